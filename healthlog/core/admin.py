@@ -1,11 +1,17 @@
-from django.contrib import admin
+import io
+
+from django.contrib import admin, messages
 from django.contrib.admin import AdminSite
 from django.contrib.auth.models import Group
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseRedirect, StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from django.utils.translation import gettext_lazy as _
 
-from . import models
-from .forms import UserChangeForm, UserCreationForm
+from . import catalog, export, models, routers
+from .forms import FoodImportForm, UserChangeForm, UserCreationForm
 
 
 class CustomAdminSite(AdminSite):
@@ -13,6 +19,24 @@ class CustomAdminSite(AdminSite):
     site_title = _('Health Log Administration')
 
 
+class ReplicaChangeListMixin:
+    """Reads the lists of objects from a read replica.
+
+    Only plain views of the list are, actions and edits posted from the
+    list are run against the primary database.
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with routers.replica_reads():
+            return super().changelist_view(request, extra_context)
+
+
+class ModelAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
+    pass
+
+
 class ConditionInlineAdmin(admin.TabularInline):
     model = models.User.conditions.through
     extra = 1
@@ -23,7 +47,7 @@ class AilmentInlineAdmin(admin.TabularInline):
     extra = 1
 
 
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(ReplicaChangeListMixin, BaseUserAdmin):
     # The forms to add and change user instances
     form = UserChangeForm
     add_form = UserCreationForm
@@ -55,34 +79,111 @@ class UserAdmin(BaseUserAdmin):
     inlines = (ConditionInlineAdmin,)
 
 
-class InfoAdmin(admin.ModelAdmin):
+class InfoAdmin(ModelAdmin):
     model = models.Info
     list_display = ('user', 'birth_date', 'weight', 'height')
     search_fields = ('user',)
 
 
-class FoodAdmin(admin.ModelAdmin):
+class FoodAdmin(ModelAdmin):
     model = models.Food
     list_display = ('name', 'calories', 'carbohydrates', 'protein', 'fats')
     search_fields = ('name',)
     ordering = ('name',)
-
-
-class LogAdmin(admin.ModelAdmin):
+    actions = ('export_csv', 'export_json')
+    change_list_template = 'admin/core/food/change_list.html'
+
+    def get_urls(self):
+        return [
+            path(
+                'import/', self.admin_site.admin_view(self.import_view),
+                name='core_food_import',
+            ),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """Imports the foods of an uploaded catalog file."""
+        if not (
+            self.has_add_permission(request)
+            and self.has_change_permission(request)
+        ):
+            raise PermissionDenied
+        form = FoodImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            output = (
+                form.cleaned_data['format']
+                or catalog.guess_format(upload.name)
+            )
+            importer = catalog.Importer(dry_run=form.cleaned_data['dry_run'])
+            file = io.TextIOWrapper(
+                upload.file, encoding='utf-8-sig', newline='',
+            )
+            try:
+                importer.run(catalog.read(file, output))
+            except (catalog.CatalogError, UnicodeDecodeError) as error:
+                self.message_user(
+                    request, f'{error} after {importer.rows} rows',
+                    messages.ERROR,
+                )
+            else:
+                for number, errors in importer.errors:
+                    details = '; '.join(
+                        f'{field}: {" ".join(field_errors)}'
+                        for field, field_errors in errors.items()
+                    )
+                    self.message_user(
+                        request, f'Row {number}: {details}', messages.WARNING,
+                    )
+                self.message_user(request, (
+                    'Checked %s' if importer.dry_run else 'Imported %s'
+                ) % importer.summary(), messages.SUCCESS)
+                return HttpResponseRedirect(
+                    reverse('admin:core_food_changelist'),
+                )
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Import foods', form=form, opts=self.model._meta,
+        )
+        return TemplateResponse(
+            request, 'admin/core/food/import.html', context,
+        )
+
+    def export_csv(self, request, queryset):
+        return self._export(queryset, catalog.CSV)
+    export_csv.short_description = 'Export selected foods as CSV'
+
+    def export_json(self, request, queryset):
+        return self._export(queryset, catalog.JSON)
+    export_json.short_description = 'Export selected foods as JSON'
+
+    def _export(self, queryset, output: str) -> StreamingHttpResponse:
+        response = StreamingHttpResponse(
+            export.buffered(catalog.export_lines(queryset, output)),
+            content_type=catalog.CONTENT_TYPES[output],
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="foods.{output}"'
+        )
+        return response
+
+
+class LogAdmin(ModelAdmin):
     model = models.Log
-    list_display = ('date', 'user')
+    list_display = ('date', 'user', 'calories')
+    readonly_fields = ('calories', 'carbohydrates', 'proteins', 'fats')
     search_fields = ('user',)
     ordering = ('-date',)
 
 
-class MealAdmin(admin.ModelAdmin):
+class MealAdmin(ModelAdmin):
     model = models.Meal
     list_display = ('log', 'time', 'food')
     search_fields = ('log', 'food',)
     list_filter = ('time',)
 
 
-class TicketAdmin(admin.ModelAdmin):
+class TicketAdmin(ModelAdmin):
     model = models.Ticket
     list_display = ('created_on', 'user')
     search_fields = ('message',)
@@ -90,10 +191,10 @@ class TicketAdmin(admin.ModelAdmin):
 
 site = CustomAdminSite()
 site.register(models.User, UserAdmin)
-site.register(models.Condition)
+site.register(models.Condition, ModelAdmin)
 site.register(models.Info, InfoAdmin)
 site.register(models.Food, FoodAdmin)
-site.register(models.Ailment)
+site.register(models.Ailment, ModelAdmin)
 site.register(models.Log, LogAdmin)
 site.register(models.Meal, MealAdmin)
 site.register(models.Ticket, TicketAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'healthlog.core'
+
+    def ready(self):
+        # Connects the signal receivers.
+        from . import signals  # noqa: F401
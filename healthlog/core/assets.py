@@ -0,0 +1,366 @@
+import hashlib
+import mimetypes
+import os
+import posixpath
+import threading
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .storage import encodings
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+
+class Variant(NamedTuple):
+    """File served for a static file in one content encoding.
+
+    Attributes:
+        path: Full path of the file.
+        size: Size of the file in bytes.
+        etag: Entity tag of the file.
+        data: Content of the file when it's kept in memory.
+    """
+    path: str
+    size: int
+    etag: str
+    data: Optional[bytes] = None
+
+
+class Asset(NamedTuple):
+    """Everything needed to answer requests for a static file.
+
+    Attributes:
+        content_type: Content type of the uncompressed file.
+        modified: Modification time of the file as a timestamp.
+        variants: Files indexed by their content encoding, with the
+            uncompressed file under an empty encoding.
+        immutable: If the name of the file contains the hash of its
+            content.
+    """
+    content_type: str
+    modified: int
+    variants: Dict[str, Variant]
+    immutable: bool
+
+
+class AssetIndex:
+    """Details and content of the collected static files.
+
+    Each file is looked up once per process, either when the index is
+    preloaded at startup or on its first request. The collected files
+    don't change while the server runs, so later requests, and
+    conditional requests in particular, are answered from memory.
+
+    Attributes:
+        root: Directory the static files were collected to.
+        max_size: Number of bytes of file content the index may keep in
+            memory. Files that don't fit are read from disk.
+        size: Number of bytes of file content kept in memory.
+    """
+    def __init__(self, root: str, max_size: int = 0):
+        self.root = root
+        self.max_size = max_size
+        self.size = 0
+        self._assets: Dict[str, Asset] = {}
+        self._hashed: Optional[Set[str]] = None
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[Asset]:
+        """Looks up a static file.
+
+        Args:
+            path: Path of the file relative to the root.
+
+        Returns:
+            The file's details, or None if it doesn't exist.
+        """
+        try:
+            return self._assets[path]
+        except KeyError:
+            pass
+        asset = self._load(path)
+        # Missing files aren't remembered so that arbitrary paths can't
+        # grow the index.
+        if asset is None:
+            return None
+        with self._lock:
+            if path in self._assets:
+                # Another thread loaded the file first.
+                self.size -= sum(
+                    variant.size for variant in asset.variants.values()
+                    if variant.data is not None
+                )
+                return self._assets[path]
+            self._assets[path] = asset
+        return asset
+
+    def hashed_names(self) -> Set[str]:
+        if self._hashed is None:
+            hashed_files = getattr(staticfiles_storage, 'hashed_files', {})
+            self._hashed = set(hashed_files.values())
+        return self._hashed
+
+    def preload(self):
+        """Looks up every collected file ahead of the first request."""
+        suffixes = tuple(suffix for _, suffix, _ in encodings())
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                # Variants are loaded along with their file.
+                if name.endswith(suffixes):
+                    continue
+                full_path = os.path.join(directory, name)
+                path = os.path.relpath(full_path, self.root)
+                self.get(path.replace(os.sep, '/'))
+
+    def clear(self):
+        with self._lock:
+            self._assets.clear()
+            self._hashed = None
+            self.size = 0
+
+    def _reserve(self, size: int) -> bool:
+        """Claims room for a file's content within the maximum size."""
+        with self._lock:
+            if self.size + size > self.max_size:
+                return False
+            self.size += size
+            return True
+
+    def _load(self, path: str) -> Optional[Asset]:
+        try:
+            full_path = safe_join(self.root, path)
+        except (SuspiciousFileOperation, ValueError):
+            return None
+        if not os.path.isfile(full_path):
+            return None
+        content_type, _ = mimetypes.guess_type(full_path)
+        variants = {}
+        for encoding, suffix in [('', '')] + [
+            (encoding, suffix) for encoding, suffix, _ in encodings()
+        ]:
+            variant_path = full_path + suffix
+            if not os.path.isfile(variant_path):
+                continue
+            size = os.path.getsize(variant_path)
+            data = None
+            digest = hashlib.md5()
+            with open(variant_path, 'rb') as variant_file:
+                if self._reserve(size):
+                    data = variant_file.read()
+                    digest.update(data)
+                else:
+                    for chunk in iter(lambda: variant_file.read(65536), b''):
+                        digest.update(chunk)
+            etag = digest.hexdigest()
+            variants[encoding] = Variant(
+                variant_path, size,
+                f'"{etag}-{encoding}"' if encoding else f'"{etag}"', data,
+            )
+        return Asset(
+            content_type or 'application/octet-stream',
+            int(os.path.getmtime(full_path)), variants,
+            path in self.hashed_names(),
+        )
+
+
+def accepted_encodings(header: str) -> Set[str]:
+    """Content encodings accepted by a client.
+
+    Args:
+        header: Value of the Accept-Encoding header.
+
+    Returns:
+        Encodings with a quality above zero. ``*`` stands for any
+        encoding that isn't listed.
+    """
+    accepted = set()
+    rejected = set()
+    for item in header.split(','):
+        encoding, _, params = item.strip().partition(';')
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        (accepted if quality > 0 else rejected).add(encoding)
+    if '*' in accepted:
+        accepted |= {encoding for encoding, _, _ in encodings()} - rejected
+    return accepted
+
+
+def choose_variant(asset: Asset, header: str) -> Tuple[str, Variant]:
+    """Picks the preferred variant of a file the client accepts.
+
+    Returns:
+        The content encoding and the variant. The encoding is empty for
+        the uncompressed file.
+    """
+    accepted = accepted_encodings(header)
+    for encoding, _, _ in encodings():
+        if encoding in accepted and encoding in asset.variants:
+            return encoding, asset.variants[encoding]
+    return '', asset.variants['']
+
+
+def not_modified(request, asset: Asset, variant: Variant) -> bool:
+    """If the client's copy of the file is still current."""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = {etag.strip() for etag in if_none_match.split(',')}
+        weak = {etag[2:] for etag in etags if etag.startswith('W/')}
+        return bool({variant.etag, '*'} & (etags | weak))
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''),
+    )
+    return (
+        if_modified_since is not None
+        and asset.modified <= if_modified_since
+    )
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def requested_range(
+    request, asset: Asset, variant: Variant,
+) -> Optional[Tuple[int, int]]:
+    """Byte range the client asked for.
+
+    Only single ranges are supported, the whole file is sent for
+    anything else.
+
+    Returns:
+        First and last byte of the range, or None for the whole file.
+
+    Raises:
+        RangeNotSatisfiable: The range starts after the end of the file.
+    """
+    header = request.META.get('HTTP_RANGE', '')
+    if not header.startswith('bytes=') or ',' in header:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is not None and if_range not in (
+        variant.etag, http_date(asset.modified),
+    ):
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if not first:
+            # Suffix ranges ask for the last bytes of the file.
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(variant.size - length, 0), variant.size - 1
+        first = int(first)
+        last = int(last) if last else variant.size - 1
+    except ValueError:
+        return None
+    if first >= variant.size:
+        raise RangeNotSatisfiable()
+    if first > last:
+        return None
+    return first, min(last, variant.size - 1)
+
+
+def _read_range(path: str, first: int, last: int, block_size: int = 65536):
+    with open(path, 'rb') as variant_file:
+        variant_file.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = variant_file.read(min(block_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(variant: Variant, content_type: str, byte_range=None):
+    """Response with the content of a variant, or a range of it.
+
+    Content kept in memory is handed to the server as is, without being
+    copied. Other files are streamed with the server's
+    ``wsgi.file_wrapper`` when possible.
+    """
+    if byte_range is None:
+        if variant.data is not None:
+            response = HttpResponse(variant.data, content_type=content_type)
+        else:
+            response = FileResponse(
+                open(variant.path, 'rb'), content_type=content_type,
+            )
+        response['Content-Length'] = variant.size
+        return response
+    first, last = byte_range
+    if variant.data is not None:
+        # WSGI servers only accept bytes, so the slice is copied once.
+        response = HttpResponse(
+            bytes(memoryview(variant.data)[first:last + 1]),
+            content_type=content_type, status=206,
+        )
+    else:
+        response = StreamingHttpResponse(
+            _read_range(variant.path, first, last),
+            content_type=content_type, status=206,
+        )
+    response['Content-Length'] = last - first + 1
+    response['Content-Range'] = f'bytes {first}-{last}/{variant.size}'
+    return response
+
+
+index = AssetIndex(settings.STATIC_ROOT, settings.STATIC_CACHE_SIZE)
+
+
+@require_safe
+def serve(request, path):
+    """Serves a collected static file.
+
+    Precompressed variants are served to clients that accept their
+    encoding. Fingerprinted files are cached for a year, others have to
+    be revalidated, which is answered from memory. Single byte ranges
+    are supported.
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    asset = index.get(path)
+    if asset is None:
+        raise Http404(f'"{path}" does not exist')
+    encoding, variant = choose_variant(
+        asset, request.META.get('HTTP_ACCEPT_ENCODING', ''),
+    )
+
+    if not_modified(request, asset, variant):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            byte_range = requested_range(request, asset, variant)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{variant.size}'
+            return response
+        response = file_response(variant, asset.content_type, byte_range)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = variant.etag
+    response['Last-Modified'] = http_date(asset.modified)
+    response['Cache-Control'] = IMMUTABLE if asset.immutable else REVALIDATE
+    if len(asset.variants) > 1:
+        response['Vary'] = 'Accept-Encoding'
+    return response
@@ -0,0 +1,196 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from . import metrics
+
+
+class TokenCache:
+    """Bounded least recently used cache of authenticated tokens.
+
+    Only the column values of the token and its user are stored, fresh
+    model instances are built for each request so that requests never
+    share mutable objects.
+
+    Attributes:
+        max_size: Maximum number of tokens to keep.
+        ttl: Seconds an entry is trusted before the database is checked
+            again.
+        hits: Number of lookups answered by the cache.
+        misses: Number of lookups that had to go to the database.
+        evictions: Number of entries dropped to stay within the size.
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._keys: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple]:
+        """Looks up the user and token of a token key.
+
+        Args:
+            key: Token key sent by the client.
+
+        Returns:
+            Tuple of the user and token, or None if they aren't cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        _, _, user_model, user_values, token_values = entry
+        user = _build(user_model, user_values)
+        token = _build(Token, token_values)
+        token.user = user
+        return user, token
+
+    def set(self, user, token: Token):
+        """Caches the user of a token.
+
+        Args:
+            user: User the token belongs to.
+            token: Token that was authenticated.
+        """
+        if self.max_size <= 0:
+            return
+        entry = (
+            time.monotonic() + self.ttl, user.pk, type(user),
+            _values(user), _values(token),
+        )
+        with self._lock:
+            self._remove(token.key)
+            self._entries[token.key] = entry
+            self._keys[user.pk] = token.key
+            while len(self._entries) > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._keys.pop(evicted[1], None)
+                self.evictions += 1
+
+    def discard_key(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def discard_user(self, user_id: int):
+        with self._lock:
+            key = self._keys.get(user_id)
+            if key is not None:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """Counters of how well the cache is doing.
+
+        Returns:
+            Dictionary of the hits, misses, evictions, current size and
+            hit rate of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._keys.pop(entry[1], None)
+
+
+def _values(instance) -> Tuple[Tuple[str, ...], Dict]:
+    """Column values of a model instance."""
+    fields = tuple(field.attname for field in instance._meta.concrete_fields)
+    return fields, {name: getattr(instance, name) for name in fields}
+
+
+def _build(model, values: Tuple[Tuple[str, ...], Dict]):
+    """Builds a model instance from the values returned by ``_values``."""
+    fields, data = values
+    return model.from_db('default', fields, [data[name] for name in fields])
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+def invalidate_user(user_id: int):
+    """Drops the cached token of a user.
+
+    The entry is dropped again once the current transaction commits so a
+    request running alongside the write can't cache the old row.
+
+    Args:
+        user_id: ID of the user that changed.
+    """
+    token_cache.discard_user(user_id)
+    transaction.on_commit(lambda: token_cache.discard_user(user_id))
+
+
+def invalidate_token(key: str):
+    """Drops a cached token, now and once the transaction commits.
+
+    Args:
+        key: Key of the token that changed.
+    """
+    token_cache.discard_key(key)
+    transaction.on_commit(lambda: token_cache.discard_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication that remembers recently used tokens.
+
+    Falls back to the database on a cache miss. Cached entries are
+    dropped whenever the token or its user are saved or deleted.
+    """
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(user, token)
+        return user, token
+
+
+def render() -> str:
+    """Stats of the token cache in the Prometheus text exposition format."""
+    stats = token_cache.stats()
+    lines = []
+    for name, kind, description, field in (
+        ('token_cache_hits_total', 'counter',
+         'Token lookups answered by the cache.', 'hits'),
+        ('token_cache_misses_total', 'counter',
+         'Token lookups that went to the database.', 'misses'),
+        ('token_cache_evictions_total', 'counter',
+         'Tokens dropped to stay within the cache size.', 'evictions'),
+        ('token_cache_size', 'gauge', 'Tokens in the cache.', 'size'),
+    ):
+        metric = f'healthlog_{name}'
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} {kind}')
+        lines.append(f'{metric} {stats[field]}')
+    return '\n'.join(lines) + '\n'
+
+
+metrics.registry.collectors.append(render)
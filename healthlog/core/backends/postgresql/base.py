@@ -0,0 +1,93 @@
+from django.conf import settings
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from healthlog.core import pool
+
+Database = base.Database
+
+
+def _connect(conn_params: dict, options: dict):
+    connection = Database.connect(**conn_params)
+    isolation_level = options.get('isolation_level')
+    if (
+        isolation_level is not None
+        and isolation_level != connection.isolation_level
+    ):
+        connection.set_session(isolation_level=isolation_level)
+    return connection
+
+
+def _check(connection) -> bool:
+    if connection.closed:
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if (
+            connection.get_transaction_status()
+            != extensions.TRANSACTION_STATUS_IDLE
+        ):
+            connection.rollback()
+    except Database.Error:
+        return False
+    return True
+
+
+def _reset(connection) -> bool:
+    if connection.closed:
+        return False
+    status = connection.get_transaction_status()
+    if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != extensions.TRANSACTION_STATUS_IDLE:
+        # Whatever the previous user left unfinished is dropped.
+        try:
+            connection.rollback()
+        except Database.Error:
+            return False
+    return True
+
+
+def _close(connection):
+    connection.close()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL database wrapper that borrows connections from a pool.
+
+    Django still opens and closes a connection around every request, but
+    opening checks one out of the process' pool and closing returns it,
+    so the connection, its TLS session and its authentication are reused
+    by the following requests.
+    """
+    def get_pool(self) -> pool.ConnectionPool:
+        def create():
+            conn_params = self.get_connection_params()
+            options = self.settings_dict['OPTIONS']
+            return pool.ConnectionPool(
+                connect=lambda: _connect(conn_params, options),
+                check=_check, reset=_reset, close=_close,
+                max_size=pool.pool_size(settings.DB_POOL_SIZE),
+                timeout=settings.DB_POOL_TIMEOUT,
+                max_lifetime=settings.DB_POOL_MAX_LIFETIME,
+                max_idle=settings.DB_POOL_MAX_IDLE,
+                check_interval=settings.DB_POOL_CHECK_INTERVAL,
+            )
+
+        return pool.get_pool(self.alias, create)
+
+    def get_new_connection(self, conn_params):
+        try:
+            connection = self.get_pool().checkout()
+        except pool.PoolTimeout as error:
+            raise Database.OperationalError(str(error)) from error
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level,
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.get_pool().checkin(self.connection)
@@ -0,0 +1,102 @@
+import hashlib
+import uuid
+from typing import Any, Callable, Iterable
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import routers
+
+# Groups of cached responses that are invalidated together.
+CONDITIONS = 'conditions'
+AILMENTS = 'ailments'
+FOODS = 'foods'
+
+
+def _cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def _version_key(namespace: str) -> str:
+    return f'healthlog:version:{namespace}'
+
+
+def user_namespace(user_id: int) -> str:
+    return f'user:{user_id}'
+
+
+def versions(namespaces: Iterable[str]) -> str:
+    """Current version of each namespace joined together.
+
+    Namespaces are never bumped in place, their version is replaced by a
+    new random value instead. Entries stored under an old version are
+    never read again and expire on their own, which works the same for
+    every cache backend without having to list or delete keys.
+
+    Args:
+        namespaces: Namespaces the cached value depends on.
+
+    Returns:
+        String that changes whenever any of the namespaces is
+        invalidated.
+    """
+    namespaces = list(namespaces)
+    keys = [_version_key(namespace) for namespace in namespaces]
+    found = _cache().get_many(keys)
+    result = []
+    for key in keys:
+        version = found.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            # Another process may have picked a version first.
+            if not _cache().add(key, version, None):
+                version = _cache().get(key) or version
+        result.append(version)
+    return ':'.join(result)
+
+
+def invalidate(namespace: str):
+    """Drops every cached value that depends on the namespace.
+
+    The namespace is invalidated again once the current transaction
+    commits so a request running alongside the write can't cache the
+    old rows.
+
+    Args:
+        namespace: Namespace that changed.
+    """
+    def replace():
+        _cache().set(_version_key(namespace), uuid.uuid4().hex, None)
+
+    replace()
+    transaction.on_commit(replace)
+
+
+def cached(
+    name: str, namespaces: Iterable[str], compute: Callable[[], Any],
+) -> Any:
+    """Gets a value from the cache or computes and stores it.
+
+    Args:
+        name: Key of the value within its namespaces.
+        namespaces: Namespaces that invalidate the value.
+        compute: Function that computes the value when it isn't cached.
+            Nothing is stored when it returns None. It always reads from
+            the primary database, since a lagging replica would store
+            rows older than the last invalidation under the new version.
+
+    Returns:
+        Cached or freshly computed value.
+    """
+    digest = hashlib.sha1(
+        f'{versions(namespaces)}:{name}'.encode('utf-8'),
+    ).hexdigest()
+    key = f'healthlog:value:{digest}'
+    value = _cache().get(key)
+    if value is None:
+        with routers.primary_reads():
+            value = compute()
+        if value is not None:
+            _cache().set(key, value)
+    return value
@@ -0,0 +1,293 @@
+import csv
+import json
+import os
+import time
+from typing import (
+    IO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple,
+)
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models.functions import Upper
+
+from . import caching, models
+from .export import Echo
+
+CSV = 'csv'
+JSON = 'json'
+NDJSON = 'ndjson'
+FORMATS = (CSV, JSON, NDJSON)
+FORMAT_CHOICES = ((CSV, 'CSV'), (JSON, 'JSON'), (NDJSON, 'NDJSON'))
+CONTENT_TYPES = {
+    CSV: 'text/csv; charset=utf-8',
+    JSON: 'application/json',
+    NDJSON: 'application/x-ndjson',
+}
+
+FIELDS = ('name', 'calories', 'carbohydrates', 'protein', 'fats')
+NUTRIENTS = FIELDS[1:]
+# Foods validated and written at a time.
+BATCH_SIZE = 1000
+# Characters of JSON read at a time.
+READ_SIZE = 64 * 1024
+# Characters a single JSON value may span, so that a broken file isn't
+# read whole looking for its end.
+MAX_VALUE_SIZE = 1024 * 1024
+
+
+class CatalogError(Exception):
+    pass
+
+
+def guess_format(filename: str, default: str = CSV) -> str:
+    """Format of a catalog file from its extension."""
+    extension = os.path.splitext(filename)[1].lstrip('.').lower()
+    return extension if extension in FORMATS else default
+
+
+def normalize_name(name: str) -> str:
+    """Name of a food with its whitespace collapsed."""
+    return ' '.join(name.split())
+
+
+def name_key(name: str) -> str:
+    """Key that tells foods with the same name apart from the others."""
+    return normalize_name(name).upper()
+
+
+def read_json(file: IO[str], read_size: int = READ_SIZE) -> Iterator:
+    """Values of a JSON array or of JSON lines, read a chunk at a time.
+
+    Raises:
+        CatalogError: The file isn't valid JSON.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+            position += 1
+        if position == len(buffer):
+            buffer = file.read(read_size)
+            position = 0
+            if not buffer:
+                return
+            continue
+        try:
+            value, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as error:
+            # The value could continue in the next chunk.
+            chunk = file.read(read_size)
+            if not chunk or len(buffer) - position > MAX_VALUE_SIZE:
+                raise CatalogError(f'Invalid JSON: {error}') from error
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield value
+
+
+def read(file: IO[str], output: str) -> Iterator:
+    """Rows of a catalog file as they're read."""
+    if output == CSV:
+        return csv.DictReader(file)
+    return read_json(file)
+
+
+def clean(row) -> Dict:
+    """Validates a row of a catalog file with the fields of the model.
+
+    Returns:
+        Values of the food fields.
+
+    Raises:
+        ValidationError: The row isn't a valid food.
+    """
+    if not isinstance(row, dict):
+        raise ValidationError('Expected an object with the food fields.')
+    data = {}
+    errors = {}
+    for name in FIELDS:
+        value = row.get(name)
+        if isinstance(value, str):
+            value = value.strip()
+        try:
+            data[name] = models.Food._meta.get_field(name).clean(value, None)
+        except ValidationError as error:
+            errors[name] = error.messages
+    if errors:
+        raise ValidationError(errors)
+    data['name'] = normalize_name(data['name'])
+    return data
+
+
+class Importer:
+    """Adds and updates the foods of a catalog in batches.
+
+    Rows are validated a batch at a time and the foods of a batch are
+    matched with the existing ones on their normalized name, with a
+    single query. Stored names are normalized when foods are saved, so
+    the match only has to upper case them. New foods are inserted with
+    ``bulk_create`` and the changed ones are saved with ``bulk_update``.
+    Rows repeating the name of a previous row update the same food, so
+    the catalog holds each name once. Only a batch is held in memory at
+    a time.
+
+    Attributes:
+        batch_size: Number of rows written at a time.
+        dry_run: If the changes are rolled back.
+        progress: Called with the importer after every batch.
+        rows: Number of rows read.
+        created: Number of foods added.
+        updated: Number of foods changed.
+        unchanged: Number of foods that were already up to date.
+        duplicates: Number of rows repeating a name within their batch.
+        invalid: Number of rows that failed validation.
+        errors: Number and errors of the first invalid rows.
+        seconds: Time spent importing.
+    """
+    max_errors = 20
+
+    def __init__(
+        self, batch_size: int = BATCH_SIZE, dry_run: bool = False,
+        progress: Optional[Callable[['Importer'], None]] = None,
+    ):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.progress = progress
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors: List[Tuple[int, Dict[str, List[str]]]] = []
+        self.seconds = 0.0
+
+    @property
+    def rate(self) -> float:
+        """Rows imported per second."""
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (
+            f'{self.rows} rows: {self.created} created, {self.updated} '
+            f'updated, {self.unchanged} unchanged, {self.duplicates} '
+            f'duplicates, {self.invalid} invalid '
+            f'({self.seconds:.3f}s, {self.rate:.0f} rows/s)'
+        )
+
+    def run(self, rows: Iterable) -> 'Importer':
+        """Imports rows read from a catalog file.
+
+        Raises:
+            CatalogError: The file couldn't be read.
+        """
+        start = time.monotonic()
+        batch = []
+        try:
+            for row in rows:
+                self.rows += 1
+                batch.append((self.rows, row))
+                if len(batch) >= self.batch_size:
+                    self.load(batch)
+                    batch = []
+                    self.seconds = time.monotonic() - start
+                    if self.progress is not None:
+                        self.progress(self)
+            if batch:
+                self.load(batch)
+        except csv.Error as error:
+            raise CatalogError(f'Invalid CSV: {error}') from error
+        finally:
+            self.seconds = time.monotonic() - start
+            if (self.created or self.updated) and not self.dry_run:
+                # Saving foods one at a time does the same from signals.
+                # It also has the food index of every process rebuilt.
+                caching.invalidate(caching.FOODS)
+        return self
+
+    def load(self, batch: List[Tuple[int, object]]):
+        """Validates a batch of rows and writes their foods."""
+        foods: Dict[str, Dict] = {}
+        for number, row in batch:
+            try:
+                data = clean(row)
+            except ValidationError as error:
+                self.invalid += 1
+                if len(self.errors) < self.max_errors:
+                    self.errors.append((number, getattr(
+                        error, 'message_dict', {'__all__': error.messages},
+                    )))
+                continue
+            key = name_key(data['name'])
+            if key in foods:
+                self.duplicates += 1
+            foods[key] = data
+        if not foods:
+            return
+
+        with transaction.atomic():
+            existing = {}
+            matches = models.Food.objects.annotate(
+                key=Upper('name'),
+            ).filter(key__in=list(foods)).order_by('-pk')
+            for food in matches:
+                # The oldest food of a name is the one kept up to date.
+                existing[name_key(food.name)] = food
+
+            created = []
+            updated = []
+            repriced = []
+            for key, data in foods.items():
+                food = existing.get(key)
+                if food is None:
+                    created.append(models.Food(**data))
+                    continue
+                changed = [
+                    field for field in FIELDS
+                    if getattr(food, field) != data[field]
+                ]
+                if not changed:
+                    self.unchanged += 1
+                    continue
+                for field in changed:
+                    setattr(food, field, data[field])
+                updated.append(food)
+                if set(changed) & set(NUTRIENTS):
+                    repriced.append(food.pk)
+
+            models.Food.objects.bulk_create(created)
+            models.Food.objects.bulk_update(updated, FIELDS)
+            if repriced:
+                models.Log.objects.filter(pk__in=models.Meal.objects.filter(
+                    food__in=repriced,
+                ).values('log')).update_totals()
+            self.created += len(created)
+            self.updated += len(updated)
+            if self.dry_run:
+                transaction.set_rollback(True)
+
+
+def export_lines(foods, output: str = CSV) -> Iterator[str]:
+    """Lines of a catalog file holding the foods of a queryset.
+
+    The foods are read with a server-side cursor in a transaction, so
+    the catalog is never held in memory.
+    """
+    with transaction.atomic(using=foods.db):
+        rows = foods.order_by('pk').values_list(*FIELDS).iterator(BATCH_SIZE)
+        if output == CSV:
+            writer = csv.writer(Echo())
+            yield writer.writerow(FIELDS)
+            for row in rows:
+                yield writer.writerow(row)
+        elif output == NDJSON:
+            for row in rows:
+                yield json.dumps(dict(zip(FIELDS, row))) + '\n'
+        else:
+            yield '['
+            separator = '\n'
+            for row in rows:
+                yield separator + json.dumps(dict(zip(FIELDS, row)))
+                separator = ',\n'
+            yield '\n]\n'
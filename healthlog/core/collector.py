@@ -1,8 +1,15 @@
 import os
+import hashlib
+import json
 import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+from django.conf import settings
 from django.contrib.staticfiles.finders import get_finders
 from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.base import ContentFile
 from django.core.files.storage import FileSystemStorage
 
 logger = logging.getLogger(__name__)
@@ -16,16 +23,31 @@ class Collector:
     """
     Copies or symlinks static files from different locations to the
     settings.STATIC_ROOT.
+
+    In incremental mode a manifest with the content hash of every
+    collected file is written to the destination. Later runs compare the
+    hashes of the source files against it and skip the files, or the
+    whole collection, that haven't changed without looking at the
+    modification times of the destination.
+
+    With more than one worker, files are hashed, copied, linked and
+    deleted on a pool of threads. Which file is collected for each
+    destination is still decided up front in finder order.
     """
+    manifest_name = 'collector-manifest.json'
+    manifest_version = 1
 
     def __init__(
         self, symlink: bool = False, clear: bool = False,
         dry_run: bool = False, post_process: bool = True,
+        incremental: bool = True, workers: int = 1,
     ):
         self.symlink = symlink
         self.clear = clear
         self.dry_run = dry_run
         self.post_process = post_process
+        self.incremental = incremental
+        self.workers = workers
         self.ignore_patterns = []
         self.copied_files = []
         self.symlinked_files = []
@@ -57,26 +79,47 @@ class Collector:
         else:
             handler = self.copy_file
 
-        found_files = {}
-        for finder in get_finders():
-            for path, storage in finder.list(self.ignore_patterns):
-                # Prefix the relative path if the source storage contains it
-                if getattr(storage, 'prefix', None):
-                    prefixed_path = os.path.join(storage.prefix, path)
-                else:
-                    prefixed_path = path
+        found_files = self.find_files()
+        hashes = self.hash_files(found_files) if self.incremental else {}
+        manifest = (
+            self.read_manifest()
+            if self.incremental and not self.clear else {}
+        )
 
-                if prefixed_path not in found_files:
-                    found_files[prefixed_path] = (storage, path)
-                    handler(path, prefixed_path, storage)
-                else:
-                    logger.warning(
-                        "Found another file with the destination path '%s'. "
-                        "It will be ignored since only the first encountered "
-                        "file is collected. If this is not what you want, "
-                        "make sure every static file has a unique path.",
-                        prefixed_path,
-                    )
+        if hashes and hashes == manifest:
+            logger.debug('Static files unchanged since the last collection')
+            self.unmodified_files.extend(found_files)
+            return self.collected()
+
+        def collect_file(prefixed_path, storage, path):
+            source_hash = hashes.get(prefixed_path)
+            unchanged = (
+                source_hash is not None
+                and manifest.get(prefixed_path) == source_hash
+                and self.storage.exists(prefixed_path)
+            )
+            if unchanged:
+                logger.debug("Skipping '%s' (same content hash)", path)
+                self.unmodified_files.append(prefixed_path)
+                return True
+            # A new or changed hash replaces the target whatever its
+            # modification time, which is only compared without a hash.
+            return handler(
+                path, prefixed_path, storage, force=source_hash is not None,
+            )
+
+        collected = self.map(collect_file, [
+            (prefixed_path, storage, path)
+            for prefixed_path, (storage, path) in found_files.items()
+        ])
+        # Only files that were copied or found unchanged are recorded, so
+        # the others are compared again next time.
+        hashes = {
+            prefixed_path: digest
+            for (prefixed_path, digest), done in zip(
+                hashes.items(), collected,
+            ) if done
+        }
 
         # Storage backends may define a post_process() method.
         if self.post_process and hasattr(self.storage, 'post_process'):
@@ -90,6 +133,7 @@ class Collector:
                     )
                     raise processed
                 if processed:
+                    self.post_processed_files.append(original_path)
                     logger.debug(
                         "Post-processed '%s' as '%s'",
                         original_path, processed_path,
@@ -97,12 +141,108 @@ class Collector:
                 else:
                     logger.debug("Skipped post-processing '%s'", original_path)
 
+        if self.incremental and not self.dry_run:
+            self.write_manifest(hashes)
+
+        return self.collected()
+
+    def collected(self):
         return {
             'modified': self.copied_files + self.symlinked_files,
             'unmodified': self.unmodified_files,
             'post_processed': self.post_processed_files,
         }
 
+    def find_files(self):
+        """
+        Find the static files to collect, indexed by their destination
+        path. Only the first file found for each destination is kept.
+        """
+        found_files = OrderedDict()
+        for finder in get_finders():
+            for path, storage in finder.list(self.ignore_patterns):
+                # Prefix the relative path if the source storage contains it
+                if getattr(storage, 'prefix', None):
+                    prefixed_path = os.path.join(storage.prefix, path)
+                else:
+                    prefixed_path = path
+
+                if prefixed_path not in found_files:
+                    found_files[prefixed_path] = (storage, path)
+                else:
+                    logger.warning(
+                        "Found another file with the destination path '%s'. "
+                        "It will be ignored since only the first encountered "
+                        "file is collected. If this is not what you want, "
+                        "make sure every static file has a unique path.",
+                        prefixed_path,
+                    )
+        return found_files
+
+    def hash_files(self, found_files):
+        """
+        Hash the content of every found file. The symlink mode and the
+        storage are part of the hash so switching either of them collects
+        and post-processes everything again.
+        """
+        mode = '%s:%s' % (
+            'symlink' if self.symlink else 'copy',
+            settings.STATICFILES_STORAGE,
+        )
+
+        def hash_file(storage, path):
+            digest = hashlib.sha256(mode.encode())
+            with storage.open(path) as source_file:
+                for chunk in source_file.chunks():
+                    digest.update(chunk)
+            return digest.hexdigest()
+
+        digests = self.map(hash_file, found_files.values())
+        return dict(zip(found_files, digests))
+
+    def map(self, func, items):
+        """
+        Call ``func`` with the arguments of each item and return the
+        results in order. The calls run on a pool of ``workers`` threads
+        when there's more than one, and the first error is raised once
+        the running calls are done.
+        """
+        if self.workers <= 1:
+            return [func(*args) for args in items]
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = [executor.submit(func, *args) for args in items]
+            try:
+                return [future.result() for future in futures]
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def read_manifest(self):
+        """
+        Read the content hashes written by the previous collection.
+        """
+        try:
+            with self.storage.open(self.manifest_name) as manifest_file:
+                manifest = json.loads(manifest_file.read().decode())
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != self.manifest_version:
+            return {}
+        return manifest.get('files', {})
+
+    def write_manifest(self, hashes):
+        """
+        Replace the manifest with the content hashes of the collected files.
+        """
+        content = json.dumps({
+            'version': self.manifest_version,
+            'files': hashes,
+        }, indent=2, sort_keys=True)
+        if self.storage.exists(self.manifest_name):
+            self.storage.delete(self.manifest_name)
+        self.storage.save(self.manifest_name, ContentFile(content.encode()))
+
     def handle(self):
         logger.info('Collecting static files')
 
@@ -129,13 +269,16 @@ class Collector:
             else:
                 logger.debug('Overwriting files at static files destination')
 
+        start = time.perf_counter()
         collected = self.collect()
+        duration = time.perf_counter() - start
         modified_count = len(collected['modified'])
         unmodified_count = len(collected['unmodified'])
         post_processed_count = len(collected['post_processed'])
         template = (
             "%(modified_count)s %(identifier)s %(action)s"
-            "%(destination)s%(unmodified)s%(post_processed)s."
+            "%(destination)s%(unmodified)s%(post_processed)s"
+            " in %(duration).2fs."
         )
         summary = template % {
             'modified_count': modified_count,
@@ -154,6 +297,7 @@ class Collector:
                 ', %s post-processed'
                 % post_processed_count or ''
             ),
+            'duration': duration,
         }
         logger.info(summary)
 
@@ -168,7 +312,8 @@ class Collector:
             return
 
         dirs, files = self.storage.listdir(path)
-        for f in files:
+
+        def delete(f):
             fpath = os.path.join(path, f)
             if self.dry_run:
                 logger.debug("Pretending to delete '%s'", fpath)
@@ -185,57 +330,71 @@ class Collector:
                         os.unlink(full_path)
                     else:
                         self.storage.delete(fpath)
+
+        self.map(delete, [(f,) for f in files])
         for d in dirs:
             self.clear_dir(os.path.join(path, d))
 
-    def delete_file(self, path, prefixed_path, source_storage):
+    def is_unmodified(self, path, prefixed_path, source_storage):
         """
-        Check if the target file should be deleted if it already exists.
+        Check if the existing target file is at least as recent as the
+        source file.
         """
-        if self.storage.exists(prefixed_path):
+        try:
+            # When was the target file modified last time?
+            target_last_modified = self.storage.get_modified_time(
+                prefixed_path,
+            )
+        except (OSError, NotImplementedError, AttributeError):
+            # The storage doesn't support get_modified_time() or failed
+            pass
+        else:
             try:
-                # When was the target file modified last time?
-                target_last_modified = self.storage.get_modified_time(
-                    prefixed_path,
+                # When was the source file modified last time?
+                source_last_modified = source_storage.get_modified_time(
+                    path,
                 )
             except (OSError, NotImplementedError, AttributeError):
-                # The storage doesn't support get_modified_time() or failed
                 pass
             else:
-                try:
-                    # When was the source file modified last time?
-                    source_last_modified = source_storage.get_modified_time(
-                        path,
+                # The full path of the target file
+                if self.local:
+                    full_path = self.storage.path(prefixed_path)
+                    # If it's --link mode and the path isn't a link (i.e.
+                    # the previous collectstatic wasn't with --link) or if
+                    # it's non-link mode and the path is a link (i.e. the
+                    # previous collectstatic was with --link), the old
+                    # links/files must be deleted so it's not safe to skip
+                    # unmodified files.
+                    can_skip_unmodified_files = not (
+                        self.symlink ^ os.path.islink(full_path)
                     )
-                except (OSError, NotImplementedError, AttributeError):
-                    pass
                 else:
-                    # The full path of the target file
-                    if self.local:
-                        full_path = self.storage.path(prefixed_path)
-                        # If it's --link mode and the path isn't a link (i.e.
-                        # the previous collectstatic wasn't with --link) or if
-                        # it's non-link mode and the path is a link (i.e. the
-                        # previous collectstatic was with --link), the old
-                        # links/files must be deleted so it's not safe to skip
-                        # unmodified files.
-                        can_skip_unmodified_files = not (
-                            self.symlink ^ os.path.islink(full_path)
-                        )
-                    else:
-                        # In remote storages, skipping is only based on the
-                        # modified times since symlinks aren't relevant.
-                        can_skip_unmodified_files = True
-                    # Avoid sub-second precision (see #14665, #19540)
-                    file_is_unmodified = (
-                        target_last_modified.replace(microsecond=0) >=
-                        source_last_modified.replace(microsecond=0)
-                    )
-                    if file_is_unmodified and can_skip_unmodified_files:
-                        if prefixed_path not in self.unmodified_files:
-                            self.unmodified_files.append(prefixed_path)
-                        logger.debug("Skipping '%s' (not modified)", path)
-                        return False
+                    # In remote storages, skipping is only based on the
+                    # modified times since symlinks aren't relevant.
+                    can_skip_unmodified_files = True
+                # Avoid sub-second precision (see #14665, #19540)
+                file_is_unmodified = (
+                    target_last_modified.replace(microsecond=0) >=
+                    source_last_modified.replace(microsecond=0)
+                )
+                return file_is_unmodified and can_skip_unmodified_files
+        return False
+
+    def delete_file(self, path, prefixed_path, source_storage, force=False):
+        """
+        Check if the target file should be deleted if it already exists.
+        With ``force`` it's replaced without comparing modification times.
+        """
+        if self.storage.exists(prefixed_path):
+            unmodified = not force and self.is_unmodified(
+                path, prefixed_path, source_storage,
+            )
+            if unmodified:
+                if prefixed_path not in self.unmodified_files:
+                    self.unmodified_files.append(prefixed_path)
+                logger.debug("Skipping '%s' (not modified)", path)
+                return False
             # Then delete the existing file if really needed
             if self.dry_run:
                 logger.info("Pretending to delete '%s'", path)
@@ -244,16 +403,18 @@ class Collector:
                 self.storage.delete(prefixed_path)
         return True
 
-    def link_file(self, path, prefixed_path, source_storage):
+    def link_file(self, path, prefixed_path, source_storage, force=False):
         """
-        Attempt to link ``path``
+        Attempt to link ``path``. Return whether the target is now
+        linked, ``force`` replaces it whatever its modification time.
         """
         # Skip this file if it was already copied earlier
         if prefixed_path in self.symlinked_files:
-            return logger.debug("Skipping '%s' (already linked earlier)", path)
+            logger.debug("Skipping '%s' (already linked earlier)", path)
+            return True
         # Delete the target file if needed or break
-        if not self.delete_file(path, prefixed_path, source_storage):
-            return
+        if not self.delete_file(path, prefixed_path, source_storage, force):
+            return False
         # The full path of the source file
         source_path = source_storage.path(path)
         # Finally link the file
@@ -283,17 +444,20 @@ class Collector:
                 raise CollectorError(e)
         if prefixed_path not in self.symlinked_files:
             self.symlinked_files.append(prefixed_path)
+        return True
 
-    def copy_file(self, path, prefixed_path, source_storage):
+    def copy_file(self, path, prefixed_path, source_storage, force=False):
         """
-        Attempt to copy ``path`` with storage
+        Attempt to copy ``path`` with storage. Return whether the target
+        is now copied, ``force`` replaces it whatever its modification time.
         """
         # Skip this file if it was already copied earlier
         if prefixed_path in self.copied_files:
-            return logger.debug("Skipping '%s' (already copied earlier)", path)
+            logger.debug("Skipping '%s' (already copied earlier)", path)
+            return True
         # Delete the target file if needed or break
-        if not self.delete_file(path, prefixed_path, source_storage):
-            return
+        if not self.delete_file(path, prefixed_path, source_storage, force):
+            return False
         # The full path of the source file
         source_path = source_storage.path(path)
         # Finally start copying
@@ -304,3 +468,4 @@ class Collector:
             with source_storage.open(path) as source_file:
                 self.storage.save(prefixed_path, source_file)
         self.copied_files.append(prefixed_path)
+        return True
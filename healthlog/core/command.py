@@ -1,10 +1,36 @@
 import os
 import logging
+import time
 
 import click
 
 logger = logging.getLogger(__name__)
 
+# Waitress adjustments that are left to waitress unless they're given.
+WAITRESS_OPTIONS = (
+    'connection_limit', 'backlog', 'channel_timeout', 'recv_bytes',
+    'send_bytes', 'asyncore_use_poll',
+)
+# Settings naming the caches whose entries every worker has to see, like
+# the versions invalidating cached responses and the analytics jobs.
+SHARED_CACHE_SETTINGS = ('RESPONSE_CACHE_ALIAS', 'ANALYTICS_CACHE_ALIAS')
+
+
+class ThreadCount(click.ParamType):
+    """Number of threads, or ``auto`` to have it computed."""
+    name = 'threads'
+
+    def convert(self, value, param, ctx):
+        if value == 'auto':
+            return value
+        try:
+            threads = int(value)
+        except (TypeError, ValueError):
+            self.fail(f'{value!r} is not a number or auto', param, ctx)
+        if threads < 1:
+            self.fail(f'{threads} is smaller than 1', param, ctx)
+        return threads
+
 
 @click.command()
 @click.option(
@@ -15,48 +41,171 @@ logger = logging.getLogger(__name__)
     '-p', '--port', default=80,
     help='Port to bind to.', envvar='HEALTH_LOG_SERVER_PORT',
 )
+@click.option(
+    '--collect-workers', default=4, type=click.IntRange(min=1),
+    help='Number of threads collecting static files.',
+    envvar='HEALTH_LOG_COLLECT_WORKERS',
+)
+@click.option(
+    '--migrate-workers', default=1, type=click.IntRange(min=1),
+    help='Number of databases migrated at the same time.',
+    envvar='HEALTH_LOG_MIGRATE_WORKERS',
+)
+@click.option(
+    '--profile-migrations', is_flag=True,
+    help='Record the duration and SQL of applied migrations.',
+    envvar='HEALTH_LOG_PROFILE_MIGRATIONS',
+)
+@click.option(
+    '-w', '--workers', default=1, type=click.IntRange(min=1),
+    help=(
+        'Number of worker processes serving requests. More than one '
+        'needs a cache shared by processes.'
+    ),
+    envvar='HEALTH_LOG_WORKERS',
+)
+@click.option(
+    '-t', '--threads', default='4', type=ThreadCount(),
+    help=(
+        'Number of threads serving requests in each worker, or auto to '
+        'size them from the CPUs and the database connection budget.'
+    ),
+    envvar='HEALTH_LOG_THREADS',
+)
+@click.option(
+    '--db-connections', type=click.IntRange(min=1),
+    help=(
+        'Database connections the server may hold, used by auto threads. '
+        'Defaults to the pool size of every worker when it is set.'
+    ),
+    envvar='HEALTH_LOG_DB_CONNECTIONS',
+)
+@click.option(
+    '--connection-limit', type=click.IntRange(min=1),
+    help='Number of connections each worker keeps open at most.',
+    envvar='HEALTH_LOG_CONNECTION_LIMIT',
+)
+@click.option(
+    '--backlog', default=1024, type=click.IntRange(min=1),
+    help='Number of connections waiting to be accepted.',
+    envvar='HEALTH_LOG_BACKLOG',
+)
+@click.option(
+    '--channel-timeout', type=click.IntRange(min=1),
+    help='Seconds an inactive connection is kept open.',
+    envvar='HEALTH_LOG_CHANNEL_TIMEOUT',
+)
+@click.option(
+    '--recv-bytes', type=click.IntRange(min=1),
+    help='Number of bytes read from a connection at a time.',
+    envvar='HEALTH_LOG_RECV_BYTES',
+)
+@click.option(
+    '--send-bytes', type=click.IntRange(min=1),
+    help='Number of bytes buffered before sending them.',
+    envvar='HEALTH_LOG_SEND_BYTES',
+)
+@click.option(
+    '--use-poll/--use-select', 'asyncore_use_poll', default=None,
+    help='Wait on connections with poll() instead of select().',
+    envvar='HEALTH_LOG_ASYNCORE_USE_POLL',
+)
+@click.option(
+    '--graceful-timeout', default=30.0, type=click.FloatRange(min=0),
+    help='Seconds workers get to finish their requests when stopped.',
+    envvar='HEALTH_LOG_GRACEFUL_TIMEOUT',
+)
 def main(**options):
     """Base command for the CLI.
 
     Args:
         **options: Arguments passed in from the CLI call.
     """
-    from waitress import serve
     from django import setup
+    from django.core.cache import caches
+    from django.core.cache.backends.locmem import LocMemCache
     from django.core.handlers.wsgi import WSGIHandler
+    from django.db import connections
 
-    from healthlog.core.navigator import Navigator
-    from healthlog.core.collector import Collector
-
+    start = time.monotonic()
     # Setup the django application registry
     os.environ['DJANGO_SETTINGS_MODULE'] = 'healthlog.core.settings'
     setup(set_prefix=False)
+    logger.info('Django setup finished in %.3fs', time.monotonic() - start)
 
     from django.conf import settings
 
-    # Check for any migrations to apply.
-    navigator = Navigator()
-    navigator.migrate()
-    navigator.close()
+    from healthlog.core import pool
+    from healthlog.core.startup import Startup
+    from healthlog.core.supervisor import (
+        Supervisor, auto_threads, bind, serve,
+    )
 
-    collector = Collector()
-    collector.handle()
-    logger.info('This is new')
-
-    if settings.DEFAULT_ADMIN_EMAIL and settings.DEFAULT_ADMIN_PASSWORD:
-        from healthlog.core.models import User
-        logger.info('Creating default admin %s', settings.DEFAULT_ADMIN_EMAIL)
-        user, created = User.objects.get_or_create(
-            email=settings.DEFAULT_ADMIN_EMAIL
+    workers = options.get('workers')
+    if workers > 1:
+        for name in SHARED_CACHE_SETTINGS:
+            if isinstance(caches[getattr(settings, name)], LocMemCache):
+                raise click.UsageError(
+                    f'{name} is a cache private to each process, so '
+                    'workers would serve responses invalidated by the '
+                    'others. Set HEALTH_LOG_CACHE_BACKEND to database or '
+                    'file to run more than one worker.',
+                )
+    threads = options.get('threads')
+    if threads == 'auto':
+        db_connections = options.get('db_connections')
+        if db_connections is None and settings.DB_POOL_SIZE:
+            # Each worker's pool holds the configured connections at most.
+            db_connections = settings.DB_POOL_SIZE * workers
+        # Analytics jobs hold connections of their own.
+        threads = auto_threads(
+            workers, db_connections,
+            reserved_connections=settings.ANALYTICS_WORKERS,
         )
-        user.set_password(settings.DEFAULT_ADMIN_PASSWORD)
-        user.is_admin = True
-        user.save()
-        logger.info('Default admin %s set', settings.DEFAULT_ADMIN_EMAIL)
+    # Every thread of a worker may hold a pooled database connection.
+    pool.default_size = threads + settings.ANALYTICS_WORKERS
 
+    # Listen right away. Connections wait in the backlog until the
+    # startup is done and the server accepts them.
     host = options.get('host')
     port = options.get('port')
-    logger.info('Starting server at http://%s:%d', host, port)
-    serve(WSGIHandler(), host=host, port=port, _quiet=True)
+    sock = bind(host, port, options.get('backlog'))
+    try:
+        Startup(
+            collect_workers=options.get('collect_workers'),
+            migrate_workers=options.get('migrate_workers'),
+            profile_migrations=options.get('profile_migrations'),
+        ).run()
+    except BaseException:
+        sock.close()
+        raise
 
+    waitress_options = {
+        name: options[name] for name in WAITRESS_OPTIONS
+        if options.get(name) is not None
+    }
+    logger.info(
+        'Starting server at http://%s:%d with %d workers of %d threads, '
+        'serving %d requests at a time',
+        host, port, workers, threads, workers * threads,
+    )
+    if waitress_options:
+        logger.info('Waitress options: %s', ', '.join(
+            f'{name}={value}' for name, value in waitress_options.items()
+        ))
+    if workers == 1:
+        serve(
+            WSGIHandler(), sock, threads,
+            graceful_timeout=options.get('graceful_timeout'),
+            **waitress_options,
+        )
+        return
 
+    # Workers open their own database connections.
+    connections.close_all()
+    pool.close_all()
+    Supervisor(
+        WSGIHandler(), sock, workers, threads=threads,
+        graceful_timeout=options.get('graceful_timeout'),
+        **waitress_options,
+    ).run()
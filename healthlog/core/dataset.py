@@ -0,0 +1,428 @@
+import io
+import math
+import multiprocessing
+import random
+import time
+from collections import Counter
+from datetime import date, timedelta
+from itertools import accumulate, count
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import caching, models, pool
+
+# Chance of each meal being recorded on a logged day.
+MEAL_CHANCES = (
+    (models.Meal.BREAKFAST, 0.85),
+    (models.Meal.LUNCH, 0.9),
+    (models.Meal.DINNER, 0.95),
+    (models.Meal.SNACK, 0.5),
+)
+# Chance of a food being eaten twice in the same meal.
+DOUBLE_SERVING_CHANCE = 0.2
+# Chance of a day with ailments having a second one.
+SECOND_AILMENT_CHANCE = 0.2
+# Ages the users are kept within.
+MIN_AGE = 13
+MAX_AGE = 100
+# First day logged by default, fixed so that datasets only depend on the
+# seed and the options.
+DEFAULT_START = date(2019, 1, 1)
+# Meals buffered before the rows are written.
+BATCH_SIZE = 100000
+# Catalog created when the database doesn't have one.
+DEFAULT_FOODS = 500
+DEFAULT_AILMENTS = (
+    'Headache', 'Nausea', 'Bloating', 'Heartburn', 'Fatigue', 'Cramps',
+    'Diarrhea', 'Dizziness', 'Rash', 'Insomnia',
+)
+DEFAULT_CONDITIONS = (
+    'Diabetes', 'Hypertension', 'Celiac Disease', 'Lactose Intolerance',
+    'Irritable Bowel Syndrome', 'Asthma', 'High Cholesterol', 'GERD',
+)
+FIRST_NAMES = (
+    'Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie',
+    'Avery', 'Quinn', 'Drew', 'Robin',
+)
+LAST_NAMES = (
+    'Smith', 'Johnson', 'Lee', 'Brown', 'Garcia', 'Miller', 'Davis',
+    'Martinez', 'Wilson', 'Anderson', 'Thomas', 'Moore',
+)
+
+# Tables in the order they're written, with the fields of their rows.
+INFOS = (models.Info, ('id', 'birth_date', 'weight', 'height'))
+USERS = (models.User, (
+    'id', 'password', 'email', 'first_name', 'last_name', 'is_active',
+    'is_admin', 'is_analyst', 'info_id',
+))
+USER_CONDITIONS = (
+    models.User.conditions.through, ('user_id', 'condition_id'),
+)
+LOGS = (models.Log, (
+    'id', 'user_id', 'date', 'calories', 'carbohydrates', 'proteins', 'fats',
+    'modified_on',
+))
+MEALS = (models.Meal, (
+    'log_id', 'user_id', 'time', 'count', 'food_id', 'modified_on',
+))
+LOG_AILMENTS = (models.Log.ailments.through, ('log_id', 'ailment_id'))
+TABLES = (INFOS, USERS, USER_CONDITIONS, LOGS, MEALS, LOG_AILMENTS)
+
+# Generator shared with the worker processes when they're forked.
+_generator: Optional['Generator'] = None
+
+
+class DatasetError(Exception):
+    pass
+
+
+class Distribution(NamedTuple):
+    """Shape of a generated dataset.
+
+    Attributes:
+        foods_per_meal: Average number of foods in a meal, at least one.
+        food_skew: Exponent of the Zipf distribution of the popularity of
+            the foods, zero to pick every food as often.
+        ailment_rate: Chance of a logged day having ailments.
+        log_rate: Chance of a user logging a day.
+        mean_age: Average age of the users.
+        age_spread: Standard deviation of the age of the users.
+        conditions_per_user: Average number of conditions of a user.
+    """
+    foods_per_meal: float = 1.5
+    food_skew: float = 1.0
+    ailment_rate: float = 0.1
+    log_rate: float = 1.0
+    mean_age: float = 40.0
+    age_spread: float = 15.0
+    conditions_per_user: float = 0.5
+
+
+def poisson(rng: random.Random, mean: float) -> int:
+    """Number drawn from a Poisson distribution with a small mean."""
+    limit = math.exp(-mean)
+    number = 0
+    product = rng.random()
+    while product > limit:
+        number += 1
+        product *= rng.random()
+    return number
+
+
+def zipf_weights(size: int, skew: float) -> List[float]:
+    """Cumulative weights of items ranked by a Zipf distribution."""
+    return list(accumulate(1 / (rank ** skew) for rank in range(1, size + 1)))
+
+
+def reserve_ids(model, block: int) -> Iterator[int]:
+    """Primary keys for rows inserted with their IDs.
+
+    On PostgreSQL the IDs are taken from the table's sequence a block at
+    a time, so other writers can still insert rows. Elsewhere they
+    follow the largest ID, and nothing else may write to the table.
+    """
+    if connection.vendor != 'postgresql':
+        last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+        yield from count(last + 1)
+        return
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                'FROM generate_series(1, %s)',
+                [model._meta.db_table, model._meta.pk.column, block],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        yield from ids
+
+
+def insert(model, fields, rows: List[tuple]):
+    """Inserts rows, with COPY on PostgreSQL and bulk_create elsewhere.
+
+    The rows hold generated values that never need to be escaped.
+    """
+    if connection.vendor != 'postgresql':
+        model.objects.bulk_create([
+            model(**dict(zip(fields, row))) for row in rows
+        ])
+        return
+    quote = connection.ops.quote_name
+    columns = ', '.join(
+        quote(model._meta.get_field(field).column) for field in fields
+    )
+    data = io.StringIO(''.join(
+        '\t'.join(map(str, row)) + '\n' for row in rows
+    ))
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN',
+            data,
+        )
+
+
+class Generator:
+    """Generates users with their daily logs for load and scale testing.
+
+    Every user gets an info, some conditions and a log for each day,
+    with meals of foods picked from the catalog by popularity and
+    sometimes ailments. Log totals are computed as the meals are
+    generated. Each user is generated from its own random generator
+    seeded with the seed and the index of the user, so a dataset only
+    depends on the seed, the options and the catalog, whichever worker
+    process generates each user. Rows are buffered and written a batch
+    at a time.
+
+    Attributes:
+        users: Number of users to generate.
+        days: Number of days each user logs.
+        seed: Seed of the random generators.
+        start: First day logged.
+        distribution: Shape of the dataset.
+        batch_size: Number of meals buffered before they're written.
+        workers: Number of processes generating users, only more than
+            one on PostgreSQL.
+        progress: Called with the generator after each batch is written.
+        counts: Number of rows written to each table indexed by its name.
+        seconds: Time spent generating.
+    """
+    def __init__(
+        self, users: int, days: int, seed: int = 0,
+        start: date = DEFAULT_START,
+        distribution: Distribution = Distribution(),
+        batch_size: int = BATCH_SIZE, workers: int = 1,
+        progress: Optional[Callable[['Generator'], None]] = None,
+    ):
+        self.users = users
+        self.days = days
+        self.seed = seed
+        self.start = start
+        self.distribution = distribution
+        self.batch_size = batch_size
+        self.workers = workers
+        self.progress = progress
+        self.counts: Counter = Counter()
+        self.seconds = 0.0
+        self._foods: List[tuple] = []
+        self._food_weights: List[float] = []
+        self._ailments: List[int] = []
+        self._ailment_weights: List[float] = []
+        self._conditions: List[int] = []
+        self._buffers: Dict[type, List[tuple]] = {}
+        self._ids: Dict[type, Iterator[int]] = {}
+        self._dates: List[date] = []
+
+    def email(self, index: int) -> str:
+        return f'synthetic-{self.seed}-{index}@example.com'
+
+    def generate(self) -> 'Generator':
+        """Generates the dataset.
+
+        Raises:
+            DatasetError: The dataset was already generated or the
+                workers aren't supported by the database.
+        """
+        start = time.monotonic()
+        if self.workers > 1 and connection.vendor != 'postgresql':
+            raise DatasetError('Workers are only supported on PostgreSQL.')
+        if models.User.objects.filter(email=self.email(0)).exists():
+            raise DatasetError(
+                f'A dataset with the seed {self.seed} already exists.',
+            )
+        self.prepare()
+
+        if self.workers <= 1:
+            self.generate_users(0, self.users)
+        else:
+            global _generator
+            _generator = self
+            step = math.ceil(self.users / self.workers)
+            ranges = [
+                (first, min(first + step, self.users))
+                for first in range(0, self.users, step)
+            ]
+            # Children can't share the connections of the parent.
+            connections.close_all()
+            pool.close_all()
+            context = multiprocessing.get_context('fork')
+            self.counts = Counter()
+            try:
+                with context.Pool(len(ranges)) as processes:
+                    for counts in processes.starmap(_generate_users, ranges):
+                        self.counts.update(counts)
+            finally:
+                _generator = None
+
+        if connection.vendor == 'postgresql':
+            # Plans shouldn't assume the tables are still empty.
+            quote = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                for model, _ in TABLES:
+                    cursor.execute(f'ANALYZE {quote(model._meta.db_table)}')
+        self.seconds = time.monotonic() - start
+        return self
+
+    def prepare(self):
+        """Loads the catalog, creating one when the database has none."""
+        rng = random.Random(f'{self.seed}:catalog')
+        if not models.Food.objects.exists():
+            models.Food.objects.bulk_create([
+                models.Food(
+                    name=f'Synthetic Food {number}',
+                    calories=rng.randint(10, 800),
+                    carbohydrates=rng.randint(0, 100),
+                    protein=rng.randint(0, 60),
+                    fats=rng.randint(0, 50),
+                )
+                for number in range(1, DEFAULT_FOODS + 1)
+            ])
+            caching.invalidate(caching.FOODS)
+        if not models.Ailment.objects.exists():
+            models.Ailment.objects.bulk_create([
+                models.Ailment(name=name) for name in DEFAULT_AILMENTS
+            ])
+            caching.invalidate(caching.AILMENTS)
+        if not models.Condition.objects.exists():
+            models.Condition.objects.bulk_create([
+                models.Condition(name=name) for name in DEFAULT_CONDITIONS
+            ])
+            caching.invalidate(caching.CONDITIONS)
+
+        # Which foods are popular is shuffled so it doesn't follow the
+        # order they were added in.
+        rng = random.Random(f'{self.seed}:popularity')
+        self._foods = list(models.Food.objects.order_by('pk').values_list(
+            'pk', 'calories', 'carbohydrates', 'protein', 'fats',
+        ))
+        rng.shuffle(self._foods)
+        self._food_weights = zipf_weights(
+            len(self._foods), self.distribution.food_skew,
+        )
+        self._ailments = list(models.Ailment.objects.order_by(
+            'pk',
+        ).values_list('pk', flat=True))
+        rng.shuffle(self._ailments)
+        self._ailment_weights = zipf_weights(len(self._ailments), 1.0)
+        self._conditions = list(models.Condition.objects.order_by(
+            'pk',
+        ).values_list('pk', flat=True))
+
+    def generate_users(self, first: int, last: int) -> Counter:
+        """Generates and writes the users with an index in a range.
+
+        Returns:
+            Number of rows this process wrote to each table.
+        """
+        self.counts = Counter()
+        self._buffers = {model: [] for model, _ in TABLES}
+        self._dates = [
+            self.start + timedelta(days=day) for day in range(self.days)
+        ]
+        self._ids = {
+            model: reserve_ids(model, self.batch_size)
+            for model in (models.Info, models.User, models.Log)
+        }
+        # A single value for everyone, it's only needed to be unusable.
+        password = make_password(None)
+        modified_on = timezone.now().isoformat()
+        for index in range(first, last):
+            self.generate_user(index, password, modified_on)
+        self.flush()
+        return self.counts
+
+    def generate_user(self, index: int, password: str, modified_on: str):
+        rng = random.Random(f'{self.seed}:{index}')
+        distribution = self.distribution
+        buffers = self._buffers
+        logs = buffers[models.Log]
+        meals = buffers[models.Meal]
+        log_ailments = buffers[models.Log.ailments.through]
+
+        info_id = next(self._ids[models.Info])
+        age = min(max(
+            rng.gauss(distribution.mean_age, distribution.age_spread),
+            MIN_AGE,
+        ), MAX_AGE)
+        buffers[models.Info].append((
+            info_id, self.start - timedelta(days=int(age * 365.25)),
+            int(min(max(rng.gauss(170, 35), 90), 400)),
+            int(min(max(rng.gauss(67, 4), 55), 84)),
+        ))
+        user_id = next(self._ids[models.User])
+        buffers[models.User].append((
+            user_id, password, self.email(index), rng.choice(FIRST_NAMES),
+            rng.choice(LAST_NAMES), True, False, False, info_id,
+        ))
+        conditions = min(
+            poisson(rng, distribution.conditions_per_user),
+            len(self._conditions),
+        )
+        for condition_id in rng.sample(self._conditions, conditions):
+            buffers[models.User.conditions.through].append(
+                (user_id, condition_id),
+            )
+
+        # Looked up once, this loop generates every row of the dataset.
+        chance = rng.random
+        choices = rng.choices
+        log_ids = self._ids[models.Log]
+        foods = self._foods
+        food_weights = self._food_weights
+        extra_foods = distribution.foods_per_meal - 1
+        for day in self._dates:
+            if chance() >= distribution.log_rate:
+                continue
+            log_id = next(log_ids)
+            calories = carbohydrates = proteins = fats = 0
+            for meal_time, meal_chance in MEAL_CHANCES:
+                if chance() >= meal_chance:
+                    continue
+                eaten = choices(
+                    foods, cum_weights=food_weights,
+                    k=1 + poisson(rng, extra_foods),
+                )
+                for food in eaten:
+                    servings = 2 if chance() < DOUBLE_SERVING_CHANCE else 1
+                    meals.append((
+                        log_id, user_id, meal_time, servings, food[0],
+                        modified_on,
+                    ))
+                    calories += servings * food[1]
+                    carbohydrates += servings * food[2]
+                    proteins += servings * food[3]
+                    fats += servings * food[4]
+            logs.append((
+                log_id, user_id, day, calories, carbohydrates, proteins, fats,
+                modified_on,
+            ))
+            if self._ailments and chance() < distribution.ailment_rate:
+                ailments = choices(
+                    self._ailments, cum_weights=self._ailment_weights,
+                    k=1 + (chance() < SECOND_AILMENT_CHANCE),
+                )
+                for ailment_id in set(ailments):
+                    log_ailments.append((log_id, ailment_id))
+            if len(meals) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Writes the buffered rows, parents first."""
+        with transaction.atomic():
+            for model, fields in TABLES:
+                rows = self._buffers[model]
+                if rows:
+                    insert(model, fields, rows)
+                    self.counts[model._meta.db_table] += len(rows)
+                    rows.clear()
+        if self.progress is not None:
+            self.progress(self)
+
+
+def _generate_users(first: int, last: int) -> Counter:
+    try:
+        return _generator.generate_users(first, last)
+    finally:
+        connections.close_all()
@@ -0,0 +1,202 @@
+import csv
+import json
+from contextlib import ExitStack
+from datetime import date
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import router, transaction
+from django.http import StreamingHttpResponse
+
+from . import models, routers
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+FORMAT_CHOICES = ((NDJSON, 'NDJSON'), (CSV, 'CSV'))
+CONTENT_TYPES = {
+    NDJSON: 'application/x-ndjson',
+    CSV: 'text/csv; charset=utf-8',
+}
+
+# Rows fetched at a time from the server-side cursors.
+CHUNK_SIZE = 2000
+# Bytes of output gathered before they're handed to the server, so the
+# response isn't written a line at a time.
+BUFFER_SIZE = 64 * 1024
+
+LOG_FIELDS = (
+    'id', 'user_id', 'date', 'calories', 'carbohydrates', 'proteins', 'fats',
+)
+MEAL_FIELDS = (
+    'meals__time', 'meals__count', 'meals__food__name',
+    'meals__food__calories', 'meals__food__carbohydrates',
+    'meals__food__protein', 'meals__food__fats',
+)
+CSV_HEADER = (
+    'log', 'user', 'date', 'calories', 'carbohydrates', 'proteins', 'fats',
+    'ailments', 'time', 'count', 'food', 'food_calories',
+    'food_carbohydrates', 'food_protein', 'food_fats',
+)
+
+
+class Echo:
+    """File-like object handing back what's written to it."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def log_records(logs, chunk_size: int = CHUNK_SIZE) -> Iterator[Dict]:
+    """Each log of a queryset with its ailments and meals, by date.
+
+    The meals and the ailments are read with two server-side cursors in
+    the same order as the logs and merged as they're read, so only a
+    single log is held in memory at a time.
+
+    Args:
+        logs: Queryset of the logs.
+        chunk_size: Rows fetched at a time from each cursor.
+
+    Yields:
+        Dictionaries of the log fields, the names of its ``ailments`` and
+        its ``meals``.
+    """
+    rows = logs.order_by('date', 'id', 'meals__id').values_list(
+        *LOG_FIELDS, *MEAL_FIELDS,
+    ).iterator(chunk_size)
+    ailments = logs.filter(ailments__isnull=False).order_by(
+        'date', 'id', 'ailments__name',
+    ).values_list('date', 'id', 'ailments__name').iterator(chunk_size)
+    ailment = next(ailments, None)
+
+    for pk, group in groupby(rows, key=lambda row: row[0]):
+        row = next(group)
+        record = dict(zip(('id', 'user', *LOG_FIELDS[2:]), row))
+        record['ailments'] = []
+        while ailment is not None and (
+            (ailment[0], ailment[1]) <= (record['date'], pk)
+        ):
+            if ailment[1] == pk:
+                record['ailments'].append(ailment[2])
+            ailment = next(ailments, None)
+        record['meals'] = [
+            {
+                'time': time, 'count': count, 'food': food,
+                'calories': calories, 'carbohydrates': carbohydrates,
+                'protein': protein, 'fats': fats,
+            }
+            for (
+                time, count, food, calories, carbohydrates, protein, fats,
+            ) in (
+                meal[len(LOG_FIELDS):] for meal in (row, *group)
+            )
+            if time is not None
+        ]
+        yield record
+
+
+def ndjson_lines(records: Iterable[Dict]) -> Iterator[str]:
+    """Each record as a line of JSON."""
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def csv_lines(records: Iterable[Dict]) -> Iterator[str]:
+    """The records as CSV lines, one for each meal.
+
+    Logs without any meals get a line with empty meal columns.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for record in records:
+        log = (
+            record['id'], record['user'], record['date'], record['calories'],
+            record['carbohydrates'], record['proteins'], record['fats'],
+            ';'.join(record['ailments']),
+        )
+        if not record['meals']:
+            yield writer.writerow(log)
+        for meal in record['meals']:
+            yield writer.writerow(log + (
+                meal['time'], meal['count'], meal['food'], meal['calories'],
+                meal['carbohydrates'], meal['protein'], meal['fats'],
+            ))
+
+
+def buffered(
+    lines: Iterable[str], size: int = BUFFER_SIZE,
+) -> Iterator[bytes]:
+    """Gathers lines into chunks of about the given number of bytes."""
+    chunk = []
+    length = 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(chunk).encode()
+            chunk = []
+            length = 0
+    if chunk:
+        yield ''.join(chunk).encode()
+
+
+def stream(
+    logs, output: str = NDJSON, replica: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """Exports logs as they're read from the database.
+
+    The queries only run once the response is being sent. They're made
+    in a transaction on a single database so that PostgreSQL streams the
+    rows from its cursors instead of materializing them first, and so
+    that the meals and the ailments come from the same snapshot.
+
+    Args:
+        logs: Queryset of the logs.
+        output: Format of the export, ``ndjson`` or ``csv``.
+        replica: If the logs can be read from a read replica.
+        chunk_size: Rows fetched at a time from each cursor.
+
+    Yields:
+        Chunks of the export.
+    """
+    lines = ndjson_lines if output == NDJSON else csv_lines
+    with ExitStack() as stack:
+        if replica:
+            stack.enter_context(routers.replica_reads())
+        alias = router.db_for_read(models.Log)
+        stack.enter_context(transaction.atomic(using=alias))
+        records = log_records(logs.using(alias), chunk_size)
+        yield from buffered(lines(records))
+
+
+def filter_dates(
+    logs, min_date: Optional[date] = None, max_date: Optional[date] = None,
+):
+    if min_date is not None:
+        logs = logs.filter(date__gte=min_date)
+    if max_date is not None:
+        logs = logs.filter(date__lte=max_date)
+    return logs
+
+
+def response(
+    logs, output: str, filename: str, replica: bool = False,
+) -> StreamingHttpResponse:
+    """Streaming response exporting logs as an attachment.
+
+    Args:
+        logs: Queryset of the logs.
+        output: Format of the export, ``ndjson`` or ``csv``.
+        filename: Name of the file without its extension.
+        replica: If the logs can be read from a read replica.
+    """
+    output = output or NDJSON
+    result = StreamingHttpResponse(
+        stream(logs, output, replica), content_type=CONTENT_TYPES[output],
+    )
+    result['Content-Disposition'] = (
+        f'attachment; filename="{filename}.{output}"'
+    )
+    return result
@@ -2,7 +2,7 @@ from django import forms
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.contrib.auth.password_validation import validate_password
 
-from . import models
+from . import catalog, export, models
 
 
 class RegistrationForm(forms.ModelForm):
@@ -136,6 +136,51 @@ class AverageBMIForm(forms.Form):
             )
 
 
+class ExportForm(forms.Form):
+    output = forms.ChoiceField(choices=export.FORMAT_CHOICES, required=False)
+    min_date = forms.DateField(required=False)
+    max_date = forms.DateField(required=False)
+
+    def clean(self):
+        min_date = self.cleaned_data.get('min_date')
+        max_date = self.cleaned_data.get('max_date')
+        if min_date is not None and max_date is not None and min_date > max_date:
+            raise forms.ValidationError(
+                'Maximum date should be greater than the minimum date.'
+            )
+
+
+class AnalystExportForm(ExportForm):
+    min_age = forms.IntegerField(min_value=0, required=False)
+    max_age = forms.IntegerField(required=False)
+    condition = forms.ModelChoiceField(
+        models.Condition.objects.all(), required=False,
+    )
+    ailment = forms.ModelChoiceField(
+        models.Ailment.objects.all(), required=False,
+    )
+
+    def clean(self):
+        super().clean()
+        min_age = self.cleaned_data.get('min_age')
+        max_age = self.cleaned_data.get('max_age')
+        if min_age is not None and max_age is not None and min_age > max_age:
+            raise forms.ValidationError(
+                'Maximum age should be greater than the minimum age.',
+            )
+
+
+class FoodImportForm(forms.Form):
+    file = forms.FileField()
+    format = forms.ChoiceField(
+        choices=(('', 'From the file extension'),) + catalog.FORMAT_CHOICES,
+        required=False,
+    )
+    dry_run = forms.BooleanField(
+        required=False, help_text='Validate the file without saving it.',
+    )
+
+
 class UserCreationForm(forms.ModelForm):
     """
     Admin form for creating new users. Includes all the required
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, NamedTuple, Optional, Set
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.utils.dateparse import parse_date
+
+from . import rollups, routers
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+# Analytics that can be run as jobs, indexed by the name of their form.
+ANALYTICS = {
+    'top_food': rollups.top_foods,
+    'top_ailment': rollups.top_ailments,
+    'top_condition': rollups.top_conditions,
+    'average_bmi': rollups.average_bmi,
+}
+DATE_PARAMETERS = ('min_date', 'max_date')
+
+
+class Job(NamedTuple):
+    """State of an analytics job.
+
+    Attributes:
+        status: Either pending, done or failed.
+        result: Result of the analytics once the job is done.
+    """
+    status: str
+    result: Any = None
+
+
+_lock = threading.Lock()
+_running: Set[str] = set()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _cache():
+    return caches[settings.ANALYTICS_CACHE_ALIAS]
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            settings.ANALYTICS_WORKERS, thread_name_prefix='analytics',
+        )
+    return _executor
+
+
+def job_key(name: str, params: Dict) -> str:
+    """Key of the job that runs the analytics with the parameters.
+
+    Args:
+        name: Name of the analytics.
+        params: Parameters of the analytics, with objects replaced by
+            their IDs and dates by their ISO format.
+
+    Returns:
+        Key that is the same for every request with equal parameters.
+    """
+    normalized = json.dumps([name, params], sort_keys=True)
+    digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    return f'healthlog:analytics:{digest}'
+
+
+def submit(name: str, params: Dict) -> Job:
+    """Queues the analytics unless its result is stored or on its way.
+
+    Submitting the same parameters again is how callers poll for the
+    result.
+
+    Args:
+        name: Name of the analytics to run.
+        params: Parameters of the analytics, as accepted by ``job_key``.
+
+    Returns:
+        Current state of the job.
+    """
+    key = job_key(name, params)
+    job = _cache().get(key)
+    if job is not None:
+        return Job(*job)
+    with _lock:
+        if key in _running:
+            return Job(PENDING)
+        # The marker is shared with the other servers through the cache
+        # and expires in case the server running the job goes away.
+        claimed = _cache().add(
+            key, tuple(Job(PENDING)), settings.ANALYTICS_JOB_TIMEOUT,
+        )
+        if not claimed:
+            job = _cache().get(key)
+            return Job(*job) if job is not None else Job(PENDING)
+        _running.add(key)
+    _pool().submit(_run, key, name, params)
+    return Job(PENDING)
+
+
+def _run(key: str, name: str, params: Dict):
+    arguments = dict(params)
+    for parameter in DATE_PARAMETERS:
+        if arguments.get(parameter):
+            arguments[parameter] = parse_date(arguments[parameter])
+    # Jobs don't follow any write of their thread's previous job.
+    routers.reset()
+    try:
+        try:
+            with routers.replica_reads():
+                job = Job(DONE, ANALYTICS[name](**arguments))
+        except Exception:
+            logger.exception('Analytics job %s failed', name)
+            job = Job(FAILED)
+        _cache().set(key, tuple(job), settings.ANALYTICS_RESULT_TTL)
+    finally:
+        # Worker threads open their own connections.
+        connections.close_all()
+        with _lock:
+            _running.discard(key)
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from healthlog.core import models
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the nutrient totals stored on every daily log.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of logs to update at a time.',
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        chunk_size = options['chunk_size']
+        log_ids = models.Log.objects.order_by('pk').values_list(
+            'pk', flat=True,
+        )
+        updated = 0
+        chunk = []
+        for log_id in log_ids.iterator():
+            chunk.append(log_id)
+            if len(chunk) >= chunk_size:
+                updated += models.Log.objects.filter(
+                    pk__in=chunk,
+                ).update_totals()
+                chunk = []
+        if chunk:
+            updated += models.Log.objects.filter(pk__in=chunk).update_totals()
+        self.stdout.write('Updated %d logs (%.3fs)' % (
+            updated, time.monotonic() - start,
+        ))
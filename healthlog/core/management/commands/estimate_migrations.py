@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+from healthlog.core.profiler import MigrationProfiler
+
+
+class Command(BaseCommand):
+    help = (
+        'Estimates how long the pending migrations will take from the '
+        'profiled migration history.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database to estimate the migrations of.',
+        )
+        parser.add_argument(
+            '--slowest', type=int, default=0,
+            help='Number of the slowest recorded operations to list.',
+        )
+
+    def handle(self, *args, **options):
+        profiler = MigrationProfiler(settings.MIGRATION_HISTORY_PATH)
+        connection = connections[options['database']]
+        executor = MigrationExecutor(connection)
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        estimates = profiler.estimate(connection, plan)
+        for migration, seconds in estimates:
+            self.stdout.write('%s (%.3fs)' % (migration, seconds))
+        total = sum(seconds for _, seconds in estimates)
+        self.stdout.write(
+            'Pending migrations estimated at %.3fs' % total,
+        )
+        budget = settings.MIGRATION_BUDGET
+        if budget and total > budget:
+            self.stdout.write(self.style.WARNING(
+                'Over the budget of %.3fs' % budget,
+            ))
+
+        operations = [
+            (migration['migration'], operation)
+            for migration in profiler.history()
+            for operation in migration['operations']
+        ]
+        operations.sort(key=lambda item: item[1]['duration'], reverse=True)
+        for migration, operation in operations[:options['slowest']]:
+            self.stdout.write('%s: %s on %d rows (%.3fs)' % (
+                migration, operation['description'], operation['rows'],
+                operation['duration'],
+            ))
+            for query in operation['queries']:
+                self.stdout.write('    %s (%.3fs)' % (
+                    query['sql'], query['duration'],
+                ))
@@ -0,0 +1,41 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from healthlog.core import catalog, models
+
+
+class Command(BaseCommand):
+    help = 'Writes the food catalog to a CSV or JSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='File to write, the standard output by default.',
+        )
+        parser.add_argument(
+            '--format', choices=catalog.FORMATS,
+            help='Format of the file, guessed from its extension by default.',
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        path = options['path']
+        output = options['format'] or catalog.guess_format(path)
+        if path == '-':
+            file = sys.stdout
+        else:
+            file = open(path, 'w', encoding='utf-8', newline='')
+        foods = models.Food.objects.all()
+        count = foods.count()
+        try:
+            for line in catalog.export_lines(foods, output):
+                file.write(line)
+        finally:
+            if file is not sys.stdout:
+                file.close()
+        seconds = time.monotonic() - start
+        self.stderr.write('Exported %d foods (%.3fs, %.0f foods/s)' % (
+            count, seconds, count / seconds if seconds else 0,
+        ))
@@ -0,0 +1,120 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from healthlog.core import dataset, models, rollups
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates users with their daily logs, meals and ailments for load '
+        'and scale testing. The same seed and options generate the same '
+        'dataset.'
+    )
+
+    def add_arguments(self, parser):
+        defaults = dataset.Distribution()
+        parser.add_argument(
+            '--users', type=int, default=100,
+            help='Number of users to generate.',
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Number of days each user logs.',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Seed of the random generators.',
+        )
+        parser.add_argument(
+            '--start', type=date.fromisoformat,
+            default=dataset.DEFAULT_START,
+            help='First day logged, as YYYY-MM-DD.',
+        )
+        parser.add_argument(
+            '--foods-per-meal', type=float, default=defaults.foods_per_meal,
+            help='Average number of foods in a meal, at least one.',
+        )
+        parser.add_argument(
+            '--food-skew', type=float, default=defaults.food_skew,
+            help=(
+                'Exponent of the Zipf distribution of food popularity, 0 to '
+                'pick every food as often.'
+            ),
+        )
+        parser.add_argument(
+            '--ailment-rate', type=float, default=defaults.ailment_rate,
+            help='Chance of a logged day having ailments.',
+        )
+        parser.add_argument(
+            '--log-rate', type=float, default=defaults.log_rate,
+            help='Chance of a user logging a day.',
+        )
+        parser.add_argument(
+            '--mean-age', type=float, default=defaults.mean_age,
+            help='Average age of the users.',
+        )
+        parser.add_argument(
+            '--age-spread', type=float, default=defaults.age_spread,
+            help='Standard deviation of the age of the users.',
+        )
+        parser.add_argument(
+            '--conditions-per-user', type=float,
+            default=defaults.conditions_per_user,
+            help='Average number of conditions of a user.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=dataset.BATCH_SIZE,
+            help='Number of meals to write at a time.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of processes generating users, PostgreSQL only.',
+        )
+        parser.add_argument(
+            '--skip-rollups', action='store_true',
+            help="Don't rebuild the analytics rollups afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        if options['foods_per_meal'] < 1:
+            raise CommandError('A meal has at least one food.')
+        for name in ('ailment_rate', 'log_rate'):
+            if not 0 <= options[name] <= 1:
+                option = '--' + name.replace('_', '-')
+                raise CommandError(f'{option} is a chance between 0 and 1.')
+        generator = dataset.Generator(
+            options['users'], options['days'], options['seed'],
+            options['start'], dataset.Distribution(
+                options['foods_per_meal'], options['food_skew'],
+                options['ailment_rate'], options['log_rate'],
+                options['mean_age'], options['age_spread'],
+                options['conditions_per_user'],
+            ),
+            options['batch_size'], options['workers'],
+            progress=self.report if options['verbosity'] > 1 else None,
+        )
+        try:
+            generator.generate()
+        except dataset.DatasetError as error:
+            raise CommandError(str(error))
+
+        meals = generator.counts[models.Meal._meta.db_table]
+        self.stdout.write('Generated %s (%.3fs, %.0f meals/s)' % (
+            ', '.join(
+                f'{generator.counts[model._meta.db_table]} '
+                f'{model._meta.db_table}'
+                for model, _ in dataset.TABLES
+            ),
+            generator.seconds,
+            meals / generator.seconds if generator.seconds else 0,
+        ))
+        if not options['skip_rollups']:
+            rollups.rebuild()
+            self.stdout.write('Rebuilt rollups')
+
+    def report(self, generator: dataset.Generator):
+        self.stdout.write('%d logs, %d meals' % (
+            generator.counts[models.Log._meta.db_table],
+            generator.counts[models.Meal._meta.db_table],
+        ))
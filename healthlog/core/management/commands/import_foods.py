@@ -0,0 +1,62 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from healthlog.core import catalog
+
+
+class Command(BaseCommand):
+    help = (
+        'Adds the foods of a CSV or JSON file to the catalog, updating the '
+        'foods with the same name.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='File to import, - to read the standard input.',
+        )
+        parser.add_argument(
+            '--format', choices=catalog.FORMATS,
+            help='Format of the file, guessed from its extension by default.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=catalog.BATCH_SIZE,
+            help='Number of foods to write at a time.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Validate and match the foods without saving them.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        output = options['format'] or catalog.guess_format(path)
+        importer = catalog.Importer(
+            options['batch_size'], options['dry_run'],
+            progress=self.report if options['verbosity'] > 1 else None,
+        )
+        if path == '-':
+            file = sys.stdin
+        else:
+            file = open(path, encoding='utf-8-sig', newline='')
+        try:
+            importer.run(catalog.read(file, output))
+        except catalog.CatalogError as error:
+            raise CommandError(f'{error} after {importer.rows} rows')
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        for number, errors in importer.errors:
+            for field, messages in errors.items():
+                self.stderr.write('Row %d: %s: %s' % (
+                    number, field, ' '.join(messages),
+                ))
+        self.stdout.write(
+            ('Checked %s' if options['dry_run'] else 'Imported %s')
+            % importer.summary(),
+        )
+
+    def report(self, importer: catalog.Importer):
+        self.stdout.write('%d rows (%.0f rows/s)' % (
+            importer.rows, importer.rate,
+        ))
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from healthlog.core import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the analytics rollup tables from the daily logs.'
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        rollups.rebuild()
+        self.stdout.write(
+            'Rebuilt rollups (%.3fs)' % (time.monotonic() - start),
+        )
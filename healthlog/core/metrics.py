@@ -0,0 +1,228 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (
+    256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+)
+
+# Histograms recorded for every view and the buckets of each.
+HISTOGRAMS = (
+    ('request_duration_seconds', 'Time spent serving requests.',
+     SECONDS_BUCKETS),
+    ('request_queries', 'Number of SQL queries run by requests.',
+     QUERY_BUCKETS),
+    ('request_query_duration_seconds', 'Time spent running SQL queries.',
+     SECONDS_BUCKETS),
+    ('response_size_bytes', 'Size of the response bodies.', BYTES_BUCKETS),
+)
+
+Labels = Tuple[str, str]
+
+
+class Histogram:
+    """Counts of observed values that fall within each bucket.
+
+    Attributes:
+        buckets: Upper bounds of each bucket in increasing order. Values
+            above the last bound fall in an implicit infinite bucket.
+        counts: Number of values in each bucket, not cumulative.
+        total: Sum of all observed values.
+        count: Number of observed values.
+    """
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """Upper bound and number of values at or below it per bucket."""
+        result = []
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Estimates a percentile of the observed values.
+
+        Values are assumed to be spread evenly within their bucket, the
+        same way Prometheus' ``histogram_quantile`` estimates them.
+
+        Args:
+            percent: Percentile to estimate, from 0 to 100.
+
+        Returns:
+            Estimated value, or None without any values.
+        """
+        if not self.count:
+            return None
+        rank = self.count * percent / 100
+        lower = 0.0
+        previous = 0
+        for bound, running in self.cumulative():
+            if running >= rank:
+                if bound == float('inf'):
+                    return self.buckets[-1]
+                within = running - previous
+                if not within:
+                    return bound
+                return lower + (bound - lower) * (rank - previous) / within
+            lower = bound
+            previous = running
+        return self.buckets[-1]
+
+
+class Registry:
+    """Histograms of every view indexed by the view and method.
+
+    Each process keeps its own histograms. With several workers, a scrape
+    only covers the worker that answered it, which is identified by the
+    ``healthlog_process_info`` gauge.
+
+    Attributes:
+        summary_interval: Seconds between summaries written to the log.
+            Summaries are disabled when it's zero.
+        collectors: Functions rendering other metrics in the Prometheus
+            text exposition format, added after the histograms.
+    """
+    def __init__(self, summary_interval: float = 0):
+        self.summary_interval = summary_interval
+        self.collectors: List[Callable[[], str]] = []
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = OrderedDict(
+            (name, {}) for name, _, _ in HISTOGRAMS
+        )
+        self._buckets = {name: buckets for name, _, buckets in HISTOGRAMS}
+        self._lock = threading.Lock()
+        self._next_summary = time.monotonic() + summary_interval
+
+    def observe(
+        self, view: str, method: str, duration: float, queries: int,
+        query_duration: float, size: Optional[int],
+    ):
+        """Records a served request.
+
+        Args:
+            view: Name of the view that served the request.
+            method: HTTP method of the request.
+            duration: Seconds spent serving the request.
+            queries: Number of SQL queries run.
+            query_duration: Seconds spent running SQL queries.
+            size: Size of the response body, or None when it's streamed.
+        """
+        values = (
+            ('request_duration_seconds', duration),
+            ('request_queries', queries),
+            ('request_query_duration_seconds', query_duration),
+            ('response_size_bytes', size),
+        )
+        labels = (view, method)
+        with self._lock:
+            for name, value in values:
+                if value is None:
+                    continue
+                histograms = self._histograms[name]
+                if labels not in histograms:
+                    histograms[labels] = Histogram(self._buckets[name])
+                histograms[labels].observe(value)
+        self._maybe_summarize()
+
+    def render(self) -> str:
+        """Every histogram in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, description, _ in HISTOGRAMS:
+                metric = f'healthlog_{name}'
+                lines.append(f'# HELP {metric} {description}')
+                lines.append(f'# TYPE {metric} histogram')
+                histograms = self._histograms[name]
+                for view, method in sorted(histograms):
+                    histogram = histograms[view, method]
+                    labels = (
+                        f'view="{_escape(view)}",method="{_escape(method)}"'
+                    )
+                    for bound, running in histogram.cumulative():
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(
+                            f'{metric}_bucket{{{labels},le="{le}"}} '
+                            f'{running}',
+                        )
+                    lines.append(
+                        f'{metric}_sum{{{labels}}} {histogram.total}',
+                    )
+                    lines.append(
+                        f'{metric}_count{{{labels}}} {histogram.count}',
+                    )
+        lines.extend((
+            '# HELP healthlog_process_info Process serving the metrics.',
+            '# TYPE healthlog_process_info gauge',
+            f'healthlog_process_info{{pid="{os.getpid()}"}} 1',
+        ))
+        rendered = '\n'.join(lines) + '\n'
+        for collector in self.collectors:
+            rendered += collector()
+        return rendered
+
+    def summary(self) -> List[str]:
+        """One line per view with the percentiles of each histogram."""
+        lines = []
+        with self._lock:
+            durations = self._histograms['request_duration_seconds']
+            for labels in sorted(durations):
+                duration = durations[labels]
+                queries = self._histograms['request_queries'][labels]
+                sql = self._histograms['request_query_duration_seconds'][
+                    labels
+                ]
+                lines.append(
+                    '%s %s count=%d p50=%.3fs p95=%.3fs p99=%.3fs '
+                    'queries_p95=%.0f sql_p95=%.3fs' % (
+                        labels[1], labels[0], duration.count,
+                        duration.percentile(50), duration.percentile(95),
+                        duration.percentile(99), queries.percentile(95),
+                        sql.percentile(95),
+                    )
+                )
+        return lines
+
+    def clear(self):
+        with self._lock:
+            for histograms in self._histograms.values():
+                histograms.clear()
+
+    def _maybe_summarize(self):
+        if self.summary_interval <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_summary:
+                return
+            self._next_summary = now + self.summary_interval
+        for line in self.summary():
+            logger.info('Request metrics: %s', line)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+registry = Registry(settings.METRICS_SUMMARY_INTERVAL)
@@ -0,0 +1,61 @@
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import metrics
+
+
+class QueryCounter:
+    """Database execute wrapper that counts and times SQL queries.
+
+    Attributes:
+        count: Number of queries run.
+        duration: Seconds spent running the queries.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """Records the latency, queries and response size of each view.
+
+    Requests are grouped by the name of the URL pattern they resolved
+    to, so the number of series stays bounded no matter the paths that
+    are requested.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else '<unmatched>'
+        if response.has_header('Content-Length'):
+            # Avoids joining the content of responses into a new copy.
+            size = int(response['Content-Length'])
+        elif response.streaming:
+            size = None
+        else:
+            size = len(response.content)
+        metrics.registry.observe(
+            view, request.method, duration,
+            counter.count, counter.duration, size,
+        )
+        return response
@@ -0,0 +1,88 @@
+# Generated by Django 2.2.28 on 2026-10-17 16:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='log',
+            name='ailments',
+            field=models.ManyToManyField(blank=True, related_name='logs', to='core.Ailment'),
+        ),
+        migrations.AlterField(
+            model_name='log',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='logs', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='conditions',
+            field=models.ManyToManyField(blank=True, related_name='users', to='core.Condition'),
+        ),
+        migrations.CreateModel(
+            name='UserFoodRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('food', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_rollups', to='core.Food')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='food_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserAilmentRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('ailment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_rollups', to='core.Ailment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ailment_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FoodRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('birth_year', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('ailment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='food_rollups', to='core.Ailment')),
+                ('condition', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='food_rollups', to='core.Condition')),
+                ('food', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='core.Food')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AilmentRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('birth_year', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('ailment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='core.Ailment')),
+                ('condition', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ailment_rollups', to='core.Condition')),
+                ('food', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ailment_rollups', to='core.Food')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='userfoodrollup',
+            index=models.Index(fields=['food', 'user'], name='core_userfo_food_id_2da035_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userailmentrollup',
+            index=models.Index(fields=['ailment', 'user'], name='core_userai_ailment_e6f324_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodrollup',
+            index=models.Index(fields=['date', 'condition', 'ailment'], name='core_foodro_date_350212_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ailmentrollup',
+            index=models.Index(fields=['date', 'condition', 'food'], name='core_ailmen_date_d1f6e8_idx'),
+        ),
+    ]
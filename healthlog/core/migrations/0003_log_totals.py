@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-17 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='log',
+            name='calories',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='carbohydrates',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='fats',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='proteins',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
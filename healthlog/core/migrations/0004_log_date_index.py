@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-17 16:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_log_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['user', 'date', 'id'], name='core_log_user_id_74eec5_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+INDEXES = (
+    # Trigram similarity (name % query).
+    (
+        'core_food_name_trgm',
+        'CREATE INDEX core_food_name_trgm ON core_food '
+        'USING gin (name gin_trgm_ops)',
+    ),
+    # Case insensitive matches inside the name (UPPER(name) LIKE '% X%').
+    (
+        'core_food_name_upper_trgm',
+        'CREATE INDEX core_food_name_upper_trgm ON core_food '
+        'USING gin (UPPER(name) gin_trgm_ops)',
+    ),
+    # Case insensitive prefix matches (UPPER(name) LIKE 'X%').
+    (
+        'core_food_name_upper_prefix',
+        'CREATE INDEX core_food_name_upper_prefix ON core_food '
+        '(UPPER(name) varchar_pattern_ops)',
+    ),
+)
+
+
+def create_indexes(apps, schema_editor):
+    # Other databases search with the in-process index instead.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for _, sql in INDEXES:
+        schema_editor.execute(sql)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_log_date_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
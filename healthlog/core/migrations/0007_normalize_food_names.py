@@ -0,0 +1,35 @@
+from django.db import migrations
+
+BATCH_SIZE = 1000
+# Name with every run of whitespace replaced by a single space.
+NORMALIZED_SQL = r"BTRIM(REGEXP_REPLACE(name, '\s+', ' ', 'g'))"
+
+
+def normalize_names(apps, schema_editor):
+    """Collapses the whitespace of the existing food names."""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'UPDATE core_food SET name = %s WHERE name <> %s'
+            % (NORMALIZED_SQL, NORMALIZED_SQL)
+        )
+        return
+    Food = apps.get_model('core', 'Food')
+    db_alias = schema_editor.connection.alias
+    changed = []
+    for food in Food.objects.using(db_alias).only('name').iterator():
+        name = ' '.join(food.name.split())
+        if name != food.name:
+            food.name = name
+            changed.append(food)
+    Food.objects.using(db_alias).bulk_update(changed, ['name'], BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_sync'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_log_users(apps, schema_editor):
+    """Gives every meal the user of its log."""
+    Log = apps.get_model('core', 'Log')
+    Meal = apps.get_model('core', 'Meal')
+    db_alias = schema_editor.connection.alias
+    Meal.objects.using(db_alias).update(user_id=models.Subquery(
+        Log.objects.filter(pk=models.OuterRef('log_id')).values('user_id'),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_normalize_food_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meal',
+            name='user',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='meals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(copy_log_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='meal',
+            name='user',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='meals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RemoveIndex(
+            model_name='meal',
+            name='core_meal_modifie_adc021_idx',
+        ),
+        migrations.AddIndex(
+            model_name='meal',
+            index=models.Index(fields=['user', 'modified_on', 'id'], name='core_meal_user_id_add853_idx'),
+        ),
+    ]
@@ -0,0 +1,87 @@
+from django.db import migrations, models
+
+# Key columns of every rollup table and the ones that can be empty.
+KEYS = {
+    'core_foodrollup': (
+        ('date', 'food_id', 'birth_year', 'condition_id', 'ailment_id'),
+        ('birth_year', 'condition_id', 'ailment_id'),
+    ),
+    'core_ailmentrollup': (
+        ('date', 'ailment_id', 'birth_year', 'condition_id', 'food_id'),
+        ('birth_year', 'condition_id', 'food_id'),
+    ),
+    'core_userfoodrollup': (('user_id', 'food_id'), ()),
+    'core_userailmentrollup': (('user_id', 'ailment_id'), ()),
+}
+# Unique indexes of the daily rollups. Unique constraints can't coalesce
+# their columns, and PostgreSQL never considers NULLs equal.
+INDEXES = ('core_foodrollup', 'core_ailmentrollup')
+
+
+def key(table: str, prefix: str = ''):
+    """Key of a table with the empty values coalesced to zero."""
+    columns, nullable = KEYS[table]
+    return [
+        f'COALESCE({prefix}{column}, 0)' if column in nullable
+        else f'{prefix}{column}'
+        for column in columns
+    ]
+
+
+def merge_duplicates(apps, schema_editor):
+    """Adds up the rows that concurrent writers created twice."""
+    for table in KEYS:
+        columns = ', '.join(key(table))
+        same_key = ' AND '.join(
+            f'{duplicate} = {row}' for duplicate, row in zip(
+                key(table, 'duplicate.'), key(table, f'{table}.'),
+            )
+        )
+        schema_editor.execute(
+            f'UPDATE {table} SET total = (SELECT SUM(duplicate.total) '
+            f'FROM {table} duplicate WHERE {same_key}) '
+            f'WHERE id IN (SELECT MIN(id) FROM {table} '
+            f'GROUP BY {columns} HAVING COUNT(*) > 1)'
+        )
+        schema_editor.execute(
+            f'DELETE FROM {table} WHERE id NOT IN ('
+            f'SELECT MIN(id) FROM {table} GROUP BY {columns})'
+        )
+
+
+def create_indexes(apps, schema_editor):
+    # Expression indexes are only created where rollups are upserted.
+    if schema_editor.connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    for table in INDEXES:
+        schema_editor.execute(
+            f'CREATE UNIQUE INDEX {table}_key ON {table} '
+            f'({", ".join(key(table))})'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    for table in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_key')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_meal_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.RunPython(create_indexes, drop_indexes),
+        migrations.AddConstraint(
+            model_name='userailmentrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'ailment'), name='core_userailmentrollup_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='userfoodrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'food'), name='core_userfoodrollup_key'),
+        ),
+    ]
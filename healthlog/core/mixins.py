@@ -1,5 +1,11 @@
+from typing import Tuple
+
 from django.contrib.auth.mixins import AccessMixin
 from django.contrib.auth.views import redirect_to_login
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import caching
 
 
 class AnalystRequiredMixin(AccessMixin):
@@ -11,3 +17,41 @@ class AnalystRequiredMixin(AccessMixin):
                 self.get_redirect_field_name(),
             )
         return super().dispatch(request, *args, **kwargs)
+
+
+class CachedResponseMixin:
+    """Caches the successful list and retrieve responses of a viewset.
+
+    Only the response data is cached, so authentication, permissions and
+    content negotiation still run for every request. The responses are
+    computed from the primary database, never from a read replica.
+
+    Attributes:
+        cache_namespaces: Namespaces that invalidate the cached responses.
+    """
+    cache_namespaces: Tuple[str, ...] = ()
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(
+            super().retrieve, request, *args, **kwargs,
+        )
+
+    def _cached_response(self, view, request, *args, **kwargs):
+        response = None
+
+        def compute():
+            nonlocal response
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return None
+            return response.data
+
+        data = caching.cached(
+            request.build_absolute_uri(), self.cache_namespaces, compute,
+        )
+        if response is not None:
+            return response
+        return Response(data)
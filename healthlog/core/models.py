@@ -1,6 +1,22 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+class AtomicSaveMixin:
+    """Saves the model in a transaction.
+
+    The rollups of the logs a save changes are computed before and after
+    it, and the logs stay locked in between so that concurrent changes
+    aren't counted twice.
+    """
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(force_insert, force_update, using, update_fields)
 
 
 class UserManager(BaseUserManager):
@@ -43,7 +59,7 @@ class UserManager(BaseUserManager):
         return user
 
 
-class Info(models.Model):
+class Info(AtomicSaveMixin, models.Model):
     """User information.
 
     Attributes:
@@ -71,7 +87,7 @@ class Condition(models.Model):
         return self.name
 
 
-class User(AbstractBaseUser):
+class User(AtomicSaveMixin, AbstractBaseUser):
     """User object.
 
     Attributes:
@@ -167,6 +183,9 @@ class Ailment(models.Model):
 class Food(models.Model):
     """Food that a user has eaten.
 
+    Names are saved with their whitespace collapsed, so foods imported
+    from a catalog can be matched on their upper cased name alone.
+
     Attributes:
         name: Name of the food.
         calories: Number of calories in the food.
@@ -180,32 +199,112 @@ class Food(models.Model):
     protein = models.PositiveIntegerField()
     fats = models.PositiveIntegerField()
 
+    def save(self, *args, **kwargs):
+        self.name = ' '.join(self.name.split())
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
 
-class Log(models.Model):
+class LogQuerySet(models.QuerySet):
+    """Queryset of daily logs."""
+    def update_totals(self):
+        """Recomputes the nutrient totals of each log from its meals.
+
+        Returns:
+            Number of logs updated.
+        """
+        meals = Meal.objects.filter(
+            log=models.OuterRef('pk'),
+        ).order_by().values('log')
+
+        def total(field):
+            amount = models.Sum(
+                models.F('count') * models.F(f'food__{field}'),
+            )
+            return Coalesce(models.Subquery(
+                meals.annotate(total=amount).values('total'),
+            ), 0)
+
+        return self.update(
+            calories=total('calories'),
+            carbohydrates=total('carbohydrates'),
+            proteins=total('protein'),
+            fats=total('fats'),
+            modified_on=timezone.now(),
+        )
+
+
+class Log(AtomicSaveMixin, models.Model):
     """Daily log for the user.
 
     Attributes:
         user: User associated with the log.
         date: Date the log is associated with.
+        calories: Total calories of the meals in the log.
+        carbohydrates: Total grams of carbohydrates of the meals in the log.
+        proteins: Total grams of proteins of the meals in the log.
+        fats: Total grams of fats of the meals in the log.
+        modified_on: When the log or its totals last changed.
+
+    The totals are only written by ``LogQuerySet.update_totals``. Saving a
+    log leaves them alone, so a log loaded before one of its meals
+    changed can't save its stale totals over the new ones.
     """
+    TOTAL_FIELDS = ('calories', 'carbohydrates', 'proteins', 'fats')
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='logs')
     date = models.DateField()
     ailments = models.ManyToManyField(Ailment, related_name='logs', blank=True)
+    calories = models.PositiveIntegerField(default=0, editable=False)
+    carbohydrates = models.PositiveIntegerField(default=0, editable=False)
+    proteins = models.PositiveIntegerField(default=0, editable=False)
+    fats = models.PositiveIntegerField(default=0, editable=False)
+    modified_on = models.DateTimeField(auto_now=True)
+
+    objects = LogQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date', 'id']),
+            models.Index(fields=['user', 'modified_on', 'id']),
+        ]
 
     def __str__(self):
         return f'{self.user.full_name}: {self.date}'
 
-
-class Meal(models.Model):
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if not self._state.adding and not force_insert:
+            if update_fields is None:
+                update_fields = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key
+                ]
+            update_fields = [
+                name for name in update_fields
+                if name not in self.TOTAL_FIELDS
+            ]
+        super().save(force_insert, force_update, using, update_fields)
+        if update_fields is not None and 'user' in update_fields:
+            # Meals copy the user of their log for the sync feed.
+            self.meals.exclude(user_id=self.user_id).update(
+                user_id=self.user_id, modified_on=timezone.now(),
+            )
+
+
+class Meal(AtomicSaveMixin, models.Model):
     """Correlation of a food with a daily log.
 
     Attributes:
         log: Daily log the food is associated with.
+        user: User of the daily log, copied so the meals of a user can
+            be synced without a join.
         time: Time the food was recorded.
+        count: Number of servings of the food.
         food: Food associated with the daily log.
+        modified_on: When the meal last changed.
     """
     BREAKFAST = 'BREAKFAST'
     LUNCH = 'LUNCH'
@@ -219,15 +318,27 @@ class Meal(models.Model):
     )
 
     log = models.ForeignKey(Log, on_delete=models.CASCADE, related_name='meals')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+        related_name='meals', editable=False,
+    )
     time = models.CharField(max_length=255, choices=TIME_CHOICES)
     count = models.PositiveIntegerField(default=1)
     food = models.ForeignKey(
         Food, on_delete=models.PROTECT, related_name='meals',
     )
+    modified_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'modified_on', 'id'])]
 
     def __str__(self):
         return f'{self.log} - {self.time} {self.food}'
 
+    def save(self, *args, **kwargs):
+        self.user_id = self.log.user_id
+        super().save(*args, **kwargs)
+
 
 class Ticket(models.Model):
     """Error that occurred with the mobile application.
@@ -235,12 +346,181 @@ class Ticket(models.Model):
     Attributes:
         user: User who had the issue.
         created_on: When the
+        modified_on: When the ticket last changed.
     """
     user = models.ForeignKey(
         User, on_delete=models.SET_NULL, null=True, related_name='tickets',
     )
     created_on = models.DateTimeField(auto_now_add=True)
+    modified_on = models.DateTimeField(auto_now=True)
     message = models.TextField()
 
+    class Meta:
+        indexes = [models.Index(fields=['user', 'modified_on', 'id'])]
+
     def __str__(self):
         return f'{self.created_on}: {self.user}'
+
+
+class Tombstone(models.Model):
+    """Record of a deleted object for clients syncing their changes.
+
+    Attributes:
+        user_id: ID of the user that owned the deleted object.
+        kind: Name of the feed the object belonged to.
+        object_id: ID of the deleted object.
+        deleted_on: When the object was deleted.
+    """
+    LOG = 'logs'
+    MEAL = 'meals'
+    TICKET = 'tickets'
+    KIND_CHOICES = (
+        (LOG, 'Log'),
+        (MEAL, 'Meal'),
+        (TICKET, 'Ticket'),
+    )
+
+    user_id = models.IntegerField()
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    deleted_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user_id', 'deleted_on', 'id'])]
+
+    def __str__(self):
+        return f'{self.deleted_on}: {self.kind} {self.object_id}'
+
+
+class FoodRollup(models.Model):
+    """Daily count of meals eaten for a food.
+
+    Rows with an empty condition or ailment count every meal regardless
+    of that dimension, so filters only ever read a single slice. Meals
+    are counted once whatever their number of servings. There is a
+    single row per date, food, birth year, condition and ailment, with
+    empty values compared as equal, which a unique index on the
+    coalesced columns enforces.
+
+    Attributes:
+        date: Date of the logs the meals belong to.
+        food: Food that was eaten.
+        birth_year: Birth year of the users who ate the food.
+        condition: Condition of the users who ate the food.
+        ailment: Ailment recorded on the logs the meals belong to.
+        total: Number of meals in this slice.
+    """
+    date = models.DateField()
+    food = models.ForeignKey(
+        Food, on_delete=models.CASCADE, related_name='rollups',
+    )
+    birth_year = models.PositiveSmallIntegerField(null=True, blank=True)
+    condition = models.ForeignKey(
+        Condition, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='food_rollups',
+    )
+    ailment = models.ForeignKey(
+        Ailment, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='food_rollups',
+    )
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['date', 'condition', 'ailment'])]
+
+    def __str__(self):
+        return f'{self.date} {self.food_id}: {self.total}'
+
+
+class AilmentRollup(models.Model):
+    """Daily count of logs recording an ailment.
+
+    Rows with an empty condition or food count every log regardless of
+    that dimension. There is a single row per date, ailment, birth year,
+    condition and food, with empty values compared as equal, which a
+    unique index on the coalesced columns enforces.
+
+    Attributes:
+        date: Date of the logs.
+        ailment: Ailment recorded on the logs.
+        birth_year: Birth year of the users who own the logs.
+        condition: Condition of the users who own the logs.
+        food: Food eaten in the logs.
+        total: Number of logs in this slice.
+    """
+    date = models.DateField()
+    ailment = models.ForeignKey(
+        Ailment, on_delete=models.CASCADE, related_name='rollups',
+    )
+    birth_year = models.PositiveSmallIntegerField(null=True, blank=True)
+    condition = models.ForeignKey(
+        Condition, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='ailment_rollups',
+    )
+    food = models.ForeignKey(
+        Food, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='ailment_rollups',
+    )
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['date', 'condition', 'food'])]
+
+    def __str__(self):
+        return f'{self.date} {self.ailment_id}: {self.total}'
+
+
+class UserFoodRollup(models.Model):
+    """Number of logs of a user that contain a food.
+
+    Attributes:
+        user: User who owns the logs.
+        food: Food eaten in the logs.
+        total: Number of logs containing the food.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='food_rollups',
+    )
+    food = models.ForeignKey(
+        Food, on_delete=models.CASCADE, related_name='user_rollups',
+    )
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['food', 'user'])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'food'], name='core_userfoodrollup_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.food_id}: {self.total}'
+
+
+class UserAilmentRollup(models.Model):
+    """Number of logs of a user that record an ailment.
+
+    Attributes:
+        user: User who owns the logs.
+        ailment: Ailment recorded on the logs.
+        total: Number of logs recording the ailment.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='ailment_rollups',
+    )
+    ailment = models.ForeignKey(
+        Ailment, on_delete=models.CASCADE, related_name='user_rollups',
+    )
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['ailment', 'user'])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ailment'], name='core_userailmentrollup_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.ailment_id}: {self.total}'
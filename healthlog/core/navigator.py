@@ -1,24 +1,56 @@
+import hashlib
 import logging
+import pkgutil
 import time
-from typing import List, Dict, Optional
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from importlib import import_module
+from typing import List, Dict, Optional, Tuple
 
-from django.db import connections
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
 from django.db.migrations.migration import Migration
 from django.db.backends.dummy.base import (
     DatabaseWrapper as DummyDatabaseWrapper
 )
-from django.db.migrations.graph import Node
 from django.db.migrations.loader import MigrationLoader
 from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.recorder import MigrationRecorder
 from django.db.backends.base.base import BaseDatabaseWrapper as DatabaseWrapper
 
+from .profiler import MigrationProfiler
+
 logger = logging.getLogger(__name__)
 
+# Key of the PostgreSQL advisory lock held while migrating.
+MIGRATION_LOCK_ID = zlib.crc32(b'healthlog.navigator.migrate')
+
 
 class NavigatorError(Exception):
     pass
 
 
+class MigrationFailed(NavigatorError):
+    """Migrating one or more databases failed.
+
+    Attributes:
+        failures: Errors raised while migrating indexed by the database's
+            identifier in the settings.
+    """
+    def __init__(self, failures: Dict[str, BaseException]):
+        self.failures = failures
+        super().__init__('Migrating %s failed: %s' % (
+            ', '.join(f"'{name}'" for name in failures),
+            '; '.join(
+                f'{name}: {error!r}' for name, error in failures.items()
+            ),
+        ))
+
+
 class Navigator:
     """Database migration helper class.
 
@@ -36,13 +68,37 @@ class Navigator:
     reference, check `django.core.management.commands.migrate` and
     `django.core.management.commands`.
 
+    Concurrent servers migrating the same PostgreSQL database wait for
+    each other with an advisory lock. Once a database is known to be up
+    to date, a fingerprint of the migration files and the applied
+    migrations is kept in the ``state`` cache, a table of the default
+    database, so later startups can skip building the migration graph
+    altogether.
+
+    Databases are independent of each other, so with more than one
+    worker they're migrated concurrently, each on its own thread and
+    connection. The migrations of one database are still applied one at a
+    time in the order of its plan.
+
+    Pending migrations are estimated from the profiled history before
+    they're applied, and aren't applied at all when the estimate exceeds
+    the ``MIGRATION_BUDGET`` setting.
+
     Attributes:
-        start: Start time of the previous migration action.
+        workers: Number of databases migrated at the same time.
+        profile: If the operations of applied migrations are profiled and
+            added to the history.
+        profiler: Migration history used for the estimates.
+        starts: Start time of the previous migration action indexed by
+            the database it was performed on.
         _connections: Dictionary of current database connections indexed
             by their identifier in the settings.
     """
-    def __init__(self):
-        self.start: Optional[float] = None
+    def __init__(self, workers: int = 1, profile: bool = False):
+        self.workers = workers
+        self.profile = profile
+        self.profiler = MigrationProfiler(settings.MIGRATION_HISTORY_PATH)
+        self.starts: Dict[str, float] = {}
         self._connections: Dict[str, DatabaseWrapper] = {}
 
         for key in connections.databases.keys():
@@ -66,7 +122,7 @@ class Navigator:
 
     def log_migration_progress(
         self, action: str, migration: Optional[Migration] = None,
-        fake: bool = False,
+        fake: bool = False, database: str = DEFAULT_DB_ALIAS,
     ):
         """Logs migration progress for each migration.
 
@@ -74,64 +130,116 @@ class Navigator:
             action: String identifier of the migration action.
             migration: Migration being performed.
             fake: If the migration is being faked.
+            database: Identifier of the database being migrated.
         """
+        if action.endswith('_start'):
+            self.starts[database] = time.monotonic()
+        else:
+            elapsed = '(%.3fs)' % (time.monotonic() - self.starts[database])
+        result = 'FAKED' if fake else 'SUCCESS'
         if action == 'apply_start':
-            self.start = time.monotonic()
-            logger.info("Migrating %s START", migration)
+            logger.info("Migrating %s on '%s' START", migration, database)
         elif action == 'apply_success':
-            elapsed = '(%.3fs)' % (time.monotonic() - self.start)
-            result = 'FAKED' if fake else 'SUCCESS'
-            logger.info("Migrating %s %s %s", migration, result, elapsed)
+            logger.info(
+                "Migrating %s on '%s' %s %s",
+                migration, database, result, elapsed,
+            )
         elif action == 'unapply_start':
-            self.start = time.monotonic()
-            logger.info("Reverting %s START", migration)
+            logger.info("Reverting %s on '%s' START", migration, database)
         elif action == 'unapply_success':
-            elapsed = '(%.3fs)' % (time.monotonic() - self.start)
-            result = 'FAKED' if fake else 'SUCCESS'
-            logger.info("Revert %s %s %s", migration, result, elapsed)
+            logger.info(
+                "Revert %s on '%s' %s %s",
+                migration, database, result, elapsed,
+            )
         elif action == 'render_start':
-            self.start = time.monotonic()
-            logger.info('Rendering model states')
+            logger.info("Rendering model states of '%s'", database)
         elif action == 'render_success':
-            elapsed = '(%.3fs)' % (time.monotonic() - self.start)
-            logger.info('Rendering model states SUCCESS %s', elapsed)
+            logger.info(
+                "Rendering model states of '%s' SUCCESS %s",
+                database, elapsed,
+            )
 
-    def get_unapplied_migrations(self) -> Dict[str, List[Node]]:
-        """Returns a collection of migrations that have not been applied.
+    @contextmanager
+    def lock(self, connection: DatabaseWrapper):
+        """Holds the migration lock of a database.
 
-        Returns:
-            Dictionary of migrations that need to be applied sorted by their
-            application order and indexed by the database they need to be
-            applied to.
+        Only PostgreSQL has advisory locks, other databases aren't locked.
+
+        Args:
+            connection: Connection to the database to lock.
         """
-        migration_plans = {}
+        if connection.vendor != 'postgresql':
+            yield
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', [MIGRATION_LOCK_ID])
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_advisory_unlock(%s)', [MIGRATION_LOCK_ID],
+                )
 
-        # Collection migration plan for each database connection.
-        for name, connection in self._connections.items():
-            # Ignore any dummy database wrappers.
-            if isinstance(connection, DummyDatabaseWrapper):
-                continue
+    def fingerprint(self, connection: DatabaseWrapper) -> Optional[str]:
+        """Hash of the migration files and the migrations applied to them.
+
+        Only the names of the migration modules are listed, none of them
+        are imported.
+
+        Args:
+            connection: Connection to the database.
 
-            loader = MigrationLoader(connection)
-            graph = loader.graph
-            leaf_nodes = graph.leaf_nodes()
-            migration_plan = []
-            visited_nodes = set()
+        Returns:
+            Hash that changes whenever a migration is added or applied, or
+            None when the database hasn't been migrated yet.
+        """
+        recorder = MigrationRecorder(connection)
+        if not recorder.has_table():
+            return None
+        applied = sorted(recorder.applied_migrations())
+        disk = []
+        for app_config in apps.get_app_configs():
+            module_name, _ = MigrationLoader.migrations_module(
+                app_config.label,
+            )
+            if module_name is None:
+                continue
+            try:
+                module = import_module(module_name)
+            except ImportError:
+                continue
+            if not hasattr(module, '__path__'):
+                continue
+            disk.extend(sorted(
+                (app_config.label, name)
+                for _, name, is_pkg in pkgutil.iter_modules(module.__path__)
+                if not is_pkg and name[0] not in '_~'
+            ))
+        content = repr((disk, applied)).encode()
+        return hashlib.sha256(content).hexdigest()
 
-            for leaf_node in leaf_nodes:
-                for migration in graph.forwards_plan(leaf_node):
-                    if migration in visited_nodes:
-                        continue
-                    node = graph.node_map[migration]
-                    if node not in loader.applied_migrations:
-                        migration_plan.append(node)
-                    visited_nodes.add(migration)
+    def _cache_key(self, name: str) -> str:
+        return f'healthlog:navigator:{name}'
 
-            # Only add if there are unapplied migrations.
-            if migration_plan:
-                migration_plans[name] = migration_plan
+    def _cached_fingerprint(self, name: str) -> Optional[str]:
+        try:
+            return caches[settings.NAVIGATOR_CACHE_ALIAS].get(
+                self._cache_key(name),
+            )
+        except DatabaseError:
+            # The cache table may not exist yet.
+            return None
 
-        return migration_plans
+    def _store_fingerprint(self, name: str, fingerprint: Optional[str]):
+        if fingerprint is None:
+            return
+        try:
+            caches[settings.NAVIGATOR_CACHE_ALIAS].set(
+                self._cache_key(name), fingerprint, None,
+            )
+        except DatabaseError:
+            logger.warning("Couldn't cache the migration state of '%s'", name)
 
     def migrate(self, fake: bool = False):
         """Migrates every database to the most recent version.
@@ -139,36 +247,166 @@ class Navigator:
         Args:
             fake: If the migration should be rolled back after
                 application.
+
+        Raises:
+            MigrationFailed: Migrating any of the databases failed. With
+                more than one worker, every database is attempted before
+                the failures are raised together.
         """
-        if not self.get_unapplied_migrations():
+        # Ignore any dummy database wrappers and the read replicas, which
+        # follow the primary.
+        names = [
+            name for name, connection in self._connections.items()
+            if not isinstance(connection, DummyDatabaseWrapper)
+            and name not in settings.REPLICA_DATABASES
+        ]
+        if self.workers <= 1 or len(names) <= 1:
+            for name in names:
+                try:
+                    self.migrate_connection(
+                        name, self._connections[name], fake,
+                    )
+                except NavigatorError:
+                    raise
+                except Exception as error:
+                    raise MigrationFailed({name: error}) from error
             return
 
-        for name, connection in self._connections.items():
-            logger.info("Migrating database '%s'", name)
-            # Hook for backends needing any database preparation.
-            connection.prepare_database()
-            # Find which apps have migrations and which do not.
-            executor = MigrationExecutor(
-                connection, self.log_migration_progress,
-            )
-            # Raise an error if any migrations are applied before
-            # their dependencies.
-            executor.loader.check_consistent_history(connection)
-
-            # Before anything else, see if there's conflicting apps and drop
-            # out hard if there are any
-            conflicts = executor.loader.detect_conflicts()
-            if conflicts:
-                name_str = "; ".join(
-                    "%s in %s" % (", ".join(names), app)
-                    for app, names in conflicts.items()
-                )
-                raise NavigatorError(
-                    "Conflicting migrations detected; multiple leaf nodes in "
-                    "the migration graph: (%s).\nTo fix them merge "
-                    "the database migrations." % name_str
+        with ThreadPoolExecutor(
+            min(self.workers, len(names)), thread_name_prefix='navigator',
+        ) as executor:
+            futures = {
+                name: executor.submit(self._migrate_in_thread, name, fake)
+                for name in names
+            }
+        failures = {}
+        for name, future in futures.items():
+            error = future.exception()
+            if error is not None:
+                logger.error(
+                    "Migrating database '%s' failed", name, exc_info=error,
                 )
+                failures[name] = error
+        if failures:
+            raise MigrationFailed(failures) from next(iter(failures.values()))
+
+    def _migrate_in_thread(self, name: str, fake: bool):
+        # Connections belong to the thread that opened them, so each
+        # worker migrates with, and then closes, its own.
+        try:
+            self.migrate_connection(name, connections[name], fake)
+        finally:
+            connections.close_all()
+
+    def migrate_connection(
+        self, name: str, connection: DatabaseWrapper, fake: bool = False,
+    ):
+        """Migrates one database unless it's known to be up to date.
+
+        Args:
+            name: Identifier of the database in the settings.
+            connection: Connection to the database.
+            fake: If the migration should be rolled back after
+                application.
+        """
+        start = time.monotonic()
+        fingerprint = self.fingerprint(connection)
+        if (
+            fingerprint is not None
+            and fingerprint == self._cached_fingerprint(name)
+        ):
+            logger.info("Database '%s' is up to date", name)
+            return
+        with self.lock(connection):
+            self.migrate_database(name, connection, fake)
+        self._store_fingerprint(name, self.fingerprint(connection))
+        logger.info(
+            "Database '%s' migrated in %.3fs", name, time.monotonic() - start,
+        )
+
+    def migrate_database(
+        self, name: str, connection: DatabaseWrapper, fake: bool = False,
+    ):
+        """Migrates one database to the most recent version.
+
+        The migration graph is built once and the plan computed from it
+        is the one that gets executed.
+
+        Args:
+            name: Identifier of the database in the settings.
+            connection: Connection to the database.
+            fake: If the migration should be rolled back after
+                application.
+        """
+        # Find which apps have migrations and which do not.
+        executor = MigrationExecutor(
+            connection, partial(self.log_migration_progress, database=name),
+        )
+        # Raise an error if any migrations are applied before
+        # their dependencies.
+        executor.loader.check_consistent_history(connection)
+
+        # Before anything else, see if there's conflicting apps and drop
+        # out hard if there are any
+        conflicts = executor.loader.detect_conflicts()
+        if conflicts:
+            name_str = "; ".join(
+                "%s in %s" % (", ".join(names), app)
+                for app, names in conflicts.items()
+            )
+            raise NavigatorError(
+                "Conflicting migrations detected; multiple leaf nodes in "
+                "the migration graph: (%s).\nTo fix them merge "
+                "the database migrations." % name_str
+            )
+
+        targets = executor.loader.graph.leaf_nodes()
+        # Another server may have applied the migrations while this one
+        # was waiting for the lock.
+        plan = executor.migration_plan(targets)
+        if not plan:
+            logger.info("Database '%s' is up to date", name)
+            return
+
+        if not fake and (self.profile or settings.MIGRATION_BUDGET):
+            self.check_budget(name, connection, plan)
 
-            targets = executor.loader.graph.leaf_nodes()
-            executor.migrate(targets, fake=fake)
-            logger.info("Database '%s' migration successful", name)
+        logger.info("Migrating database '%s'", name)
+        # Hook for backends needing any database preparation.
+        connection.prepare_database()
+        if self.profile and not fake:
+            with self.profiler.profile(name, connection, plan):
+                executor.migrate(targets, plan=plan, fake=fake)
+        else:
+            executor.migrate(targets, plan=plan, fake=fake)
+        logger.info("Database '%s' migration successful", name)
+
+    def check_budget(
+        self, name: str, connection: DatabaseWrapper,
+        plan: List[Tuple[Migration, bool]],
+    ):
+        """Logs how long a plan is estimated to take.
+
+        Args:
+            name: Identifier of the database in the settings.
+            connection: Connection to the database.
+            plan: Migrations about to be applied.
+
+        Raises:
+            NavigatorError: The estimate exceeds the migration budget.
+        """
+        estimates = self.profiler.estimate(connection, plan)
+        for migration, seconds in estimates:
+            logger.info(
+                "Migrating %s on '%s' estimated at %.3fs",
+                migration, name, seconds,
+            )
+        total = sum(seconds for _, seconds in estimates)
+        logger.info("Database '%s' migration estimated at %.3fs", name, total)
+        budget = settings.MIGRATION_BUDGET
+        if budget and total > budget:
+            raise NavigatorError(
+                "Migrating database '%s' is estimated at %.3fs, over the "
+                "budget of %.3fs. Apply the migrations manually or raise "
+                "the budget." % (name, total, budget)
+            )
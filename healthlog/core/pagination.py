@@ -0,0 +1,130 @@
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import date
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Pagination that seeks past the last row of the previous page.
+
+    Rows are ordered from newest to oldest by the ``keyset_fields`` of the
+    view, a date field followed by a unique ID field. The cursor holds the
+    date and ID of the last row that was returned so every page costs the
+    same no matter how far back the client scrolls. No total count is
+    returned.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def __init__(self):
+        self.request = None
+        self.next_cursor = None
+
+    def decode_cursor(self, request) -> Optional[Tuple[date, int]]:
+        """Reads the cursor from the request.
+
+        Returns:
+            Date and ID of the last row of the previous page, or None on
+            the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            date_value, pk = value.split(':')
+            date_value = parse_date(date_value)
+            if date_value is None:
+                raise ValueError(value)
+            return date_value, int(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, date_value: date, pk: int) -> str:
+        value = f'{date_value.isoformat()}:{pk}'
+        return urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        date_field, id_field = view.keyset_fields
+        queryset = queryset.order_by(f'-{date_field}', f'-{id_field}')
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            date_value, pk = cursor
+            queryset = queryset.filter(
+                Q(**{f'{date_field}__lt': date_value})
+                | Q(**{date_field: date_value, f'{id_field}__lt': pk})
+            )
+        # Fetch one extra row to find out if there's another page.
+        results = list(queryset[:self.page_size + 1])
+        if len(results) > self.page_size:
+            results = results[:self.page_size]
+            last = results[-1]
+            self.next_cursor = self.encode_cursor(
+                _resolve(last, date_field), _resolve(last, id_field),
+            )
+        return results
+
+    def get_next_link(self) -> Optional[str]:
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.next_cursor,
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+class DatePagination(PageNumberPagination):
+    """Page number pagination with an opt in keyset mode.
+
+    Requests that include a ``cursor`` query parameter are paginated with
+    ``KeysetPagination``. Setting ``KEYSET_PAGINATION`` makes keyset mode
+    the default for requests that don't ask for a ``page``.
+    """
+    def __init__(self):
+        self.keyset: Optional[KeysetPagination] = None
+
+    def use_keyset(self, request) -> bool:
+        params = request.query_params
+        if KeysetPagination.cursor_query_param in params:
+            return True
+        return (
+            settings.KEYSET_PAGINATION
+            and self.page_query_param not in params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset(request):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+def _resolve(instance, lookup: str):
+    """Follows a ``__`` separated lookup across related objects."""
+    for name in lookup.split('__'):
+        instance = getattr(instance, name)
+    return instance
@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from rest_framework.permissions import BasePermission
 
 
@@ -13,3 +15,17 @@ class IsAPIUser(BasePermission):
 class IsUnauthenticated(BasePermission):
     def has_permission(self, request, view):
         return bool(request.user and not request.user.is_authenticated)
+
+
+class HasMetricsToken(BasePermission):
+    """
+    Allows access to clients sending the metrics token as a bearer token.
+    """
+
+    def has_permission(self, request, view):
+        if not settings.METRICS_TOKEN:
+            return False
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        return constant_time_compare(
+            header, f'Bearer {settings.METRICS_TOKEN}',
+        )
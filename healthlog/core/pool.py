@@ -0,0 +1,304 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Pool size used when neither the settings nor the server size it.
+FALLBACK_SIZE = 10
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class Stats(NamedTuple):
+    """Snapshot of a pool's state and counters.
+
+    Attributes:
+        max_size: Number of connections the pool may hold.
+        size: Number of open connections.
+        idle: Number of connections waiting to be checked out.
+        checkouts: Number of connections handed out.
+        connects: Number of connections opened.
+        discards: Number of connections closed for failing a health check
+            or for being too old or idle.
+        timeouts: Number of checkouts that gave up waiting.
+        wait_seconds: Time spent waiting for a free connection.
+    """
+    max_size: int
+    size: int
+    idle: int
+    checkouts: int
+    connects: int
+    discards: int
+    timeouts: int
+    wait_seconds: float
+
+
+class _Entry:
+    __slots__ = ('connection', 'created', 'released')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = self.released = time.monotonic()
+
+
+class ConnectionPool:
+    """Bounded pool of database connections shared by a process' threads.
+
+    Connections are handed out most recently used first. A connection
+    that sat idle for longer than the check interval is checked before it
+    is handed out, and connections that are too old, idle for too long
+    or unhealthy are closed instead of reused. At most ``max_size``
+    connections are open at a time and checkouts wait for one to be
+    returned when they all are in use.
+
+    Attributes:
+        connect: Opens a new connection.
+        check: Tells if a connection can still be used.
+        reset: Prepares a returned connection for its next use, returning
+            False when it can't be reused.
+        close: Closes a connection.
+        max_size: Number of connections the pool may hold.
+        timeout: Seconds a checkout waits for a free connection.
+        max_lifetime: Seconds a connection is used for at most.
+        max_idle: Seconds an unused connection is kept open.
+        check_interval: Seconds a connection may sit idle before it's
+            checked again on checkout.
+    """
+    def __init__(
+        self, connect: Callable[[], Any], check: Callable[[Any], bool],
+        reset: Callable[[Any], bool], close: Callable[[Any], None],
+        max_size: int, timeout: float = 10, max_lifetime: float = 1800,
+        max_idle: float = 300, check_interval: float = 30,
+    ):
+        self.connect = connect
+        self.check = check
+        self.reset = reset
+        self.close = close
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self._idle: List[_Entry] = []
+        self._used: Dict[int, _Entry] = {}
+        self._opening = 0
+        self._condition = threading.Condition()
+        self._next_reap = time.monotonic() + max_idle
+        self._checkouts = 0
+        self._connects = 0
+        self._discards = 0
+        self._timeouts = 0
+        self._wait_seconds = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self._idle) + len(self._used) + self._opening
+
+    def checkout(self):
+        """Hands out a healthy connection.
+
+        Raises:
+            PoolTimeout: Every connection stayed in use for the timeout.
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._condition:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self.size < self.max_size:
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        'No database connection was returned to the pool '
+                        'of %d within %.1fs' % (self.max_size, self.timeout)
+                    )
+                self._condition.wait(remaining)
+            self._wait_seconds += time.monotonic() - start
+            # Holds the connection's place until it's handed out.
+            self._opening += 1
+
+        try:
+            if entry is not None and not self._usable(entry, checkout=True):
+                self._discard(entry)
+                entry = None
+            if entry is None:
+                entry = _Entry(self.connect())
+                with self._condition:
+                    self._connects += 1
+        except BaseException:
+            with self._condition:
+                self._opening -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._opening -= 1
+            self._used[id(entry.connection)] = entry
+            self._checkouts += 1
+        self.reap()
+        return entry.connection
+
+    def checkin(self, connection):
+        """Returns a connection handed out by the pool."""
+        with self._condition:
+            entry = self._used.pop(id(connection), None)
+        if entry is None:
+            # The pool was cleared while the connection was in use.
+            self.close(connection)
+            return
+        if not self._usable(entry) or not self.reset(connection):
+            self._discard(entry)
+            with self._condition:
+                self._condition.notify()
+            return
+        entry.released = time.monotonic()
+        with self._condition:
+            self._idle.append(entry)
+            self._condition.notify()
+
+    def reap(self):
+        """Closes the connections that have been idle for too long."""
+        now = time.monotonic()
+        with self._condition:
+            if now < self._next_reap:
+                return
+            self._next_reap = now + min(self.max_idle, self.check_interval)
+            expired = [
+                entry for entry in self._idle
+                if now - entry.released > self.max_idle
+                or now - entry.created > self.max_lifetime
+            ]
+            self._idle = [
+                entry for entry in self._idle if entry not in expired
+            ]
+        for entry in expired:
+            self._discard(entry)
+        if expired:
+            logger.debug('Closed %d idle database connections', len(expired))
+
+    def clear(self):
+        """Closes the idle connections and forgets the ones in use."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._used.clear()
+        for entry in idle:
+            self.close(entry.connection)
+
+    def stats(self) -> Stats:
+        with self._condition:
+            return Stats(
+                self.max_size, self.size, len(self._idle), self._checkouts,
+                self._connects, self._discards, self._timeouts,
+                self._wait_seconds,
+            )
+
+    def _usable(self, entry: _Entry, checkout: bool = False) -> bool:
+        now = time.monotonic()
+        if now - entry.created > self.max_lifetime:
+            return False
+        if checkout and now - entry.released > self.check_interval:
+            return self.check(entry.connection)
+        return True
+
+    def _discard(self, entry: _Entry):
+        with self._condition:
+            self._discards += 1
+        try:
+            self.close(entry.connection)
+        except Exception:
+            logger.debug(
+                'Failed to close a database connection', exc_info=True,
+            )
+
+
+_pools: Dict[str, ConnectionPool] = OrderedDict()
+_pools_lock = threading.Lock()
+# Size of the pools that aren't sized by the settings.
+default_size = 0
+# Connections inherited from the parent process. Closing them would close
+# the parent's connections too, so they're kept open and never used.
+_inherited: List[ConnectionPool] = []
+
+
+def get_pool(
+    alias: str, factory: Callable[[], ConnectionPool],
+) -> ConnectionPool:
+    """Pool of a database, created by the factory the first time."""
+    try:
+        return _pools[alias]
+    except KeyError:
+        pass
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = factory()
+        return _pools[alias]
+
+
+def pool_size(configured: int) -> int:
+    """Size of a pool given the size in the settings, zero if unset."""
+    return configured or default_size or FALLBACK_SIZE
+
+
+def close_all():
+    """Closes every pool, before forking for example."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.clear()
+
+
+def _after_fork():
+    _inherited.extend(_pools.values())
+    _pools.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def render() -> str:
+    """Stats of every pool in the Prometheus text exposition format."""
+    metrics = (
+        ('db_pool_max_size', 'gauge', 'Connections the pool may hold.',
+         'max_size'),
+        ('db_pool_size', 'gauge', 'Open connections.', 'size'),
+        ('db_pool_idle', 'gauge', 'Connections waiting to be used.', 'idle'),
+        ('db_pool_checkouts_total', 'counter', 'Connections handed out.',
+         'checkouts'),
+        ('db_pool_connects_total', 'counter', 'Connections opened.',
+         'connects'),
+        ('db_pool_discards_total', 'counter',
+         'Connections closed for being unhealthy, too old or idle.',
+         'discards'),
+        ('db_pool_timeouts_total', 'counter',
+         'Checkouts that gave up waiting for a connection.', 'timeouts'),
+        ('db_pool_wait_seconds_total', 'counter',
+         'Time spent waiting for a free connection.', 'wait_seconds'),
+    )
+    stats = [(alias, pool.stats()) for alias, pool in list(_pools.items())]
+    lines = []
+    for name, kind, description, field in metrics:
+        metric = f'healthlog_{name}'
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for alias, pool_stats in stats:
+            value = getattr(pool_stats, field)
+            lines.append(f'{metric}{{database="{alias}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+metrics.registry.collectors.append(render)
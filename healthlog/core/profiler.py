@@ -0,0 +1,321 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.apps import apps
+from django.db.backends.base.base import BaseDatabaseWrapper as DatabaseWrapper
+from django.db.migrations.migration import Migration
+from django.db.migrations.operations.base import Operation
+from django.db.migrations.operations.models import CreateModel, ModelOperation
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Time assumed for an operation on a table before its rows are counted.
+OPERATION_SECONDS = 0.01
+# Time assumed per row for operations that have never been profiled.
+ROW_SECONDS = 0.00001
+
+# Operations are shared by every loader of a migration, so their methods
+# are wrapped once, for as long as any profile needs them, and the
+# wrappers dispatch to the hooks of the profile running in their thread.
+_wrapped: Dict[Tuple[int, str], list] = {}
+_wrapped_lock = threading.Lock()
+_local = threading.local()
+
+Hook = Callable[..., object]
+
+
+def _dispatch(operation: Operation, method_name: str, method: Callable):
+    def profiled(*args, **kwargs):
+        hook = getattr(_local, 'hooks', {}).get((id(operation), method_name))
+        if hook is None:
+            return method(*args, **kwargs)
+        return hook(method, *args, **kwargs)
+    return profiled
+
+
+def _wrap(operation: Operation, method_name: str):
+    """Starts sending the calls of an operation method to the hooks."""
+    key = (id(operation), method_name)
+    with _wrapped_lock:
+        if key in _wrapped:
+            _wrapped[key][0] += 1
+            return
+        original = operation.__dict__.get(method_name)
+        _wrapped[key] = [1, original]
+        setattr(operation, method_name, _dispatch(
+            operation, method_name, getattr(operation, method_name),
+        ))
+
+
+def _unwrap(operation: Operation, method_name: str):
+    """Restores the original method once no profile needs it."""
+    key = (id(operation), method_name)
+    with _wrapped_lock:
+        _wrapped[key][0] -= 1
+        if _wrapped[key][0] > 0:
+            return
+        original = _wrapped.pop(key)[1]
+        if original is None:
+            delattr(operation, method_name)
+        else:
+            setattr(operation, method_name, original)
+
+
+def operation_table(app_label: str, operation: Operation) -> Optional[str]:
+    """Table whose rows an operation has to go through.
+
+    Args:
+        app_label: Label of the app of the operation's migration.
+        operation: Migration operation.
+
+    Returns:
+        Name of the table, or None for operations that don't work on an
+        existing table.
+    """
+    model_name = getattr(operation, 'model_name', None)
+    if (
+        model_name is None
+        and isinstance(operation, ModelOperation)
+        and not isinstance(operation, CreateModel)
+    ):
+        model_name = operation.name
+    if model_name is None:
+        return None
+    try:
+        return apps.get_model(app_label, model_name)._meta.db_table
+    except LookupError:
+        # Removed models used the default table name.
+        return f'{app_label}_{model_name.lower()}'
+
+
+def row_count(connection: DatabaseWrapper, table: str) -> int:
+    """Number of rows of a table.
+
+    PostgreSQL's planner estimate is used instead of counting the rows.
+    Tables that don't exist have no rows.
+    """
+    with connection.cursor() as cursor:
+        if table not in connection.introspection.table_names(cursor):
+            return 0
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [table],
+            )
+        else:
+            cursor.execute(
+                'SELECT COUNT(*) FROM %s' % connection.ops.quote_name(table),
+            )
+        row = cursor.fetchone()
+    return max(int(row[0]), 0) if row else 0
+
+
+class MigrationProfiler:
+    """Records how long migrations take and estimates pending ones.
+
+    Profiled migrations are added to a JSON history with the SQL and
+    duration of each of their operations and the number of rows of the
+    table the operation worked on. Estimates use the recorded duration of
+    the same operation scaled to the current number of rows, or the
+    average time per row of the same kind of operation when it was never
+    profiled.
+
+    Attributes:
+        path: JSON file the history is kept in.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._history: Optional[List[dict]] = None
+        self._lock = threading.Lock()
+
+    def history(self) -> List[dict]:
+        """Profiled migrations in the order they were applied."""
+        with self._lock:
+            if self._history is None:
+                try:
+                    with open(self.path) as history_file:
+                        self._history = json.load(history_file)
+                except FileNotFoundError:
+                    self._history = []
+                except (OSError, ValueError):
+                    logger.warning(
+                        "Couldn't read the migration history '%s'", self.path,
+                    )
+                    self._history = []
+            return list(self._history)
+
+    def record(self, migrations: List[dict]):
+        """Adds profiled migrations to the history."""
+        self.history()
+        with self._lock:
+            self._history.extend(migrations)
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            temporary_path = f'{self.path}.{threading.get_ident()}.tmp'
+            with open(temporary_path, 'w') as history_file:
+                json.dump(self._history, history_file, indent=2)
+            os.replace(temporary_path, self.path)
+
+    def rates(self) -> Dict[str, float]:
+        """Average seconds per row indexed by the kind of operation."""
+        durations: Dict[str, float] = {}
+        rows: Dict[str, int] = {}
+        for migration in self.history():
+            for operation in migration['operations']:
+                if not operation['rows']:
+                    continue
+                kind = operation['operation']
+                duration = durations.get(kind, 0) + operation['duration']
+                durations[kind] = duration
+                rows[kind] = rows.get(kind, 0) + operation['rows']
+        return {kind: durations[kind] / rows[kind] for kind in durations}
+
+    def estimate(
+        self, connection: DatabaseWrapper,
+        plan: List[Tuple[Migration, bool]],
+    ) -> List[Tuple[Migration, float]]:
+        """Estimates how long each migration of a plan will take.
+
+        Args:
+            connection: Connection to the database to migrate.
+            plan: Migrations to apply, or unapply when backwards.
+
+        Returns:
+            Migrations of the plan with their estimated duration in
+            seconds.
+        """
+        rates = self.rates()
+        recorded = {}
+        for migration in self.history():
+            key = (migration['migration'], migration['backwards'])
+            recorded[key] = {
+                operation['index']: operation
+                for operation in migration['operations']
+            }
+        counts: Dict[str, int] = {}
+        estimates = []
+        for migration, backwards in plan:
+            operations = recorded.get((str(migration), backwards), {})
+            seconds = 0.0
+            for index, operation in enumerate(migration.operations):
+                table = operation_table(migration.app_label, operation)
+                if table is not None and table not in counts:
+                    counts[table] = row_count(connection, table)
+                rows = counts.get(table, 0)
+                previous = operations.get(index)
+                if previous is not None:
+                    # Scale the time the same operation took before.
+                    duration = previous['duration']
+                    if previous['rows'] and rows:
+                        duration *= rows / previous['rows']
+                else:
+                    rate = rates.get(type(operation).__name__, ROW_SECONDS)
+                    duration = OPERATION_SECONDS + rows * rate
+                seconds += duration
+            estimates.append((migration, seconds))
+        return estimates
+
+    @contextmanager
+    def profile(
+        self, name: str, connection: DatabaseWrapper,
+        plan: List[Tuple[Migration, bool]],
+    ):
+        """Profiles the operations of a plan while it's executed.
+
+        The migrations that ran are added to the history even when one of
+        them fails. Only the plan executed by the current thread is timed,
+        so databases can be profiled concurrently, and the operations get
+        their original methods back afterwards.
+
+        Args:
+            name: Identifier of the database in the settings.
+            connection: Connection to the database to migrate.
+            plan: Migrations about to be applied, or unapplied when
+                backwards.
+        """
+        migrations = []
+        current: List[Optional[dict]] = [None]
+
+        def log_query(execute, sql, params, many, context):
+            start = time.monotonic()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                if current[0] is not None:
+                    current[0]['queries'].append({
+                        'sql': sql,
+                        'duration': time.monotonic() - start,
+                    })
+
+        def hook(migration, record, index, operation) -> Hook:
+            table = operation_table(migration.app_label, operation)
+
+            def profiled(method, *args, **kwargs):
+                if not record['operations']:
+                    migrations.append(record)
+                rows = row_count(connection, table) if table else 0
+                profile = {
+                    'index': index,
+                    'operation': type(operation).__name__,
+                    'description': operation.describe(),
+                    'table': table,
+                    'rows': rows,
+                    'queries': [],
+                    'duration': 0.0,
+                }
+                record['operations'].append(profile)
+                current[0] = profile
+                start = time.monotonic()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    profile['duration'] = time.monotonic() - start
+                    record['duration'] += profile['duration']
+                    current[0] = None
+
+            return profiled
+
+        hooks: Dict[Tuple[int, str], Hook] = {}
+        wrapped = []
+        for migration, backwards in plan:
+            record = {
+                'database': name,
+                'migration': str(migration),
+                'backwards': backwards,
+                'recorded_on': timezone.now().isoformat(),
+                'duration': 0.0,
+                'operations': [],
+            }
+            method_name = (
+                'database_backwards' if backwards else 'database_forwards'
+            )
+            for index, operation in enumerate(migration.operations):
+                hooks[(id(operation), method_name)] = hook(
+                    migration, record, index, operation,
+                )
+                wrapped.append((operation, method_name))
+
+        previous = getattr(_local, 'hooks', {})
+        _local.hooks = hooks
+        for operation, method_name in wrapped:
+            _wrap(operation, method_name)
+
+        try:
+            with connection.execute_wrapper(log_query):
+                yield
+        finally:
+            _local.hooks = previous
+            for operation, method_name in wrapped:
+                _unwrap(operation, method_name)
+            if migrations:
+                self.record(migrations)
+                logger.info(
+                    "Recorded %d migration profiles of '%s' in '%s'",
+                    len(migrations), name, self.path,
+                )
@@ -0,0 +1,546 @@
+import logging
+import threading
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from django.db import connections, router, transaction
+from django.db.models import Avg, Count, F, FloatField, Sum, Value
+from django.db.models.functions import Cast
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Rollup tables and the fields that make up the key of each row.
+ROLLUPS = (
+    (
+        models.FoodRollup,
+        ('date', 'food_id', 'birth_year', 'condition_id', 'ailment_id'),
+    ),
+    (
+        models.AilmentRollup,
+        ('date', 'ailment_id', 'birth_year', 'condition_id', 'food_id'),
+    ),
+    (models.UserFoodRollup, ('user_id', 'food_id')),
+    (models.UserAilmentRollup, ('user_id', 'ailment_id')),
+)
+DAILY_ROLLUPS = (models.FoodRollup, models.AilmentRollup)
+# Databases that can insert rollup rows or add to the existing ones in a
+# single statement, and the number of rows written at a time.
+UPSERT_VENDORS = ('postgresql', 'sqlite')
+UPSERT_BATCH_SIZE = 100
+
+Totals = Dict[type, Counter]
+
+_state = threading.local()
+
+
+def _pending() -> Dict[int, list]:
+    """Logs currently being changed by this thread.
+
+    Returns:
+        Dictionary of ``[depth, totals]`` pairs indexed by the log ID.
+    """
+    if not hasattr(_state, 'pending'):
+        _state.pending = {}
+    return _state.pending
+
+
+def _empty() -> Totals:
+    return {model: Counter() for model, _ in ROLLUPS}
+
+
+def snapshot(log_ids: Iterable[int]) -> Dict[int, Totals]:
+    """Computes what each log currently contributes to the rollups.
+
+    Args:
+        log_ids: IDs of the logs to compute the contributions of.
+
+    Returns:
+        Rollup totals indexed by the log ID. Logs that no longer exist
+        contribute nothing.
+    """
+    log_ids = list(log_ids)
+    results = {log_id: _empty() for log_id in log_ids}
+    if not log_ids:
+        return results
+
+    logs = models.Log.objects.filter(pk__in=log_ids).values_list(
+        'id', 'date', 'user_id', 'user__info__birth_date',
+    )
+    logs = list(logs)
+    user_ids = {user_id for _, _, user_id, _ in logs}
+    conditions = defaultdict(list)
+    through = models.User.conditions.through.objects.filter(
+        user_id__in=user_ids,
+    )
+    for user_id, condition_id in through.values_list(
+        'user_id', 'condition_id',
+    ):
+        conditions[user_id].append(condition_id)
+    ailments = defaultdict(list)
+    through = models.Log.ailments.through.objects.filter(log_id__in=log_ids)
+    for log_id, ailment_id in through.values_list('log_id', 'ailment_id'):
+        ailments[log_id].append(ailment_id)
+    # Meals are counted, not their servings, like the dashboard always
+    # did when it counted the meal rows of each food.
+    foods = defaultdict(Counter)
+    meals = models.Meal.objects.filter(log_id__in=log_ids)
+    for log_id, food_id in meals.values_list('log_id', 'food_id'):
+        foods[log_id][food_id] += 1
+
+    for log_id, log_date, user_id, birth_date in logs:
+        totals = results[log_id]
+        birth_year = birth_date.year if birth_date else None
+        log_conditions = [None] + conditions[user_id]
+        log_ailments = ailments[log_id]
+        log_foods = foods[log_id]
+        for food_id, meal_count in log_foods.items():
+            totals[models.UserFoodRollup][(user_id, food_id)] += 1
+            for condition_id in log_conditions:
+                for ailment_id in [None] + log_ailments:
+                    key = (
+                        log_date, food_id, birth_year,
+                        condition_id, ailment_id,
+                    )
+                    totals[models.FoodRollup][key] += meal_count
+        for ailment_id in log_ailments:
+            totals[models.UserAilmentRollup][(user_id, ailment_id)] += 1
+            for condition_id in log_conditions:
+                for food_id in [None] + list(log_foods):
+                    key = (
+                        log_date, ailment_id, birth_year,
+                        condition_id, food_id,
+                    )
+                    totals[models.AilmentRollup][key] += 1
+    return results
+
+
+def _order(key: tuple) -> tuple:
+    """Sorts keys with empty values so rows are always locked in order."""
+    return tuple((value is not None, value) for value in key)
+
+
+def _upsert(model, fields, rows: List[tuple]):
+    """Adds amounts to rollup rows, inserting the ones that are missing.
+
+    The rows are written with ``INSERT ... ON CONFLICT DO UPDATE``
+    against the unique key of the table, so concurrent writers can't
+    create the same row twice.
+
+    Args:
+        model: Rollup model.
+        fields: Fields that make up the key of each row.
+        rows: Key values of each row followed by the amount to add.
+    """
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor not in UPSERT_VENDORS:
+        for *key, amount in rows:
+            lookup = dict(zip(fields, key))
+            updated = model.objects.filter(**lookup).update(
+                total=F('total') + amount,
+            )
+            if not updated:
+                model.objects.create(total=amount, **lookup)
+        return
+
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    model_fields = [model._meta.get_field(name) for name in fields]
+    model_fields.append(model._meta.get_field('total'))
+    columns = ', '.join(quote(field.column) for field in model_fields)
+    # Matches the unique indexes, where empty values are equal.
+    target = ', '.join(
+        f'(COALESCE({quote(field.column)}, 0))' if field.null
+        else quote(field.column)
+        for field in model_fields[:-1]
+    )
+    placeholders = '(%s)' % ', '.join(['%s'] * len(model_fields))
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        batch = rows[start:start + UPSERT_BATCH_SIZE]
+        params = [
+            field.get_db_prep_value(value, connection)
+            for row in batch
+            for field, value in zip(model_fields, row)
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) VALUES '
+                f'{", ".join([placeholders] * len(batch))} '
+                f'ON CONFLICT ({target}) DO UPDATE '
+                f'SET total = {table}.total + EXCLUDED.total',
+                params,
+            )
+
+
+def _write(totals: Totals):
+    """Adds the totals to the stored rollup rows.
+
+    Args:
+        totals: Amount to add to each rollup row. Negative amounts are
+            subtracted.
+    """
+    with transaction.atomic():
+        for model, fields in ROLLUPS:
+            added = []
+            for key in sorted(totals[model], key=_order):
+                amount = totals[model][key]
+                if amount > 0:
+                    added.append(key + (amount,))
+                elif amount < 0:
+                    # Rows that are subtracted from were added before.
+                    # Keys are unique, so this is a single row.
+                    model.objects.filter(**dict(zip(fields, key))).update(
+                        total=F('total') + amount,
+                    )
+            if added:
+                _upsert(model, fields, added)
+
+
+def begin(log_ids: Iterable[int]) -> List[int]:
+    """Marks the start of a change to the given logs.
+
+    Records the current contribution of each log so that only the
+    difference has to be written once the change is complete. Changes
+    can be nested, like meals deleted by a log deletion, in which case
+    the outermost change writes the difference.
+
+    Within a transaction the logs are locked until it ends, so that a
+    concurrent change to them waits instead of recording the same
+    contribution and counting this change again. The model saves and
+    deletions that call this are always in one.
+
+    Args:
+        log_ids: IDs of the logs that are about to change.
+
+    Returns:
+        IDs of the logs that have to be passed to ``end``.
+    """
+    pending = _pending()
+    log_ids = [log_id for log_id in set(log_ids) if log_id is not None]
+    new_ids = [log_id for log_id in log_ids if log_id not in pending]
+    alias = router.db_for_write(models.Log)
+    if new_ids and transaction.get_connection(alias).in_atomic_block:
+        # Locked in order so concurrent changes can't deadlock.
+        list(models.Log.objects.using(alias).select_for_update().filter(
+            pk__in=new_ids,
+        ).order_by('pk').values_list('pk', flat=True))
+    for log_id, totals in snapshot(new_ids).items():
+        pending[log_id] = [0, totals]
+    for log_id in log_ids:
+        pending[log_id][0] += 1
+    return log_ids
+
+
+def end(log_ids: Iterable[int]):
+    """Marks the end of a change to the given logs.
+
+    Args:
+        log_ids: IDs returned by the matching ``begin`` call.
+    """
+    pending = _pending()
+    finished = {}
+    for log_id in log_ids:
+        if log_id not in pending:
+            continue
+        pending[log_id][0] -= 1
+        if pending[log_id][0] <= 0:
+            finished[log_id] = pending.pop(log_id)[1]
+    if not finished:
+        return
+    delta = _empty()
+    for log_id, totals in snapshot(finished).items():
+        for model, _ in ROLLUPS:
+            delta[model].update(totals[model])
+            delta[model].subtract(finished[log_id][model])
+    _write(delta)
+
+
+def reset(**kwargs):
+    """Forgets about any changes that were never completed."""
+    _pending().clear()
+
+
+class track:
+    """Context manager that updates rollups around a change to logs.
+
+    Used for writes that don't send model signals, like ``bulk_create``,
+    within a transaction that keeps the logs locked until it's done.
+
+    Args:
+        log_ids: IDs of the logs that are about to change.
+    """
+    def __init__(self, log_ids: Iterable[int]):
+        self.log_ids = list(log_ids)
+
+    def __enter__(self):
+        self.log_ids = begin(self.log_ids)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            end(self.log_ids)
+        else:
+            for log_id in self.log_ids:
+                _pending().pop(log_id, None)
+
+
+def logs_for_users(user_ids: Iterable[int]) -> List[int]:
+    """IDs of every log that belongs to the given users."""
+    return list(models.Log.objects.filter(
+        user_id__in=user_ids,
+    ).values_list('pk', flat=True))
+
+
+# Every condition of each user, plus an empty one for the rows counting
+# all the users, and the same for the ailments and the foods of each log.
+USER_CONDITIONS_SQL = (
+    'SELECT id AS user_id, CAST(NULL AS INTEGER) AS condition_id '
+    'FROM {user} UNION ALL SELECT user_id, condition_id FROM {conditions}'
+)
+LOG_AILMENTS_SQL = (
+    'SELECT id AS log_id, CAST(NULL AS INTEGER) AS ailment_id FROM {log} '
+    'UNION ALL SELECT log_id, ailment_id FROM {ailments}'
+)
+LOG_FOODS_SQL = (
+    'SELECT id AS log_id, CAST(NULL AS INTEGER) AS food_id FROM {log} '
+    'UNION ALL SELECT DISTINCT log_id, food_id FROM {meal}'
+)
+REBUILD_SQL = (
+    (
+        models.FoodRollup,
+        'INSERT INTO {food_rollup} '
+        '(date, food_id, birth_year, condition_id, ailment_id, total) '
+        'SELECT log.date, meal.food_id, {birth_year}, '
+        'conditions.condition_id, ailments.ailment_id, COUNT(*) '
+        'FROM {meal} meal '
+        'JOIN {log} log ON log.id = meal.log_id '
+        'JOIN {user} u ON u.id = log.user_id '
+        'LEFT JOIN {info} info ON info.id = u.info_id '
+        f'JOIN ({USER_CONDITIONS_SQL}) conditions '
+        'ON conditions.user_id = log.user_id '
+        f'JOIN ({LOG_AILMENTS_SQL}) ailments ON ailments.log_id = log.id '
+        'GROUP BY log.date, meal.food_id, {birth_year}, '
+        'conditions.condition_id, ailments.ailment_id',
+    ),
+    (
+        models.AilmentRollup,
+        'INSERT INTO {ailment_rollup} '
+        '(date, ailment_id, birth_year, condition_id, food_id, total) '
+        'SELECT log.date, log_ailment.ailment_id, {birth_year}, '
+        'conditions.condition_id, foods.food_id, COUNT(*) '
+        'FROM {ailments} log_ailment '
+        'JOIN {log} log ON log.id = log_ailment.log_id '
+        'JOIN {user} u ON u.id = log.user_id '
+        'LEFT JOIN {info} info ON info.id = u.info_id '
+        f'JOIN ({USER_CONDITIONS_SQL}) conditions '
+        'ON conditions.user_id = log.user_id '
+        f'JOIN ({LOG_FOODS_SQL}) foods ON foods.log_id = log.id '
+        'GROUP BY log.date, log_ailment.ailment_id, {birth_year}, '
+        'conditions.condition_id, foods.food_id',
+    ),
+    (
+        models.UserFoodRollup,
+        'INSERT INTO {user_food_rollup} (user_id, food_id, total) '
+        'SELECT user_id, food_id, COUNT(DISTINCT log_id) FROM {meal} '
+        'GROUP BY user_id, food_id',
+    ),
+    (
+        models.UserAilmentRollup,
+        'INSERT INTO {user_ailment_rollup} (user_id, ailment_id, total) '
+        'SELECT log.user_id, log_ailment.ailment_id, COUNT(*) '
+        'FROM {ailments} log_ailment '
+        'JOIN {log} log ON log.id = log_ailment.log_id '
+        'GROUP BY log.user_id, log_ailment.ailment_id',
+    ),
+)
+
+
+def rebuild():
+    """Recomputes every rollup table from the logs and meals.
+
+    Each table is filled by a single ``INSERT ... SELECT`` that lets the
+    database aggregate the rows, the same way ``snapshot`` counts them
+    for a single log.
+    """
+    connection = connections[router.db_for_write(models.FoodRollup)]
+    quote = connection.ops.quote_name
+    tables = {
+        name: quote(model._meta.db_table) for name, model in (
+            ('user', models.User), ('info', models.Info),
+            ('conditions', models.User.conditions.through),
+            ('log', models.Log), ('ailments', models.Log.ailments.through),
+            ('meal', models.Meal), ('food_rollup', models.FoodRollup),
+            ('ailment_rollup', models.AilmentRollup),
+            ('user_food_rollup', models.UserFoodRollup),
+            ('user_ailment_rollup', models.UserAilmentRollup),
+        )
+    }
+    birth_year = 'CAST(%s AS INTEGER)' % connection.ops.date_extract_sql(
+        'year', 'info.birth_date',
+    )
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            for model, sql in REBUILD_SQL:
+                model.objects.using(connection.alias).all().delete()
+                cursor.execute(sql.format(birth_year=birth_year, **tables))
+
+
+def _birth_year(age: Optional[int]) -> Optional[int]:
+    """Birth year of someone who is ``age`` years old today."""
+    if age is None:
+        return None
+    return (date.today() - timedelta(days=365 * age)).year
+
+
+def _filter_slice(
+    queryset, min_age: Optional[int], max_age: Optional[int],
+    min_date: Optional[date] = None, max_date: Optional[date] = None,
+):
+    min_year = _birth_year(max_age)
+    if min_year is not None:
+        queryset = queryset.filter(birth_year__gte=min_year)
+    max_year = _birth_year(min_age)
+    if max_year is not None:
+        queryset = queryset.filter(birth_year__lte=max_year)
+    if min_date is not None:
+        queryset = queryset.filter(date__gte=min_date)
+    if max_date is not None:
+        queryset = queryset.filter(date__lte=max_date)
+    return queryset
+
+
+def matching_users(
+    min_age: Optional[int], max_age: Optional[int],
+    condition: Optional[models.Condition] = None,
+    ailment: Optional[models.Ailment] = None,
+    food: Optional[models.Food] = None,
+):
+    """Users that match the analytics filters.
+
+    Args:
+        min_age: Minimum age of the users.
+        max_age: Maximum age of the users.
+        condition: Condition the users need to have.
+        ailment: Ailment the users need to have recorded.
+        food: Food the users need to have eaten.
+
+    Returns:
+        Queryset of the matching users.
+    """
+    users = models.User.objects.all()
+    min_year = _birth_year(max_age)
+    if min_year is not None:
+        users = users.filter(info__birth_date__year__gte=min_year)
+    max_year = _birth_year(min_age)
+    if max_year is not None:
+        users = users.filter(info__birth_date__year__lte=max_year)
+    if condition is not None:
+        users = users.filter(conditions=condition)
+    if ailment is not None:
+        users = users.filter(pk__in=models.UserAilmentRollup.objects.filter(
+            ailment=ailment, total__gte=1,
+        ).values('user'))
+    if food is not None:
+        users = users.filter(pk__in=models.UserFoodRollup.objects.filter(
+            food=food, total__gte=1,
+        ).values('user'))
+    return users
+
+
+def top_foods(
+    min_age: Optional[int] = None, max_age: Optional[int] = None,
+    condition: Optional[models.Condition] = None,
+    ailment: Optional[models.Ailment] = None,
+    min_date: Optional[date] = None, max_date: Optional[date] = None,
+    limit: Optional[int] = None,
+) -> List[Dict]:
+    """Foods eaten most often by the matching users.
+
+    Ages are resolved to the birth year of the users.
+
+    Returns:
+        List of dictionaries with the food ``name`` and its ``total``.
+    """
+    queryset = _filter_slice(
+        models.FoodRollup.objects.filter(
+            condition=condition, ailment=ailment,
+        ),
+        min_age, max_age, min_date, max_date,
+    )
+    queryset = queryset.values(name=F('food__name')).annotate(
+        total=Sum('total'),
+    ).order_by('-total').filter(total__gte=1)
+    return list(queryset[:limit or 5])
+
+
+def top_ailments(
+    min_age: Optional[int] = None, max_age: Optional[int] = None,
+    condition: Optional[models.Condition] = None,
+    food: Optional[models.Food] = None,
+    min_date: Optional[date] = None, max_date: Optional[date] = None,
+    limit: Optional[int] = None,
+) -> List[Dict]:
+    """Ailments recorded most often by the matching users.
+
+    Ages are resolved to the birth year of the users.
+
+    Returns:
+        List of dictionaries with the ailment ``name`` and its ``total``.
+    """
+    queryset = _filter_slice(
+        models.AilmentRollup.objects.filter(condition=condition, food=food),
+        min_age, max_age, min_date, max_date,
+    )
+    queryset = queryset.values(name=F('ailment__name')).annotate(
+        total=Sum('total'),
+    ).order_by('-total').filter(total__gte=1)
+    return list(queryset[:limit or 5])
+
+
+def top_conditions(
+    min_age: Optional[int] = None, max_age: Optional[int] = None,
+    ailment: Optional[models.Ailment] = None,
+    food: Optional[models.Food] = None,
+    limit: Optional[int] = None,
+) -> List[Dict]:
+    """Conditions shared by the most matching users.
+
+    Ages are resolved to the birth year of the users.
+
+    Returns:
+        List of dictionaries with the condition ``name`` and its
+        ``total``.
+    """
+    users = matching_users(min_age, max_age, ailment=ailment, food=food)
+    queryset = models.User.conditions.through.objects.filter(
+        user__in=users.values('pk'),
+    )
+    queryset = queryset.values(name=F('condition__name')).annotate(
+        total=Count('user'),
+    ).order_by('-total').filter(total__gte=1)
+    return list(queryset[:limit or 5])
+
+
+def average_bmi(
+    min_age: Optional[int] = None, max_age: Optional[int] = None,
+    condition: Optional[models.Condition] = None,
+    ailment: Optional[models.Ailment] = None,
+    food: Optional[models.Food] = None,
+) -> Optional[float]:
+    """Average body mass index of the matching users.
+
+    Ages are resolved to the birth year of the users.
+
+    Returns:
+        Average BMI rounded to two decimals, or None without any users.
+    """
+    users = matching_users(min_age, max_age, condition, ailment, food)
+    result = users.annotate(bmi=(
+        Cast(Value(703) * F('info__weight'), FloatField())
+        / Cast(F('info__height') * F('info__height'), FloatField())
+    )).aggregate(average_bmi=Avg('bmi'))
+    if not result['average_bmi']:
+        return None
+    return round(result['average_bmi'], 2)
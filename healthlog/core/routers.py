@@ -0,0 +1,139 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Apps whose tables are always read from the primary. Cache entries have
+# to be current for invalidation to work.
+PRIMARY_APPS = {'django_cache'}
+
+# Seconds a replica is behind the primary, zero when it has replayed
+# everything it received.
+LAG_SQL = (
+    'SELECT CASE WHEN NOT pg_is_in_recovery() '
+    'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+_state = threading.local()
+# Whether each replica was fresh when last checked, and when that was.
+_checks: Dict[str, Tuple[float, bool]] = {}
+_checks_lock = threading.Lock()
+
+
+def reset(**kwargs):
+    """Forgets about the writes of the previous request."""
+    _state.pinned = False
+    _state.replica = False
+
+
+@contextmanager
+def replica_reads():
+    """Routes the reads within the block to a read replica.
+
+    Reads still go to the primary after a write in the same request, or
+    when no replica is fresh enough.
+    """
+    previous = getattr(_state, 'replica', False)
+    _state.replica = True
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+@contextmanager
+def primary_reads():
+    """Routes the reads within the block to the primary database.
+
+    Used for values that outlive the request, like cached responses, which
+    must not be computed from a replica that hasn't caught up with the
+    write that invalidated them.
+    """
+    previous = getattr(_state, 'replica', False)
+    _state.replica = False
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def replica_lag(alias: str) -> float:
+    """Seconds a replica is behind the primary."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        lag = cursor.fetchone()[0]
+    return float(lag or 0)
+
+
+def is_fresh(alias: str) -> bool:
+    """If a replica is reachable and within the allowed lag.
+
+    The result is remembered for the check interval.
+    """
+    now = time.monotonic()
+    checked = _checks.get(alias)
+    interval = settings.DB_REPLICA_CHECK_INTERVAL
+    if checked is not None and now - checked[0] < interval:
+        return checked[1]
+    try:
+        lag = replica_lag(alias)
+    except DatabaseError:
+        logger.warning("Replica '%s' is unreachable", alias, exc_info=True)
+        connections[alias].close()
+        fresh = False
+    else:
+        fresh = lag <= settings.DB_REPLICA_MAX_LAG
+        if not fresh:
+            logger.warning("Replica '%s' is %.1fs behind", alias, lag)
+    with _checks_lock:
+        _checks[alias] = (now, fresh)
+    return fresh
+
+
+def fresh_replicas() -> List[str]:
+    return [
+        alias for alias in settings.REPLICA_DATABASES if is_fresh(alias)
+    ]
+
+
+class ReplicaRouter:
+    """Sends reads within ``replica_reads`` blocks to the read replicas.
+
+    Any write pins the rest of the request to the primary so it reads
+    its own writes. Only the primary is migrated.
+    """
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        if (
+            not getattr(_state, 'replica', False)
+            or getattr(_state, 'pinned', False)
+            or model._meta.app_label in PRIMARY_APPS
+        ):
+            return None
+        replicas = fresh_replicas()
+        if not replicas:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints) -> str:
+        _state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints) -> Optional[bool]:
+        if db in settings.REPLICA_DATABASES:
+            return False
+        return None
@@ -0,0 +1,177 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from . import caching, models
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# Same default as the pg_trgm similarity threshold.
+SIMILARITY_THRESHOLD = 0.3
+
+_word_pattern = re.compile(r'[^\W_]+')
+
+
+def normalize(text: str) -> str:
+    """Lower cases a name and collapses everything but words to spaces."""
+    return ' '.join(_word_pattern.findall(text.lower()))
+
+
+def trigrams(text: str) -> Set[str]:
+    """Trigrams of a name, extracted the same way as pg_trgm does."""
+    result = set()
+    for word in normalize(text).split():
+        padded = f'  {word} '
+        for index in range(len(padded) - 2):
+            result.add(padded[index:index + 3])
+    return result
+
+
+class FoodIndex:
+    """In-process search index of food names.
+
+    Used on databases that don't support trigram indexes. The index is
+    built from the database on the first search. Every change to the
+    foods invalidates the ``foods`` cache namespace, whichever process
+    makes it, so the index is rebuilt when it was built for another
+    version of the namespace.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self._version: Optional[str] = None
+        self._names: Dict[int, str] = {}
+        self._trigrams: Dict[int, Set[str]] = {}
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        self._words: List[Tuple[str, int]] = []
+
+    def _add(self, pk: int, name: str):
+        name = normalize(name)
+        self._names[pk] = name
+        self._trigrams[pk] = trigrams(name)
+        for trigram in self._trigrams[pk]:
+            self._postings[trigram].add(pk)
+        for word in set(name.split()):
+            self._words.append((word, pk))
+
+    def _build(self, version: str):
+        self._clear()
+        foods = models.Food.objects.values_list('pk', 'name').order_by()
+        for pk, name in foods.iterator():
+            self._add(pk, name)
+        self._words.sort()
+        self._built = True
+        self._version = version
+
+    def _clear(self):
+        self._built = False
+        self._version = None
+        self._names = {}
+        self._trigrams = {}
+        self._postings = defaultdict(set)
+        self._words = []
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def search(self, query: str, limit: int) -> List[int]:
+        """Finds the foods with names most like the query.
+
+        Args:
+            query: Partial name of the food.
+            limit: Maximum number of results.
+
+        Returns:
+            IDs of the matching foods, best match first.
+        """
+        query = normalize(query)
+        if not query:
+            return []
+        # Read before building, so foods changed while the index is being
+        # built make it stale.
+        version = caching.versions([caching.FOODS])
+        with self._lock:
+            if not self._built or self._version != version:
+                self._build(version)
+            ranks = {}
+            # Names where a word starts with the query rank above any
+            # fuzzy match, and names starting with it rank highest.
+            first_word = query.split()[0]
+            index = bisect_left(self._words, (first_word,))
+            while (
+                index < len(self._words)
+                and self._words[index][0].startswith(first_word)
+            ):
+                pk = self._words[index][1]
+                name = self._names[pk]
+                if name.startswith(query):
+                    ranks[pk] = 2
+                elif f' {query}' in f' {name}':
+                    ranks[pk] = 1
+                index += 1
+
+            query_trigrams = trigrams(query)
+            shared = Counter()
+            for trigram in query_trigrams:
+                shared.update(self._postings.get(trigram, ()))
+            similarities = {}
+            for pk, count in shared.items():
+                union = len(query_trigrams) + len(self._trigrams[pk]) - count
+                similarities[pk] = count / union if union else 0.0
+
+            matches = set(ranks) | {
+                pk for pk, similarity in similarities.items()
+                if similarity >= SIMILARITY_THRESHOLD
+            }
+            ranked = sorted(matches, key=lambda pk: (
+                -ranks.get(pk, 0), -similarities.get(pk, 0.0),
+                self._names[pk],
+            ))
+        return ranked[:limit]
+
+
+food_index = FoodIndex()
+
+
+def search_foods(query: str, limit: int = DEFAULT_LIMIT) -> List[models.Food]:
+    """Searches the food catalog by name.
+
+    Names starting with the query come first, followed by names that have
+    a word starting with it and then by names that are only similar.
+    PostgreSQL answers this from trigram indexes, other databases use an
+    in-process index.
+
+    Args:
+        query: Partial name of the food.
+        limit: Maximum number of results.
+
+    Returns:
+        Matching foods, best match first.
+    """
+    query = query.strip()
+    if not query:
+        return []
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+        queryset = models.Food.objects.filter(
+            Q(name__istartswith=query)
+            | Q(name__icontains=f' {query}')
+            | Q(name__trigram_similar=query),
+        ).annotate(
+            rank=Case(
+                When(name__istartswith=query, then=Value(2)),
+                When(name__icontains=f' {query}', then=Value(1)),
+                default=Value(0), output_field=IntegerField(),
+            ),
+            similarity=TrigramSimilarity('name', query),
+        ).order_by('-rank', '-similarity', 'name')
+        return list(queryset[:limit])
+    food_ids = food_index.search(query, limit)
+    foods = models.Food.objects.in_bulk(food_ids)
+    return [foods[pk] for pk in food_ids if pk in foods]
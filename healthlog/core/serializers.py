@@ -3,7 +3,7 @@ from django.contrib.auth import authenticate
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
-from . import models
+from . import models, rollups, search
 
 
 class TokenSerializer(serializers.Serializer):
@@ -119,10 +119,74 @@ class FoodSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class FoodSearchSerializer(serializers.Serializer):
+    """Serializer for food search query parameters."""
+    q = serializers.CharField()
+    limit = serializers.IntegerField(
+        min_value=1, max_value=search.MAX_LIMIT,
+        default=search.DEFAULT_LIMIT,
+    )
+
+
 class MealSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Meal
-        fields = ['id', 'log', 'time', 'food']
+        fields = ['id', 'log', 'time', 'food', 'count']
+
+
+class BulkMealItemSerializer(serializers.Serializer):
+    """Serializer for a single meal of a bulk meal request."""
+    log = serializers.IntegerField()
+    time = serializers.ChoiceField(models.Meal.TIME_CHOICES)
+    food = serializers.IntegerField()
+    count = serializers.IntegerField(min_value=1, default=1)
+
+
+class BulkMealSerializer(serializers.Serializer):
+    """Serializer that creates many meals at once.
+
+    Logs and foods of every meal are looked up together, and the meals
+    are inserted with a single ``bulk_create``.
+    """
+    MAX_MEALS = 500
+
+    meals = BulkMealItemSerializer(many=True, allow_empty=False)
+
+    def validate_meals(self, value):
+        if len(value) > self.MAX_MEALS:
+            raise serializers.ValidationError(
+                f'No more than {self.MAX_MEALS} meals can be added at once.',
+            )
+        user = self.context['request'].user
+        logs = models.Log.objects.filter(user=user).in_bulk(
+            {item['log'] for item in value},
+        )
+        foods = models.Food.objects.in_bulk({item['food'] for item in value})
+        errors = []
+        for item in value:
+            item_errors = {}
+            if item['log'] not in logs:
+                item_errors['log'] = ['Log does not exist.']
+            if item['food'] not in foods:
+                item_errors['food'] = ['Food does not exist.']
+            errors.append(item_errors)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        for item in value:
+            item['log'] = logs[item['log']]
+            item['food'] = foods[item['food']]
+        return value
+
+    def create(self, validated_data):
+        meals = [
+            models.Meal(user_id=item['log'].user_id, **item)
+            for item in validated_data['meals']
+        ]
+        log_ids = {meal.log_id for meal in meals}
+        with transaction.atomic(), rollups.track(log_ids):
+            meals = models.Meal.objects.bulk_create(meals)
+            models.Log.objects.filter(pk__in=log_ids).update_totals()
+        return meals
 
 
 class LogMealSerializer(serializers.ModelSerializer):
@@ -133,6 +197,12 @@ class LogMealSerializer(serializers.ModelSerializer):
         fields = ['id', 'time', 'food']
 
 
+class LogMealCreateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Meal
+        fields = ['time', 'food', 'count']
+
+
 class LogSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -143,10 +213,6 @@ class LogSerializer(serializers.ModelSerializer):
 class LogDetailSerializer(serializers.ModelSerializer):
     meals = LogMealSerializer(many=True)
     ailments = AilmentSerializer(many=True)
-    calories = serializers.SerializerMethodField()
-    carbohydrates = serializers.SerializerMethodField()
-    proteins = serializers.SerializerMethodField()
-    fats = serializers.SerializerMethodField()
 
     class Meta:
         model = models.Log
@@ -156,29 +222,30 @@ class LogDetailSerializer(serializers.ModelSerializer):
             'meals', 'ailments',
         ]
 
-    def get_calories(self, log: models.Log):
-        calories = 0
-        for meal in log.meals.all():
-            calories += meal.food.calories
-        return calories
 
-    def get_carbohydrates(self, log: models.Log):
-        carbohydrates = 0
-        for meal in log.meals.all():
-            carbohydrates += meal.food.carbohydrates
-        return carbohydrates
+class LogTotalsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Log
+        fields = [
+            'id', 'date', 'calories',
+            'carbohydrates', 'proteins', 'fats',
+        ]
+
+
+class LogSyncSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Log
+        fields = [
+            'id', 'date', 'calories',
+            'carbohydrates', 'proteins', 'fats',
+            'ailments', 'modified_on',
+        ]
 
-    def get_proteins(self, log: models.Log):
-        proteins = 0
-        for meal in log.meals.all():
-            proteins += meal.food.protein
-        return proteins
 
-    def get_fats(self, log: models.Log):
-        fats = 0
-        for meal in log.meals.all():
-            fats += meal.food.fats
-        return fats
+class MealSyncSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Meal
+        fields = ['id', 'log', 'time', 'food', 'count', 'modified_on']
 
 
 class LogUpdateSerializer(serializers.ModelSerializer):
@@ -203,6 +270,12 @@ class TicketDetailSerializer(serializers.ModelSerializer):
         fields = ['message', 'created_on']
 
 
+class TicketSyncSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Ticket
+        fields = ['id', 'message', 'created_on', 'modified_on']
+
+
 class MealDetailSerializer(serializers.ModelSerializer):
     log = LogSerializer()
     food = FoodSerializer()
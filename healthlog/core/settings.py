@@ -49,14 +49,16 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'django.contrib.messages',
     'django.contrib.admin',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
 
-    'healthlog.core',
+    'healthlog.core.apps.CoreConfig',
 ]
 
 MIDDLEWARE = [
+    'healthlog.core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,7 +93,7 @@ WSGI_APPLICATION = 'healthlog.core.wsgi.application'
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'healthlog.core.backends.postgresql',
         'HOST': get_env('db_host', 'localhost'),
         'PORT': get_env('db_port', '5432'),
         'NAME': get_env('db_name', 'healthlog'),
@@ -100,6 +102,34 @@ DATABASES = {
     }
 }
 
+# Read replicas of the database as a comma separated list of host or
+# host:port. They're used for analytics, exports and the admin's lists
+# as long as they're at most the maximum lag in seconds behind. Cached
+# responses are always computed on the primary.
+REPLICA_DATABASES = []
+for index, replica in enumerate(filter(None, get_env(
+    'db_replica_hosts', '',
+).split(','))):
+    replica_host, _, replica_port = replica.strip().partition(':')
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(f'replica_{index}')
+DATABASE_ROUTERS = ['healthlog.core.routers.ReplicaRouter']
+DB_REPLICA_MAX_LAG = float(get_env('db_replica_max_lag', '10'))
+DB_REPLICA_CHECK_INTERVAL = float(get_env('db_replica_check_interval', '5'))
+
+# Each process keeps a pool of PostgreSQL connections. Pools sized zero
+# get one connection per server thread and analytics worker.
+DB_POOL_SIZE = int(get_env('db_pool_size', '0'))
+DB_POOL_TIMEOUT = float(get_env('db_pool_timeout', '10'))
+DB_POOL_MAX_LIFETIME = float(get_env('db_pool_max_lifetime', '1800'))
+DB_POOL_MAX_IDLE = float(get_env('db_pool_max_idle', '300'))
+DB_POOL_CHECK_INTERVAL = float(get_env('db_pool_check_interval', '30'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -144,6 +174,11 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 STATIC_URL = get_env('static_url', '/static/')
 STATIC_ROOT = os.path.join(BASE_DIR, '../static/')
+STATICFILES_STORAGE = (
+    'healthlog.core.storage.CompressedManifestStaticFilesStorage'
+)
+# Bytes of collected static files each process keeps in memory.
+STATIC_CACHE_SIZE = int(get_env('static_cache_size', str(32 * 1024 * 1024)))
 
 # Logging
 # Removes control of logging from Django and accesses the logging
@@ -164,13 +199,84 @@ LOGOUT_REDIRECT_URL = '/login/'
 DEFAULT_ADMIN_EMAIL = get_env('default_admin_email')
 DEFAULT_ADMIN_PASSWORD = get_env('default_admin_password')
 
+# Number of authenticated API tokens each process keeps in memory and
+# the seconds they're trusted before being checked against the database.
+TOKEN_CACHE_SIZE = int(get_env('token_cache_size', '10000'))
+TOKEN_CACHE_TTL = float(get_env('token_cache_ttl', '60'))
+
+# Cache of API responses. The backend is either "locmem" for a cache
+# private to each process, "file" for a directory shared by processes
+# on the same host or "database" for a table shared by every server.
+# Running more than one worker needs "file" or "database".
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'database': 'django.core.cache.backends.db.DatabaseCache',
+}
+CACHE_LOCATIONS = {
+    'locmem': 'healthlog',
+    'file': os.path.join(BASE_DIR, '../cache/'),
+    'database': 'healthlog_cache',
+}
+CACHE_BACKEND = get_env('cache_backend', 'locmem')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': get_env(
+            'cache_location', CACHE_LOCATIONS[CACHE_BACKEND],
+        ),
+        'TIMEOUT': int(get_env('cache_timeout', '300')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(get_env('cache_max_entries', '10000')),
+        },
+    },
+    # State that has to outlive the process whatever the backend above,
+    # kept in a table of the default database. The startup creates the
+    # table before anything reads it.
+    'state': {
+        'BACKEND': CACHE_BACKENDS['database'],
+        'LOCATION': get_env('state_cache_table', 'healthlog_state'),
+        'TIMEOUT': None,
+    },
+}
+RESPONSE_CACHE_ALIAS = 'default'
+# Cache remembering which migration state each database was last seen in.
+NAVIGATOR_CACHE_ALIAS = 'state'
+# Cache remembering the default admin set on the previous startup.
+STARTUP_CACHE_ALIAS = 'state'
+# JSON file profiled migrations are recorded in.
+MIGRATION_HISTORY_PATH = get_env(
+    'migration_history', os.path.join(BASE_DIR, '../migration-history.json'),
+)
+# Seconds the pending migrations of a database may be estimated to take
+# before the server refuses to apply them. Zero disables the budget.
+MIGRATION_BUDGET = float(get_env('migration_budget', '0'))
+
+# Analytics of the dashboard run on a pool of worker threads in each
+# process. Results are kept in the cache for the given seconds and jobs
+# that haven't finished in time are considered lost.
+ANALYTICS_CACHE_ALIAS = 'default'
+ANALYTICS_WORKERS = int(get_env('analytics_workers', '2'))
+ANALYTICS_JOB_TIMEOUT = int(get_env('analytics_job_timeout', '300'))
+ANALYTICS_RESULT_TTL = int(get_env('analytics_result_ttl', '300'))
+
+# Request metrics are exposed to admins and to clients sending the token
+# as a bearer token. Summaries are logged every interval in seconds, or
+# never when it's zero. Metrics are kept per worker process, so each
+# scrape or summary only covers a single worker.
+METRICS_TOKEN = get_env('metrics_token')
+METRICS_SUMMARY_INTERVAL = float(get_env('metrics_summary_interval', '300'))
+
+# Use keyset pagination for meals and logs unless a page is requested.
+KEYSET_PAGINATION = get_env('keyset_pagination', '0') == '1'
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': (
         'rest_framework.pagination.PageNumberPagination'
     ),
     'PAGE_SIZE': 100,
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'healthlog.core.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
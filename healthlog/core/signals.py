@@ -0,0 +1,295 @@
+from django.core.signals import request_started
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from . import authentication, caching, models, rollups, routers
+
+# Fields of a food that the totals of its logs are computed from.
+NUTRIENTS = ('calories', 'carbohydrates', 'protein', 'fats')
+
+# Changes that never complete, like a failed save, are dropped between
+# requests so they don't hold back the rollups of their logs.
+request_started.connect(rollups.reset)
+# Writes only pin the request that made them to the primary database.
+request_started.connect(routers.reset)
+
+
+@receiver(pre_save, sender=models.Meal)
+def begin_meal_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    log_ids = [instance.log_id]
+    if instance.pk is not None:
+        # The meal could be moving away from another log.
+        log_ids += models.Meal.objects.filter(
+            pk=instance.pk,
+        ).values_list('log_id', flat=True)
+    instance._changed_log_ids = log_ids
+    instance._rollup_log_ids = rollups.begin(log_ids)
+
+
+@receiver(post_save, sender=models.Meal)
+def update_meal_log_totals(sender, instance, raw=False, **kwargs):
+    log_ids = getattr(instance, '_changed_log_ids', None)
+    if log_ids:
+        del instance._changed_log_ids
+        models.Log.objects.filter(pk__in=log_ids).update_totals()
+
+
+@receiver(post_delete, sender=models.Meal)
+def update_deleted_meal_log_totals(sender, instance, **kwargs):
+    models.Log.objects.filter(pk=instance.log_id).update_totals()
+
+
+@receiver(pre_save, sender=models.Food)
+def check_food_nutrients(
+    sender, instance, raw=False, update_fields=None, **kwargs,
+):
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & set(NUTRIENTS):
+        return
+    # Renames and other changes leave the totals of the logs as they are.
+    instance._nutrients_changed = models.Food.objects.filter(
+        pk=instance.pk,
+    ).exclude(**{
+        nutrient: getattr(instance, nutrient) for nutrient in NUTRIENTS
+    }).exists()
+
+
+@receiver(post_save, sender=models.Food)
+def update_food_log_totals(sender, instance, created, raw=False, **kwargs):
+    changed = getattr(instance, '_nutrients_changed', False)
+    if changed:
+        del instance._nutrients_changed
+    if raw or created or not changed:
+        return
+    models.Log.objects.filter(pk__in=models.Meal.objects.filter(
+        food=instance,
+    ).values('log')).update_totals()
+
+
+@receiver(pre_save, sender=models.Log)
+def begin_log_rollups(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    instance._rollup_log_ids = rollups.begin([instance.pk])
+
+
+@receiver(pre_save, sender=models.User)
+def begin_user_rollups(
+    sender, instance, raw=False, update_fields=None, **kwargs,
+):
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and 'info' not in update_fields:
+        return
+    changed = models.User.objects.filter(pk=instance.pk).exclude(
+        info_id=instance.info_id,
+    ).exists()
+    if changed:
+        instance._rollup_log_ids = rollups.begin(
+            rollups.logs_for_users([instance.pk]),
+        )
+
+
+@receiver(pre_save, sender=models.Info)
+def begin_info_rollups(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    changed = models.Info.objects.filter(pk=instance.pk).exclude(
+        birth_date=instance.birth_date,
+    ).exists()
+    if changed:
+        instance._rollup_log_ids = rollups.begin(rollups.logs_for_users(
+            models.User.objects.filter(info=instance).values('pk'),
+        ))
+
+
+@receiver(post_save, sender=models.Meal)
+@receiver(post_save, sender=models.Log)
+@receiver(post_save, sender=models.User)
+@receiver(post_save, sender=models.Info)
+def end_rollups(sender, instance, **kwargs):
+    log_ids = getattr(instance, '_rollup_log_ids', None)
+    if log_ids:
+        del instance._rollup_log_ids
+        rollups.end(log_ids)
+
+
+@receiver(pre_delete, sender=models.Meal)
+def begin_meal_delete_rollups(sender, instance, **kwargs):
+    rollups.begin([instance.log_id])
+
+
+@receiver(post_delete, sender=models.Meal)
+def end_meal_delete_rollups(sender, instance, **kwargs):
+    rollups.end([instance.log_id])
+
+
+@receiver(pre_delete, sender=models.Log)
+def begin_log_delete_rollups(sender, instance, **kwargs):
+    rollups.begin([instance.pk])
+
+
+@receiver(post_delete, sender=models.Log)
+def end_log_delete_rollups(sender, instance, **kwargs):
+    rollups.end([instance.pk])
+
+
+@receiver(pre_delete, sender=models.Info)
+def begin_info_delete_rollups(sender, instance, **kwargs):
+    instance._rollup_log_ids = rollups.begin(rollups.logs_for_users(
+        models.User.objects.filter(info=instance).values('pk'),
+    ))
+
+
+@receiver(post_delete, sender=models.Info)
+def end_info_delete_rollups(sender, instance, **kwargs):
+    end_rollups(sender, instance)
+
+
+@receiver(m2m_changed, sender=models.Log.ailments.through)
+def log_ailments_changed(
+    sender, instance, action, reverse, pk_set, **kwargs,
+):
+    if action.startswith('pre_'):
+        if not reverse:
+            log_ids = [instance.pk]
+        elif pk_set is not None:
+            log_ids = pk_set
+        else:
+            log_ids = instance.logs.values_list('pk', flat=True)
+        instance._rollup_log_ids = rollups.begin(log_ids)
+    else:
+        end_rollups(sender, instance)
+
+
+@receiver(m2m_changed, sender=models.User.conditions.through)
+def user_conditions_changed(
+    sender, instance, action, reverse, pk_set, **kwargs,
+):
+    if action.startswith('pre_'):
+        if not reverse:
+            user_ids = [instance.pk]
+        elif pk_set is not None:
+            user_ids = pk_set
+        else:
+            user_ids = instance.users.values_list('pk', flat=True)
+        instance._rollup_log_ids = rollups.begin(
+            rollups.logs_for_users(user_ids),
+        )
+    else:
+        end_rollups(sender, instance)
+
+
+@receiver(post_save, sender=models.User)
+@receiver(post_delete, sender=models.User)
+def invalidate_user_token(sender, instance, **kwargs):
+    authentication.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    authentication.invalidate_token(instance.key)
+
+
+@receiver(m2m_changed, sender=models.Log.ailments.through)
+def touch_log_ailments(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        logs = models.Log.objects.filter(pk=instance.pk)
+    elif pk_set is not None:
+        logs = models.Log.objects.filter(pk__in=pk_set)
+    else:
+        # Cleared logs can't be told apart anymore.
+        return
+    logs.update(modified_on=timezone.now())
+
+
+@receiver(post_delete, sender=models.Log)
+def record_log_tombstone(sender, instance, **kwargs):
+    models.Tombstone.objects.create(
+        user_id=instance.user_id, kind=models.Tombstone.LOG,
+        object_id=instance.pk,
+    )
+
+
+@receiver(post_delete, sender=models.Meal)
+def record_meal_tombstone(sender, instance, **kwargs):
+    user_id = instance.user_id
+    if user_id is None:
+        user_id = models.Log.objects.filter(
+            pk=instance.log_id,
+        ).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        models.Tombstone.objects.create(
+            user_id=user_id, kind=models.Tombstone.MEAL,
+            object_id=instance.pk,
+        )
+
+
+@receiver(post_delete, sender=models.Ticket)
+def record_ticket_tombstone(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        models.Tombstone.objects.create(
+            user_id=instance.user_id, kind=models.Tombstone.TICKET,
+            object_id=instance.pk,
+        )
+
+
+@receiver(post_save, sender=models.Condition)
+@receiver(post_delete, sender=models.Condition)
+def invalidate_condition_cache(sender, instance, **kwargs):
+    caching.invalidate(caching.CONDITIONS)
+
+
+@receiver(post_save, sender=models.Ailment)
+@receiver(post_delete, sender=models.Ailment)
+def invalidate_ailment_cache(sender, instance, **kwargs):
+    caching.invalidate(caching.AILMENTS)
+
+
+@receiver(post_save, sender=models.Food)
+@receiver(post_delete, sender=models.Food)
+def invalidate_food_cache(sender, instance, **kwargs):
+    caching.invalidate(caching.FOODS)
+
+
+@receiver(post_save, sender=models.User)
+@receiver(post_delete, sender=models.User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    caching.invalidate(caching.user_namespace(instance.pk))
+
+
+@receiver(post_save, sender=models.Info)
+@receiver(pre_delete, sender=models.Info)
+def invalidate_info_user_cache(sender, instance, **kwargs):
+    # Users are detached from deleted info before post_delete is sent.
+    user_ids = models.User.objects.filter(info=instance).values_list(
+        'pk', flat=True,
+    )
+    for user_id in user_ids:
+        caching.invalidate(caching.user_namespace(user_id))
+
+
+@receiver(m2m_changed, sender=models.User.conditions.through)
+def invalidate_user_conditions_cache(
+    sender, instance, action, reverse, pk_set, **kwargs,
+):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif pk_set is not None:
+        user_ids = pk_set
+    else:
+        user_ids = instance.users.values_list('pk', flat=True)
+    for user_id in user_ids:
+        caching.invalidate(caching.user_namespace(user_id))
@@ -0,0 +1,147 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DatabaseError, connections
+from django.utils.crypto import salted_hmac
+
+from .collector import Collector
+from .navigator import Navigator
+
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    """Startup phases of the server.
+
+    Each phase is timed, and phases whose inputs haven't changed since
+    the previous startup are skipped: the navigator skips databases that
+    are up to date, the collector skips unchanged static files and the
+    default admin is only saved when its credentials change. What the
+    previous startup saw is kept in the ``state`` cache, a table of the
+    default database, so it survives restarts. The
+    database and the static files don't depend on each other, so they're
+    prepared at the same time.
+
+    Attributes:
+        durations: Seconds each phase took indexed by its name.
+    """
+    def __init__(self, collect_workers: int = 1, migrate_workers: int = 1,
+                 profile_migrations: bool = False):
+        self.collect_workers = collect_workers
+        self.migrate_workers = migrate_workers
+        self.profile_migrations = profile_migrations
+        self.durations: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """Times a phase of the startup."""
+        start = time.monotonic()
+        yield
+        self.durations[name] = time.monotonic() - start
+        logger.info(
+            "Startup phase '%s' finished in %.3fs", name, self.durations[name],
+        )
+
+    def run(self):
+        """Runs every phase, raising the first error once they're done."""
+        start = time.monotonic()
+        self.concurrently(self.prepare_database, self.prepare_static)
+        logger.info('Startup finished in %.3fs', time.monotonic() - start)
+
+    def concurrently(self, *functions: Callable[[], None]):
+        with ThreadPoolExecutor(len(functions)) as executor:
+            futures = [executor.submit(function) for function in functions]
+        for future in futures:
+            future.result()
+
+    def prepare_database(self):
+        """Migrates the databases and sets the default admin."""
+        try:
+            with self.phase('cache tables'):
+                # Tables of database caches aren't part of the migrations.
+                # They're created first since migrations remember their
+                # state in the state cache.
+                call_command('createcachetable')
+
+            with self.phase('migrations'):
+                navigator = Navigator(
+                    workers=self.migrate_workers,
+                    profile=self.profile_migrations,
+                )
+                try:
+                    navigator.migrate()
+                finally:
+                    navigator.close()
+
+            with self.phase('default admin'):
+                self.set_default_admin()
+        finally:
+            # Connections belong to this thread and wouldn't be reused.
+            connections.close_all()
+
+    def prepare_static(self):
+        """Collects the static files and loads them in memory."""
+        with self.phase('static files'):
+            collector = Collector(workers=self.collect_workers)
+            collector.handle()
+
+        from . import assets
+        with self.phase('static files preload'):
+            assets.index.preload()
+        logger.info(
+            'Loaded %d bytes of static files in memory', assets.index.size,
+        )
+
+    def set_default_admin(self):
+        """Creates the default admin or updates its password.
+
+        Hashing the password is slow, so a keyed hash of the credentials
+        and the stored password is cached and the admin is left alone
+        while it matches.
+        """
+        email = settings.DEFAULT_ADMIN_EMAIL
+        password = settings.DEFAULT_ADMIN_PASSWORD
+        if not (email and password):
+            return
+
+        from .models import User
+        cache = caches[settings.STARTUP_CACHE_ALIAS]
+        key = 'healthlog:startup:admin'
+        user = User.objects.filter(email=email).first()
+        if user is not None and user.is_admin:
+            fingerprint = self._admin_fingerprint(user, password)
+            try:
+                unchanged = cache.get(key) == fingerprint
+            except DatabaseError:
+                unchanged = False
+            if unchanged or user.check_password(password):
+                logger.info('Default admin %s is up to date', email)
+                self._store(cache, key, fingerprint)
+                return
+
+        logger.info('Creating default admin %s', email)
+        if user is None:
+            user = User(email=email)
+        user.set_password(password)
+        user.is_admin = True
+        user.save()
+        self._store(cache, key, self._admin_fingerprint(user, password))
+        logger.info('Default admin %s set', email)
+
+    def _admin_fingerprint(self, user, password: str) -> str:
+        return salted_hmac(
+            'healthlog.startup.admin',
+            f'{user.email}:{password}:{user.password}',
+        ).hexdigest()
+
+    def _store(self, cache, key: str, value: str):
+        try:
+            cache.set(key, value, None)
+        except DatabaseError:
+            logger.warning("Couldn't cache the startup state '%s'", key)
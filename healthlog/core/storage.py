@@ -0,0 +1,97 @@
+import gzip
+import logging
+import os
+import zlib
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Extensions of files that are worth compressing. Images and web fonts
+# other than the legacy formats are already compressed.
+COMPRESSIBLE_EXTENSIONS = {
+    '.css', '.js', '.map', '.json', '.html', '.txt', '.xml', '.svg',
+    '.eot', '.ttf', '.otf', '.ico',
+}
+
+
+def _gzip(data: bytes) -> bytes:
+    # A fixed modification time keeps the output the same between runs.
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _brotli(data: bytes) -> bytes:
+    return brotli.compress(data)
+
+
+def _deflate(data: bytes) -> bytes:
+    return zlib.compress(data, 9)
+
+
+def encodings():
+    """Content encodings of the precompressed variants of a file.
+
+    Brotli is only available when its package is installed, zlib's
+    deflate takes its place otherwise.
+
+    Returns:
+        Tuples of the encoding, file suffix and compression function in
+        the order they're preferred.
+    """
+    if brotli is not None:
+        second = ('br', '.br', _brotli)
+    else:
+        second = ('deflate', '.zz', _deflate)
+    return (second, ('gzip', '.gz', _gzip))
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Static files storage that fingerprints and precompresses files.
+
+    Every collected file is stored under a name that contains the hash
+    of its content, and compressible files get gzip and brotli, or
+    deflate, variants next to both names so they can be served without
+    compressing them on each request.
+    """
+    # Fall back to the original name for files that were never collected.
+    manifest_strict = False
+    min_compress_size = 256
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            self.compress(name)
+
+    def compress(self, name: str):
+        """Writes the precompressed variants of a stored file.
+
+        Variants that wouldn't be smaller than the file are removed.
+
+        Args:
+            name: Name of the stored file.
+        """
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in COMPRESSIBLE_EXTENSIONS:
+            return
+        with self.open(name) as stored_file:
+            data = stored_file.read()
+        for encoding, suffix, compress in encodings():
+            variant = name + suffix
+            if self.exists(variant):
+                self.delete(variant)
+            if len(data) < self.min_compress_size:
+                continue
+            compressed = compress(data)
+            if len(compressed) >= len(data):
+                continue
+            self._save(variant, ContentFile(compressed))
+            logger.debug("Compressed '%s' with %s", name, encoding)
@@ -0,0 +1,261 @@
+import logging
+import os
+import signal
+import socket
+import time
+from typing import Dict, Optional
+
+from waitress.channel import HTTPChannel
+from waitress.server import create_server
+
+logger = logging.getLogger(__name__)
+
+
+def bind(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    """Opens the listening socket of the server.
+
+    Args:
+        host: Hostname to bind to.
+        port: Port to bind to.
+        backlog: Number of connections waiting to be accepted.
+
+    Returns:
+        Socket listening on the first address the host resolves to.
+    """
+    family, kind, proto, _, address = socket.getaddrinfo(
+        host, port, socket.AF_UNSPEC, socket.SOCK_STREAM, 0,
+        socket.AI_PASSIVE,
+    )[0]
+    sock = socket.socket(family, kind, proto)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def cpu_count() -> int:
+    """Number of CPUs the process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        return os.cpu_count() or 1
+
+
+def auto_threads(
+    workers: int, db_connections: Optional[int] = None,
+    reserved_connections: int = 0, cpus: Optional[int] = None,
+) -> int:
+    """Number of threads each worker should serve requests with.
+
+    Requests mostly wait on the database, so a few threads per CPU keep
+    the CPUs busy. Each thread holds a database connection of its own
+    though, so every worker's threads, along with the connections it
+    reserves for other work, have to fit within its share of the
+    connection budget.
+
+    Args:
+        workers: Number of worker processes.
+        db_connections: Database connections all the workers may hold
+            together, or None for no limit.
+        reserved_connections: Connections each worker holds besides the
+            ones of its request threads.
+        cpus: Number of CPUs, the available ones by default.
+
+    Returns:
+        Number of threads per worker, at least one.
+    """
+    if cpus is None:
+        cpus = cpu_count()
+    threads = max(2, 4 * cpus // workers)
+    if db_connections is not None:
+        threads = min(
+            threads, db_connections // workers - reserved_connections,
+        )
+    return max(threads, 1)
+
+
+def serve(
+    application, sock: socket.socket, threads: int = 4,
+    graceful_timeout: float = 30, **options,
+):
+    """Serves an application with waitress until SIGTERM is received.
+
+    Once stopped, no new connections are accepted and idle connections
+    are closed, while running requests get the graceful timeout to send
+    their response.
+
+    Args:
+        application: WSGI application to serve.
+        sock: Listening socket.
+        threads: Number of threads handling requests.
+        graceful_timeout: Seconds the running requests get once stopped.
+        **options: Other waitress adjustments.
+    """
+    server = create_server(
+        application, sockets=[sock], threads=threads, **options,
+    )
+    stopped = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.append(1))
+
+    def loop():
+        server.asyncore.loop(
+            timeout=server.adj.asyncore_loop_timeout, map=server._map,
+            use_poll=server.adj.asyncore_use_poll, count=1,
+        )
+
+    while not stopped:
+        loop()
+
+    # Stop accepting connections and wait for the running requests. The
+    # server itself stays open since its trigger wakes the loop up when
+    # responses are ready.
+    server.del_channel()
+    server.socket.close()
+    deadline = time.monotonic() + graceful_timeout
+    while time.monotonic() < deadline:
+        channels = [
+            channel for channel in list(server._map.values())
+            if isinstance(channel, HTTPChannel)
+        ]
+        if not channels:
+            break
+        for channel in channels:
+            if not (
+                channel.requests or channel.request
+                or channel.total_outbufs_len
+            ):
+                channel.handle_close()
+        loop()
+    server.task_dispatcher.shutdown(timeout=1)
+
+
+class Supervisor:
+    """Serves an application from pre-forked worker processes.
+
+    Every worker inherits the listening socket of the supervisor and
+    accepts connections on it with a waitress server of its own. Workers
+    that die are replaced. On SIGTERM or SIGINT the workers are asked to
+    finish their running requests and are killed if they haven't exited
+    shortly after the graceful timeout.
+
+    Attributes:
+        application: WSGI application to serve.
+        sock: Listening socket shared by the workers.
+        workers: Number of worker processes.
+        threads: Number of threads handling requests in each worker.
+        graceful_timeout: Seconds workers get to exit once stopped.
+        options: Other waitress adjustments of the workers.
+    """
+    # Workers that die sooner than this after starting are replaced after
+    # a delay so that a broken worker isn't forked in a tight loop.
+    min_lifetime = 1.0
+    poll_interval = 0.2
+    # Seconds workers get on top of the graceful timeout to shut down.
+    kill_delay = 2.0
+
+    def __init__(
+        self, application, sock: socket.socket, workers: int,
+        threads: int = 4, graceful_timeout: float = 30, **options,
+    ):
+        self.application = application
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.options = options
+        self._pids: Dict[int, float] = {}
+        self._stopping = False
+
+    def run(self):
+        """Starts the workers and supervises them until stopped."""
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for _ in range(self.workers):
+            self.spawn()
+
+        deadline = None
+        while self._pids:
+            self.reap()
+            if self._stopping:
+                if deadline is None:
+                    deadline = (
+                        time.monotonic() + self.graceful_timeout
+                        + self.kill_delay
+                    )
+                    self.signal_workers(signal.SIGTERM)
+                elif time.monotonic() >= deadline:
+                    logger.warning(
+                        'Killing %d workers that did not exit in time',
+                        len(self._pids),
+                    )
+                    self.signal_workers(signal.SIGKILL)
+                    deadline = float('inf')
+            time.sleep(self.poll_interval)
+        self.sock.close()
+        logger.info('Server stopped')
+
+    def spawn(self) -> int:
+        """Forks a worker process.
+
+        Returns:
+            Process ID of the worker.
+        """
+        pid = os.fork()
+        if pid:
+            self._pids[pid] = time.monotonic()
+            logger.info('Started worker %d', pid)
+            return pid
+
+        # The worker leaves stopping to the supervisor, Ctrl+C reaches the
+        # whole process group.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        status = 0
+        try:
+            serve(
+                self.application, self.sock, self.threads,
+                self.graceful_timeout, **self.options,
+            )
+        except BaseException:
+            logger.exception('Worker %d crashed', os.getpid())
+            status = 1
+        finally:
+            logging.shutdown()
+            os._exit(status)
+
+    def reap(self):
+        """Collects exited workers and replaces them unless stopping."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._pids.clear()
+                return
+            if not pid:
+                return
+            started = self._pids.pop(pid, None)
+            if started is None or self._stopping:
+                continue
+            if os.WIFSIGNALED(status):
+                code = -os.WTERMSIG(status)
+            else:
+                code = os.WEXITSTATUS(status)
+            logger.warning('Worker %d exited with status %d', pid, code)
+            if time.monotonic() - started < self.min_lifetime:
+                time.sleep(self.min_lifetime)
+            self.spawn()
+
+    def signal_workers(self, signum: int):
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _stop(self, signum, frame):
+        if not self._stopping:
+            logger.info('Stopping %d workers', len(self._pids))
+        self._stopping = True
@@ -0,0 +1,153 @@
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import models, serializers
+
+# Maximum number of rows returned for each feed in a single response.
+SYNC_LIMIT = 500
+# Rows changed this recently are sent again on the next sync in case an
+# older transaction commits after them.
+COMMIT_LAG = timedelta(seconds=5)
+
+Key = Tuple[datetime, int]
+
+
+class SyncError(Exception):
+    pass
+
+
+def _feeds(user):
+    """Querysets and serializers of every synced feed for a user.
+
+    Returns:
+        Tuples of the feed name, queryset, timestamp field and serializer
+        class.
+    """
+    return (
+        (
+            models.Tombstone.LOG,
+            models.Log.objects.filter(user=user).prefetch_related(
+                'ailments',
+            ),
+            'modified_on', serializers.LogSyncSerializer,
+        ),
+        (
+            models.Tombstone.MEAL,
+            models.Meal.objects.filter(user=user),
+            'modified_on', serializers.MealSyncSerializer,
+        ),
+        (
+            models.Tombstone.TICKET,
+            models.Ticket.objects.filter(user=user),
+            'modified_on', serializers.TicketSyncSerializer,
+        ),
+        (
+            'deleted',
+            models.Tombstone.objects.filter(user_id=user.pk),
+            'deleted_on', None,
+        ),
+    )
+
+
+def decode_cursor(encoded: Optional[str]) -> Dict[str, Key]:
+    """Reads the position of every feed from a sync cursor.
+
+    Args:
+        encoded: Cursor returned by a previous sync, if any.
+
+    Returns:
+        Timestamp and ID of the last row seen, indexed by the feed name.
+
+    Raises:
+        SyncError: The cursor is malformed.
+    """
+    if not encoded:
+        return {}
+    try:
+        data = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+        cursor = {}
+        for name, (timestamp, pk) in data.items():
+            timestamp = parse_datetime(timestamp)
+            if timestamp is None:
+                raise ValueError(name)
+            cursor[name] = (timestamp, int(pk))
+        return cursor
+    except (TypeError, ValueError, AttributeError, binascii.Error):
+        raise SyncError('Invalid cursor')
+
+
+def encode_cursor(cursor: Dict[str, Key]) -> str:
+    data = {
+        name: [timestamp.isoformat(), pk]
+        for name, (timestamp, pk) in cursor.items()
+    }
+    return urlsafe_b64encode(json.dumps(data).encode('ascii')).decode('ascii')
+
+
+def changes(user, encoded: Optional[str] = None, limit: int = SYNC_LIMIT):
+    """Collects everything that changed for a user since a cursor.
+
+    Args:
+        user: User that is syncing.
+        encoded: Cursor returned by the previous sync. Everything is
+            returned when it's missing.
+        limit: Maximum number of rows to return for each feed.
+
+    Returns:
+        Dictionary of the changed rows of each feed, the IDs of deleted
+        objects, the cursor for the next sync and whether more changes
+        are waiting.
+
+    Raises:
+        SyncError: The cursor is malformed.
+    """
+    cursor = decode_cursor(encoded)
+    horizon = (timezone.now() - COMMIT_LAG, 0)
+    result = OrderedDict()
+    next_cursor = {}
+    more = False
+    for name, queryset, field, serializer_class in _feeds(user):
+        position = cursor.get(name)
+        if position is not None:
+            timestamp, pk = position
+            queryset = queryset.filter(
+                Q(**{f'{field}__gt': timestamp})
+                | Q(**{field: timestamp, 'pk__gt': pk})
+            )
+        rows = list(queryset.order_by(field, 'pk')[:limit + 1])
+        truncated = len(rows) > limit
+        rows = rows[:limit]
+
+        if rows:
+            last = (getattr(rows[-1], field), rows[-1].pk)
+            # Never move past rows that could still be committing.
+            if last > horizon:
+                last = horizon
+                truncated = False
+            position = max(position, last) if position else last
+        elif position is None:
+            position = horizon
+        next_cursor[name] = position
+        more = more or truncated
+
+        if serializer_class is None:
+            deleted = OrderedDict(
+                (kind, []) for kind, _ in models.Tombstone.KIND_CHOICES
+            )
+            for tombstone in rows:
+                deleted[tombstone.kind].append(tombstone.object_id)
+            result[name] = deleted
+        else:
+            result[name] = serializer_class(rows, many=True).data
+
+    result['cursor'] = encode_cursor(next_cursor)
+    result['more'] = more
+    return result
@@ -0,0 +1,68 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, override_settings
+
+from .collector import Collector
+
+
+class CollectorTests(SimpleTestCase):
+    """Incremental collection of the static files."""
+
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.target = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source)
+        self.addCleanup(shutil.rmtree, self.target)
+        settings = override_settings(
+            STATICFILES_DIRS=[self.source],
+            STATIC_ROOT=self.target,
+            STATICFILES_FINDERS=[
+                'django.contrib.staticfiles.finders.FileSystemFinder',
+            ],
+            STATICFILES_STORAGE=(
+                'django.contrib.staticfiles.storage.StaticFilesStorage'
+            ),
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, root, path, content, mtime):
+        full_path = os.path.join(root, path)
+        with open(full_path, 'w') as file:
+            file.write(content)
+        os.utime(full_path, (mtime, mtime))
+
+    def read(self, path):
+        with open(os.path.join(self.target, path)) as file:
+            return file.read()
+
+    def test_changed_file_older_than_target_is_copied(self):
+        self.write(self.source, 'styles.css', 'a {}', mtime=2000000000)
+        Collector().collect()
+        manifest = json.loads(self.read(Collector.manifest_name))
+
+        # The new content is older than the collected copy.
+        self.write(self.source, 'styles.css', 'b {}', mtime=1000000000)
+        collected = Collector().collect()
+
+        self.assertEqual(collected['modified'], ['styles.css'])
+        self.assertEqual(self.read('styles.css'), 'b {}')
+        self.assertNotEqual(
+            json.loads(self.read(Collector.manifest_name)),
+            manifest,
+        )
+
+    def test_file_missing_from_manifest_is_copied(self):
+        self.write(self.source, 'styles.css', 'a {}', mtime=1000000000)
+        self.write(self.target, 'styles.css', 'b {}', mtime=2000000000)
+        collected = Collector().collect()
+
+        self.assertEqual(collected['modified'], ['styles.css'])
+        self.assertEqual(self.read('styles.css'), 'a {}')
+        self.assertIn(
+            'styles.css',
+            json.loads(self.read(Collector.manifest_name))['files'],
+        )
@@ -16,11 +16,10 @@ Including another URLconf
 import re
 from django.urls import path, include, re_path
 from django.conf import settings
-from django.views.static import serve
 from django.contrib.auth import views as auth_views
 from rest_framework.routers import SimpleRouter
 
-from . import views
+from . import assets, views
 from . import admin
 
 router = SimpleRouter()
@@ -40,14 +39,18 @@ urlpatterns = [
         'registration/', views.AnalystRegistrationView.as_view(),
         name='analyst-registration',
     ),
+    path('export/', views.AnalystExportView.as_view(), name='export'),
     path('admin/', admin.site.urls),  # Admin page
     path('api/auth/', views.AuthView.as_view()),  # Authentication
     path('api/registration/', views.RegistrationView.as_view()),
     path('api/users/me/', views.UserView.as_view()),
+    path('api/sync/', views.SyncView.as_view()),
+    path('api/export/', views.ExportView.as_view()),
     path('api/', include(router.urls)),  # API route
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
 ] + [
     re_path(
         r'^%s(?P<path>.*)$' % re.escape(settings.STATIC_URL.lstrip('/')),
-        serve, {'document_root': settings.STATIC_ROOT}
+        assets.serve,
     ),
 ]
@@ -1,29 +1,32 @@
 from typing import Dict
-from datetime import date, timedelta
 
 from django.contrib.auth import login
 
 from django.conf import settings
-from django.http import HttpResponseRedirect
-from django.views.generic import TemplateView
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.views.generic import TemplateView, View
 from django.shortcuts import resolve_url
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_protect
 from django.views.decorators.debug import sensitive_post_parameters
-from django.db.models import Count, Avg, F, Value, FloatField
-from django.db.models.functions import Cast
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, GenericViewSet, mixins
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
 
-from . import models, serializers, filters, forms
-from .permissions import IsUnauthenticated
-from .mixins import AnalystRequiredMixin
+from . import (
+    caching, export, jobs, metrics, models, rollups, serializers, filters,
+    forms, search, sync,
+)
+from .pagination import DatePagination
+from .permissions import HasMetricsToken, IsUnauthenticated
+from .mixins import AnalystRequiredMixin, CachedResponseMixin
 
 
 class AnalystRegistrationView(TemplateView):
@@ -57,6 +60,27 @@ class AnalystRegistrationView(TemplateView):
 class HomeView(AnalystRequiredMixin, TemplateView):
     template_name = 'core/home.html'
 
+    def _get_job_results(self, context: Dict, name: str, params: Dict):
+        """Submits or polls the analytics job of a form.
+
+        Args:
+            context: Context of the page.
+            name: Name of the form.
+            params: Cleaned data of the form with objects replaced by
+                their IDs and dates by their ISO format.
+
+        Returns:
+            Result of the job, or None while it's still running.
+        """
+        job = jobs.submit(name, params)
+        pending = job.status == jobs.PENDING
+        self.request.session[f'{name}_pending'] = pending
+        context[f'{name}_pending'] = pending
+        context[f'{name}_failed'] = job.status == jobs.FAILED
+        if pending:
+            context['analytics_pending'] = True
+        return job.result
+
     def _get_top_food_context(self, context: Dict, form_name: str):
         results = self.request.session.get('top_food_results', [])
         previous_data = self.request.session.get('top_food_form', {})
@@ -64,6 +88,11 @@ class HomeView(AnalystRequiredMixin, TemplateView):
             not self.request.POST
             or (self.request.POST and not form_name == 'top_food')
         ):
+            if self.request.session.get('top_food_pending'):
+                results = self._get_job_results(
+                    context, 'top_food', previous_data,
+                )
+                self.request.session['top_food_results'] = results
             context['top_food_form'] = forms.TopFoodChoiceForm(previous_data)
             context['top_food_results'] = results
             return
@@ -72,38 +101,6 @@ class HomeView(AnalystRequiredMixin, TemplateView):
             context['top_food_form'] = form
             context['top_food_results'] = {}
             return
-        queryset = models.Food.objects.all()
-        min_age = form.cleaned_data['min_age']
-        if min_age is not None:
-            threshold = date.today() - timedelta(days=365 * min_age)
-            queryset = queryset.filter(
-                meals__log__user__info__birth_date__lte=threshold
-            )
-        max_age = form.cleaned_data['max_age']
-        if max_age is not None:
-            threshold = date.today() - timedelta(days=365 * max_age)
-            queryset = queryset.filter(
-                meals__log__user__info__birth_date__gte=threshold
-            )
-        condition = form.cleaned_data['condition']
-        if condition is not None:
-            queryset = queryset.filter(meals__log__user__conditions=condition)
-        ailment = form.cleaned_data['ailment']
-        if ailment is not None:
-            queryset = queryset.filter(meals__log__ailments=ailment)
-        min_date = form.cleaned_data['min_date']
-        if min_date is not None:
-            queryset = queryset.filter(meals__log__date__gte=min_date)
-        max_date = form.cleaned_data['max_date']
-        if max_date is not None:
-            queryset = queryset.filter(meals__log__date__lte=max_date)
-        limit = form.cleaned_data.get('limit') or 5
-        queryset = queryset.values('name').annotate(
-            total=Count('meals'),
-        ).order_by('-total').filter(total__gte=1)
-        results = [result for result in queryset[:limit]]
-        context['top_food_results'] = results
-        context['top_food_form'] = form
         form_data = form.cleaned_data.copy()
         if form_data['ailment']:
             form_data['ailment'] = form_data['ailment'].pk
@@ -113,9 +110,11 @@ class HomeView(AnalystRequiredMixin, TemplateView):
             form_data['max_date'] = str(form_data['max_date'])
         if form_data['min_date']:
             form_data['min_date'] = str(form_data['min_date'])
+        results = self._get_job_results(context, 'top_food', form_data)
+        context['top_food_results'] = results
+        context['top_food_form'] = form
         self.request.session['top_food_results'] = results
         self.request.session['top_food_form'] = form_data
-        print(context['top_food_results'])
 
     def _get_top_ailment_context(self, context: Dict, form_name: str):
         results = self.request.session.get('top_ailment_results', [])
@@ -124,6 +123,11 @@ class HomeView(AnalystRequiredMixin, TemplateView):
             not self.request.POST
             or (self.request.POST and not form_name == 'top_ailment')
         ):
+            if self.request.session.get('top_ailment_pending'):
+                results = self._get_job_results(
+                    context, 'top_ailment', previous_data,
+                )
+                self.request.session['top_ailment_results'] = results
             context['top_ailment_form'] = forms.TopTemporaryAilmentForm(
                 previous_data,
             )
@@ -134,38 +138,6 @@ class HomeView(AnalystRequiredMixin, TemplateView):
             context['top_ailment_form'] = form
             context['top_ailment_results'] = {}
             return
-        queryset = models.Ailment.objects.all()
-        min_age = form.cleaned_data['min_age']
-        if min_age is not None:
-            threshold = date.today() - timedelta(days=365 * min_age)
-            queryset = queryset.filter(
-                logs__user__info__birth_date__lte=threshold
-            )
-        max_age = form.cleaned_data['max_age']
-        if max_age is not None:
-            threshold = date.today() - timedelta(days=365 * max_age)
-            queryset = queryset.filter(
-                logs__user__info__birth_date__gte=threshold
-            )
-        condition = form.cleaned_data['condition']
-        if condition is not None:
-            queryset = queryset.filter(logs__user__conditions=condition)
-        food = form.cleaned_data['food']
-        if food is not None:
-            queryset = queryset.filter(logs__meals__food=food)
-        min_date = form.cleaned_data['min_date']
-        if min_date is not None:
-            queryset = queryset.filter(logs__date__gte=min_date)
-        max_date = form.cleaned_data['max_date']
-        if max_date is not None:
-            queryset = queryset.filter(logs__date__lte=max_date)
-        limit = form.cleaned_data.get('limit') or 5
-        queryset = queryset.values('name').annotate(
-            total=Count('logs'),
-        ).order_by('-total').filter(total__gte=1)
-        results = [result for result in queryset[:limit]]
-        context['top_ailment_results'] = results
-        context['top_ailment_form'] = form
         form_data = form.cleaned_data.copy()
         if form_data['food']:
             form_data['food'] = form_data['food'].pk
@@ -175,9 +147,11 @@ class HomeView(AnalystRequiredMixin, TemplateView):
             form_data['max_date'] = str(form_data['max_date'])
         if form_data['min_date']:
             form_data['min_date'] = str(form_data['min_date'])
+        results = self._get_job_results(context, 'top_ailment', form_data)
+        context['top_ailment_results'] = results
+        context['top_ailment_form'] = form
         self.request.session['top_ailment_results'] = results
         self.request.session['top_ailment_form'] = form_data
-        print(context['top_ailment_results'])
 
     def _get_top_condition_context(self, context: Dict, form_name: str):
         results = self.request.session.get('top_condition_results', [])
@@ -186,6 +160,11 @@ class HomeView(AnalystRequiredMixin, TemplateView):
             not self.request.POST
             or (self.request.POST and not form_name == 'top_condition')
         ):
+            if self.request.session.get('top_condition_pending'):
+                results = self._get_job_results(
+                    context, 'top_condition', previous_data,
+                )
+                self.request.session['top_condition_results'] = results
             context['top_condition_form'] = forms.TopChronicConditionForm(
                 previous_data,
             )
@@ -196,37 +175,14 @@ class HomeView(AnalystRequiredMixin, TemplateView):
             context['top_condition_form'] = form
             context['top_condition_results'] = {}
             return
-        queryset = models.Condition.objects.all()
-        min_age = form.cleaned_data['min_age']
-        if min_age is not None:
-            threshold = date.today() - timedelta(days=365 * min_age)
-            queryset = queryset.filter(
-                users__info__birth_date__lte=threshold
-            )
-        max_age = form.cleaned_data['max_age']
-        if max_age is not None:
-            threshold = date.today() - timedelta(days=365 * max_age)
-            queryset = queryset.filter(
-                users__info__birth_date__gte=threshold
-            )
-        ailment = form.cleaned_data['ailment']
-        if ailment is not None:
-            queryset = queryset.filter(users__logs__ailments=ailment)
-        food = form.cleaned_data['food']
-        if food is not None:
-            queryset = queryset.filter(users__logs__meals__food=food)
-        limit = form.cleaned_data.get('limit') or 5
-        queryset = queryset.values('name').annotate(
-            total=Count('users'),
-        ).order_by('-total').filter(total__gte=1)
-        results = [result for result in queryset[:limit]]
-        context['top_condition_results'] = results
-        context['top_condition_form'] = form
         form_data = form.cleaned_data.copy()
         if form_data['food']:
             form_data['food'] = form_data['food'].pk
         if form_data['ailment']:
             form_data['ailment'] = form_data['ailment'].pk
+        results = self._get_job_results(context, 'top_condition', form_data)
+        context['top_condition_results'] = results
+        context['top_condition_form'] = form
         self.request.session['top_condition_results'] = results
         self.request.session['top_condition_form'] = form_data
 
@@ -237,6 +193,11 @@ class HomeView(AnalystRequiredMixin, TemplateView):
             not self.request.POST
             or (self.request.POST and not form_name == 'average_bmi')
         ):
+            if self.request.session.get('average_bmi_pending'):
+                result = self._get_job_results(
+                    context, 'average_bmi', previous_data,
+                )
+                self.request.session['average_bmi_result'] = result
             context['average_bmi_form'] = forms.AverageBMIForm(
                 previous_data,
             )
@@ -247,38 +208,6 @@ class HomeView(AnalystRequiredMixin, TemplateView):
             context['average_bmi_form'] = form
             context['average_bmi_result'] = {}
             return
-        queryset = models.User.objects.all()
-        min_age = form.cleaned_data['min_age']
-        if min_age is not None:
-            threshold = date.today() - timedelta(days=365 * min_age)
-            queryset = queryset.filter(
-                info__birth_date__lte=threshold
-            )
-        max_age = form.cleaned_data['max_age']
-        if max_age is not None:
-            threshold = date.today() - timedelta(days=365 * max_age)
-            queryset = queryset.filter(
-                info__birth_date__gte=threshold
-            )
-        ailment = form.cleaned_data['ailment']
-        if ailment is not None:
-            queryset = queryset.filter(logs__ailments=ailment)
-        food = form.cleaned_data['food']
-        if food is not None:
-            queryset = queryset.filter(logs__meals__food=food)
-        condition = form.cleaned_data['condition']
-        if condition is not None:
-            queryset = queryset.filter(logs__user__conditions=condition)
-        queryset = queryset.values('id').annotate(bmi=(
-            Cast(Value(703) * F('info__weight'), FloatField())
-            / Cast(F('info__height') * F('info__height'), FloatField())
-        )).aggregate(average_bmi=Avg('bmi'))
-        result = (
-            round(queryset['average_bmi'], 2)
-            if queryset['average_bmi'] else None
-        )
-        context['average_bmi_result'] = result
-        context['average_bmi_form'] = form
         form_data = form.cleaned_data.copy()
         if form_data['food']:
             form_data['food'] = form_data['food'].pk
@@ -286,6 +215,9 @@ class HomeView(AnalystRequiredMixin, TemplateView):
             form_data['ailment'] = form_data['ailment'].pk
         if form_data['condition']:
             form_data['condition'] = form_data['condition'].pk
+        result = self._get_job_results(context, 'average_bmi', form_data)
+        context['average_bmi_result'] = result
+        context['average_bmi_form'] = form
         self.request.session['average_bmi_result'] = result
         self.request.session['average_bmi_form'] = form_data
 
@@ -299,6 +231,7 @@ class HomeView(AnalystRequiredMixin, TemplateView):
         self._get_top_ailment_context(context, form_name)
         self._get_top_condition_context(context, form_name)
         self._get_average_bmi_context(context, form_name)
+        context['export_form'] = forms.AnalystExportForm()
         return context
 
     def post(self, request, *args, **kwargs):
@@ -306,10 +239,34 @@ class HomeView(AnalystRequiredMixin, TemplateView):
         return super().render_to_response(context)
 
 
+class AnalystExportView(AnalystRequiredMixin, View):
+    def get(self, request, *args, **kwargs):
+        """Streams the logs of the users matching the filters."""
+        form = forms.AnalystExportForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse(form.errors, status=400)
+        data = form.cleaned_data
+        users = rollups.matching_users(
+            data['min_age'], data['max_age'], data['condition'],
+            data['ailment'],
+        )
+        logs = export.filter_dates(
+            models.Log.objects.filter(user__in=users.values('pk')),
+            data['min_date'], data['max_date'],
+        )
+        return export.response(logs, data['output'], 'logs', replica=True)
+
+
 class UserView(APIView):
     def get(self, request, format=None):
-        serializer = serializers.UserSerializer(request.user)
-        return Response(serializer.data)
+        data = caching.cached(
+            'users/me', (
+                caching.user_namespace(request.user.pk),
+                caching.CONDITIONS,
+            ),
+            lambda: serializers.UserSerializer(request.user).data,
+        )
+        return Response(data)
 
     def put(self, request, format=None):
         serializer = serializers.UserUpdateSerializer(
@@ -330,33 +287,98 @@ class UserView(APIView):
         return Response(serializer.data)
 
 
+class SyncView(APIView):
+    def get(self, request, format=None):
+        """Lists the user's logs, meals and tickets changed since a cursor.
+
+        The ``since`` query parameter takes the cursor returned by the
+        previous sync. Deleted objects are listed by their IDs.
+        """
+        try:
+            changes = sync.changes(
+                request.user, request.query_params.get('since'),
+            )
+        except sync.SyncError as error:
+            raise ValidationError({'since': [str(error)]})
+        return Response(changes)
+
+
+class ExportView(APIView):
+    def get(self, request, format=None):
+        """Streams all the logs of the user with their meals."""
+        form = forms.ExportForm(request.query_params)
+        if not form.is_valid():
+            raise ValidationError(form.errors)
+        data = form.cleaned_data
+        logs = export.filter_dates(
+            models.Log.objects.filter(user=request.user),
+            data['min_date'], data['max_date'],
+        )
+        return export.response(logs, data['output'], 'logs')
+
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser | HasMetricsToken]
+
+    def get(self, request, format=None):
+        """Request metrics of this worker process in the Prometheus format."""
+        return HttpResponse(
+            metrics.registry.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
+
+
 class ConditionViewSet(
-    GenericViewSet, mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+    CachedResponseMixin, GenericViewSet,
+    mixins.CreateModelMixin, mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
 ):
     """API Views related with long term conditions."""
     queryset = models.Condition.objects.all().order_by('name')
     serializer_class = serializers.ConditionSerializer
     filterset_class = filters.ConditionFilter
+    cache_namespaces = (caching.CONDITIONS,)
 
 
 class AilmentViewSet(
-    GenericViewSet, mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+    CachedResponseMixin, GenericViewSet,
+    mixins.CreateModelMixin, mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
 ):
     """API Views related to short term ailments."""
     queryset = models.Ailment.objects.all().order_by('name')
     serializer_class = serializers.AilmentSerializer
+    cache_namespaces = (caching.AILMENTS,)
 
 
 class FoodViewSet(
-    GenericViewSet, mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+    CachedResponseMixin, GenericViewSet,
+    mixins.CreateModelMixin, mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
 ):
     """API Views related with food objects."""
     queryset = models.Food.objects.all().order_by('name')
     serializer_class = serializers.FoodSerializer
     filterset_class = filters.FoodFilter
+    cache_namespaces = (caching.FOODS,)
+
+    @action(['GET'], False, url_name='search')
+    def search(self, request):
+        """View that searches foods by name.
+
+        Takes the partial name in the ``q`` query parameter and returns
+        at most ``limit`` foods ordered by relevance.
+        """
+        serializer = serializers.FoodSearchSerializer(
+            data=request.query_params,
+        )
+        serializer.is_valid(raise_exception=True)
+        foods = search.search_foods(
+            serializer.validated_data['q'],
+            serializer.validated_data['limit'],
+        )
+        serializer = serializers.FoodSerializer(foods, many=True)
+        return Response(serializer.data)
 
 
 class MealViewSet(ModelViewSet):
@@ -364,6 +386,8 @@ class MealViewSet(ModelViewSet):
     queryset = models.Meal.objects.all().order_by('-log__date')
     serializer_class = serializers.MealSerializer
     filterset_class = filters.MealFilter
+    pagination_class = DatePagination
+    keyset_fields = ('log__date', 'id')
 
     def get_serializer_class(self):
         if self.action in ('retrieve', 'list'):
@@ -376,7 +400,30 @@ class MealViewSet(ModelViewSet):
         Returns:
             Queryset of all meals filtered to the current user.
         """
-        return self.queryset.filter(log__user=self.request.user)
+        queryset = self.queryset.filter(log__user=self.request.user)
+        if self.action in ('retrieve', 'list'):
+            queryset = queryset.select_related('log', 'food')
+        return queryset
+
+    @action(['POST'], False, serializer_class=serializers.BulkMealSerializer)
+    def bulk(self, request):
+        """View that adds many meals at once.
+
+        Meals can belong to any of the user's logs. Responds with the
+        created meals and the updated totals of their logs.
+        """
+        serializer = serializers.BulkMealSerializer(
+            data=request.data, context=self.get_serializer_context(),
+        )
+        serializer.is_valid(raise_exception=True)
+        meals = serializer.save()
+        logs = models.Log.objects.filter(
+            pk__in={meal.log_id for meal in meals},
+        ).order_by('date')
+        return Response({
+            'meals': serializers.MealSerializer(meals, many=True).data,
+            'logs': serializers.LogTotalsSerializer(logs, many=True).data,
+        }, status=status.HTTP_201_CREATED)
 
 
 class TicketViewSet(GenericViewSet, mixins.CreateModelMixin):
@@ -403,6 +450,8 @@ class LogViewSet(ModelViewSet):
     queryset = models.Log.objects.all()
     serializer_class = serializers.LogSerializer
     filterset_class = filters.LogFilter
+    pagination_class = DatePagination
+    keyset_fields = ('date', 'id')
 
     def get_queryset(self):
         """Gets the queryset for the views.
@@ -410,7 +459,10 @@ class LogViewSet(ModelViewSet):
         Returns:
             Queryset of all logs filtered to the current user.
         """
-        return self.queryset.filter(user=self.request.user)
+        queryset = self.queryset.filter(user=self.request.user)
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related('meals__food', 'ailments')
+        return queryset
 
     def perform_create(self, serializer):
         serializer.validated_data['user'] = self.request.user
@@ -438,7 +490,7 @@ class LogViewSet(ModelViewSet):
 
     @action(
         ['GET', 'POST'], True, url_name='meal-list',
-        serializer_class=serializers.LogMealSerializer,
+        serializer_class=serializers.LogMealCreateSerializer,
     )
     def meals(self, request, pk=None):
         """View that lists and adds meals for a log.
@@ -449,11 +501,12 @@ class LogViewSet(ModelViewSet):
         log = self.get_object()
         # Add a meal if it's a POST request.
         if request.method == 'POST':
-            serializer = serializers.LogMealSerializer(data=request.data)
+            serializer = serializers.LogMealCreateSerializer(
+                data=request.data,
+            )
             serializer.is_valid(raise_exception=True)
-            serializer.validated_data['log'] = log
-            meal = serializer.save()
-            log.meals.add(meal)
+            meal = serializer.save(log=log)
+            serializer = serializers.LogMealSerializer(meal)
             return Response(serializer.data)
         # List the current meals if it's a get request.
         if request.method == 'GET':